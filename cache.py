@@ -0,0 +1,654 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import time
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import numpy
+
+from retrieval import Throughput
+from timeseries import TimeSeries
+
+
+
+def toMilliseconds(dt):
+    """Convert a (UTC) datetime object to milliseconds since epoch."""
+    return int(numpy.datetime64(dt, 'ms').astype(numpy.int64))
+
+
+
+def toDatetime(milliseconds):
+    """Convert milliseconds since epoch to a (UTC) datetime object."""
+    return numpy.datetime64(int(milliseconds), 'ms').astype(object)
+
+
+
+class ObservationCache:
+    """
+    Local SQLite store of retrieved observations, keyed by server URL,
+    offering and observed property.
+
+    The store also keeps track of the time intervals which have already
+    been retrieved for each time series, so that a new request only has to
+    retrieve the missing intervals (see getMissingIntervals). It also keeps
+    the GetResultTemplate responses of each time series, which only have to
+    be retrieved once (see getResultTemplate), or the time of their
+    failure (see isResultTemplateUnavailable), the data availability of
+    each offering (see getAvailability), the throughput measured for each
+    offering (see getThroughput) and the time series retrievals which have
+    been interrupted (see getInterruptedRetrieval).
+
+    Times are stored as UTC milliseconds since epoch. A new connection is
+    opened for each operation, so that the cache can be used from any
+    thread.
+
+    argument:
+        >>> path:
+            path (string) of the SQLite database file, which is created if
+            needed.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        connection = self._connect()
+        try:
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS series (
+                    id INTEGER PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    offering TEXT NOT NULL,
+                    property TEXT NOT NULL,
+                    unit TEXT,
+                    UNIQUE (url, offering, property));
+                CREATE TABLE IF NOT EXISTS observations (
+                    series INTEGER NOT NULL,
+                    time INTEGER NOT NULL,
+                    value REAL,
+                    PRIMARY KEY (series, time));
+                CREATE TABLE IF NOT EXISTS coverage (
+                    series INTEGER NOT NULL,
+                    start INTEGER NOT NULL,
+                    end INTEGER NOT NULL);
+                CREATE TABLE IF NOT EXISTS result_templates (
+                    url TEXT NOT NULL,
+                    offering TEXT NOT NULL,
+                    property TEXT NOT NULL,
+                    content BLOB NOT NULL,
+                    PRIMARY KEY (url, offering, property));
+                CREATE TABLE IF NOT EXISTS result_template_failures (
+                    url TEXT NOT NULL,
+                    offering TEXT NOT NULL,
+                    property TEXT NOT NULL,
+                    failed REAL NOT NULL,
+                    PRIMARY KEY (url, offering, property));
+                CREATE TABLE IF NOT EXISTS availability (
+                    url TEXT NOT NULL,
+                    offering TEXT NOT NULL,
+                    property TEXT NOT NULL,
+                    start INTEGER NOT NULL,
+                    end INTEGER NOT NULL,
+                    count INTEGER,
+                    PRIMARY KEY (url, offering, property));
+                CREATE TABLE IF NOT EXISTS availability_requests (
+                    url TEXT NOT NULL,
+                    offering TEXT NOT NULL,
+                    fetched REAL NOT NULL,
+                    PRIMARY KEY (url, offering));
+                CREATE TABLE IF NOT EXISTS throughput (
+                    url TEXT NOT NULL,
+                    offering TEXT NOT NULL,
+                    latency REAL NOT NULL,
+                    rate REAL NOT NULL,
+                    density REAL,
+                    samples INTEGER NOT NULL,
+                    PRIMARY KEY (url, offering));
+                CREATE TABLE IF NOT EXISTS interrupted_retrievals (
+                    url TEXT NOT NULL,
+                    offering TEXT NOT NULL,
+                    property TEXT NOT NULL,
+                    start INTEGER NOT NULL,
+                    end INTEGER NOT NULL,
+                    PRIMARY KEY (url, offering, property));
+                ''')
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _getSeriesId(self, connection, url, offering, prop, create=False):
+        row = connection.execute(
+            'SELECT id FROM series WHERE url=? AND offering=? AND property=?',
+            (url, offering, prop)).fetchone()
+        if row is not None:
+            return row[0]
+        if not create:
+            return None
+        cursor = connection.execute(
+            'INSERT INTO series (url, offering, property) VALUES (?, ?, ?)',
+            (url, offering, prop))
+        return cursor.lastrowid
+
+    def getCoverage(self, url, offering, prop):
+        """
+        Return the sorted list of (start, end) intervals, in milliseconds,
+        already retrieved for a time series.
+        """
+
+        connection = self._connect()
+        try:
+            series = self._getSeriesId(connection, url, offering, prop)
+            if series is None:
+                return []
+            return connection.execute(
+                'SELECT start, end FROM coverage WHERE series=? '
+                'ORDER BY start', (series,)).fetchall()
+        finally:
+            connection.close()
+
+    def getMissingIntervals(self, url, offering, prop, starting_time,
+                            ending_time):
+        """
+        Return the parts of a time period which have not been retrieved
+        yet for a time series.
+
+        arguments:
+            >>> url:
+                GetObservation URL of the server (string).
+            >>> offering:
+                offering id (string).
+            >>> prop:
+                observed property (string).
+            >>> starting_time:
+                datetime object.
+            >>> ending_time:
+                datetime object.
+
+        return value:
+            >>> gaps:
+                list of (starting_time, ending_time) datetime objects tuples,
+                in time order.
+        """
+
+        start = toMilliseconds(starting_time)
+        end = toMilliseconds(ending_time)
+        gaps = []
+        for covered_start, covered_end in self.getCoverage(url, offering,
+                                                           prop):
+            if covered_end < start:
+                continue
+            if covered_start > end:
+                break
+            if covered_start > start:
+                gaps.append((start, covered_start))
+            start = max(start, covered_end)
+        if start < end:
+            gaps.append((start, end))
+
+        return [(toDatetime(s), toDatetime(e)) for s, e in gaps]
+
+    def getCombinedMissingIntervals(self, url, offering, props,
+                                    starting_time, ending_time):
+        """
+        Return the parts of a time period which have not been retrieved
+        yet for at least one of several observed properties of an offering
+        (see getMissingIntervals), so that they can be retrieved together.
+        """
+
+        gaps = []
+        for prop in props:
+            gaps.extend(self.getMissingIntervals(url, offering, prop,
+                                                 starting_time, ending_time))
+        gaps.sort()
+        merged = []
+        for start, end in gaps:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+
+        return [tuple(gap) for gap in merged]
+
+    def store(self, url, series, starting_time, ending_time):
+        """
+        Store the observations retrieved for a time period, and mark this
+        period as retrieved. Times later than now are not marked as
+        retrieved, as the server may still receive observations for them.
+
+        arguments:
+            >>> url:
+                GetObservation URL of the server (string).
+            >>> series:
+                timeseries.TimeSeries object, whose offering and observed
+                property complete the time series key.
+            >>> starting_time, ending_time:
+                requested time period (datetime objects).
+        """
+
+        offering = series.offering
+        prop = series.observed_property
+        unit = series.unit
+        start = toMilliseconds(starting_time)
+        end = min(toMilliseconds(ending_time),
+                  toMilliseconds(datetime.datetime.utcnow()))
+
+        connection = self._connect()
+        try:
+            series_id = self._getSeriesId(connection, url, offering, prop,
+                                          create=True)
+            if unit:
+                connection.execute('UPDATE series SET unit=? WHERE id=?',
+                                   (unit, series_id))
+            connection.executemany(
+                'INSERT OR REPLACE INTO observations (series, time, value) '
+                'VALUES (?, ?, ?)',
+                zip([series_id] * len(series),
+                    series.times.astype(numpy.int64).tolist(),
+                    series.values.tolist()))
+
+            if start < end:
+                # Merge the new interval with the intervals it overlaps.
+                intervals = connection.execute(
+                    'SELECT start, end FROM coverage WHERE series=?',
+                    (series_id,)).fetchall()
+                intervals.append((start, end))
+                intervals.sort()
+                merged = [list(intervals[0])]
+                for s, e in intervals[1:]:
+                    if s <= merged[-1][1]:
+                        merged[-1][1] = max(merged[-1][1], e)
+                    else:
+                        merged.append([s, e])
+                connection.execute('DELETE FROM coverage WHERE series=?',
+                                   (series_id,))
+                connection.executemany(
+                    'INSERT INTO coverage (series, start, end) '
+                    'VALUES (?, ?, ?)',
+                    [(series_id, s, e) for s, e in merged])
+            connection.commit()
+        finally:
+            connection.close()
+
+    def read(self, url, offering, prop, starting_time, ending_time):
+        """
+        Read the stored observations of a time series for a time period.
+
+        return value:
+            >>> series:
+                timeseries.TimeSeries object, in time order.
+        """
+
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                'SELECT id, unit FROM series '
+                'WHERE url=? AND offering=? AND property=?',
+                (url, offering, prop)).fetchone()
+            if row is None:
+                rows = []
+                unit = ''
+            else:
+                rows = connection.execute(
+                    'SELECT time, value FROM observations '
+                    'WHERE series=? AND time BETWEEN ? AND ? ORDER BY time',
+                    (row[0], toMilliseconds(starting_time),
+                     toMilliseconds(ending_time))).fetchall()
+                unit = row[1] or ''
+        finally:
+            connection.close()
+
+        times = numpy.array([r[0] for r in rows], dtype=numpy.int64)
+        values = numpy.array([r[1] for r in rows], dtype=numpy.float64)
+
+        return TimeSeries(times.astype('datetime64[ms]'), values, unit=unit,
+                          offering=offering, observed_property=prop)
+
+    def getResultTemplate(self, url, offering, prop):
+        """
+        Return the stored GetResultTemplate response (string) of a time
+        series, or None.
+        """
+
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                'SELECT content FROM result_templates '
+                'WHERE url=? AND offering=? AND property=?',
+                (url, offering, prop)).fetchone()
+        finally:
+            connection.close()
+
+        return bytes(row[0]) if row is not None else None
+
+    def storeResultTemplate(self, url, offering, prop, content):
+        """Store the GetResultTemplate response (string) of a time series."""
+
+        connection = self._connect()
+        try:
+            connection.execute(
+                'INSERT OR REPLACE INTO result_templates '
+                '(url, offering, property, content) VALUES (?, ?, ?, ?)',
+                (url, offering, prop, sqlite3.Binary(content)))
+            connection.execute(
+                'DELETE FROM result_template_failures '
+                'WHERE url=? AND offering=? AND property=?',
+                (url, offering, prop))
+            connection.commit()
+        finally:
+            connection.close()
+
+    def isResultTemplateUnavailable(self, url, offering, prop, ttl=86400):
+        """
+        Return True if the GetResultTemplate request of a time series has
+        failed less than ttl seconds ago (see storeResultTemplateFailure).
+        """
+
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                'SELECT failed FROM result_template_failures '
+                'WHERE url=? AND offering=? AND property=?',
+                (url, offering, prop)).fetchone()
+        finally:
+            connection.close()
+
+        return row is not None and time.time() - row[0] < ttl
+
+    def storeResultTemplateFailure(self, url, offering, prop):
+        """
+        Record that the result template of a time series could not be
+        retrieved, so that it is not requested again for a while.
+        """
+
+        connection = self._connect()
+        try:
+            connection.execute(
+                'INSERT OR REPLACE INTO result_template_failures '
+                '(url, offering, property, failed) VALUES (?, ?, ?, ?)',
+                (url, offering, prop, time.time()))
+            connection.commit()
+        finally:
+            connection.close()
+
+    def getAvailability(self, url, offerings, ttl=3600):
+        """
+        Return the stored data availability of offerings, for those whose
+        availability has been retrieved less than ttl seconds ago.
+
+        arguments:
+            >>> url:
+                GetObservation URL of the server (string).
+            >>> offerings:
+                list of offering ids (strings).
+            >>> ttl:
+                time (seconds) during which a retrieved availability is used.
+
+        return values:
+            >>> availability:
+                dict mapping (offering, observed property) tuples to
+                (starting_time, ending_time, count) tuples, with datetime
+                objects and a number of observations or None.
+            >>> missing:
+                list of the offerings whose availability has to be
+                retrieved, in the order of offerings.
+        """
+
+        availability = {}
+        missing = []
+        oldest = time.time() - ttl
+        connection = self._connect()
+        try:
+            for offering in offerings:
+                row = connection.execute(
+                    'SELECT fetched FROM availability_requests '
+                    'WHERE url=? AND offering=?', (url, offering)).fetchone()
+                if row is None or row[0] < oldest:
+                    missing.append(offering)
+                    continue
+                for prop, start, end, count in connection.execute(
+                        'SELECT property, start, end, count FROM availability '
+                        'WHERE url=? AND offering=?', (url, offering)):
+                    availability[(offering, prop)] = (
+                        toDatetime(start), toDatetime(end), count)
+        finally:
+            connection.close()
+
+        return availability, missing
+
+    def storeAvailability(self, url, offerings, availability):
+        """
+        Store the data availability retrieved for offerings, replacing the
+        one stored before.
+
+        arguments:
+            >>> url:
+                GetObservation URL of the server (string).
+            >>> offerings:
+                list of the offering ids (strings) whose availability has
+                been retrieved, including those without any observation.
+            >>> availability:
+                dict of their time series availability (see
+                getAvailability).
+        """
+
+        connection = self._connect()
+        try:
+            for offering in offerings:
+                connection.execute(
+                    'DELETE FROM availability WHERE url=? AND offering=?',
+                    (url, offering))
+                connection.execute(
+                    'INSERT OR REPLACE INTO availability_requests '
+                    '(url, offering, fetched) VALUES (?, ?, ?)',
+                    (url, offering, time.time()))
+            connection.executemany(
+                'INSERT OR REPLACE INTO availability '
+                '(url, offering, property, start, end, count) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(url, offering, prop, toMilliseconds(start),
+                  toMilliseconds(end), count)
+                 for (offering, prop), (start, end, count)
+                 in availability.items()])
+            connection.commit()
+        finally:
+            connection.close()
+
+    def getThroughput(self, url, offering):
+        """
+        Return the stored throughput (retrieval.Throughput object) of the
+        requests sent to a server for an offering, or None.
+        """
+
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                'SELECT latency, rate, density, samples FROM throughput '
+                'WHERE url=? AND offering=?', (url, offering)).fetchone()
+        finally:
+            connection.close()
+
+        return Throughput(*row) if row is not None else None
+
+    def storeThroughput(self, url, offering, throughput):
+        """Store the throughput (retrieval.Throughput object) of an offering."""
+
+        connection = self._connect()
+        try:
+            connection.execute(
+                'INSERT OR REPLACE INTO throughput '
+                '(url, offering, latency, rate, density, samples) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (url, offering, throughput.latency, throughput.rate,
+                 throughput.density, throughput.samples))
+            connection.commit()
+        finally:
+            connection.close()
+
+    def getInterruptedRetrieval(self, url, offering, prop):
+        """
+        Return the (starting_time, ending_time) time period of the last
+        interrupted retrieval of a time series, or None.
+        """
+
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                'SELECT start, end FROM interrupted_retrievals '
+                'WHERE url=? AND offering=? AND property=?',
+                (url, offering, prop)).fetchone()
+        finally:
+            connection.close()
+
+        if row is None:
+            return None
+        return toDatetime(row[0]), toDatetime(row[1])
+
+    def storeInterruptedRetrieval(self, url, offering, props, starting_time,
+                                  ending_time):
+        """
+        Record that the retrieval of some observed properties of an
+        offering for a time period has been interrupted, so that it can be
+        resumed later.
+        """
+
+        connection = self._connect()
+        try:
+            connection.executemany(
+                'INSERT OR REPLACE INTO interrupted_retrievals '
+                '(url, offering, property, start, end) VALUES (?, ?, ?, ?, ?)',
+                [(url, offering, prop, toMilliseconds(starting_time),
+                  toMilliseconds(ending_time)) for prop in props])
+            connection.commit()
+        finally:
+            connection.close()
+
+    def clearInterruptedRetrieval(self, url, offering, props):
+        """Forget the interrupted retrievals of some observed properties."""
+
+        connection = self._connect()
+        try:
+            connection.executemany(
+                'DELETE FROM interrupted_retrievals '
+                'WHERE url=? AND offering=? AND property=?',
+                [(url, offering, prop) for prop in props])
+            connection.commit()
+        finally:
+            connection.close()
+
+
+
+class CapabilitiesCache:
+    """
+    On-disk store of GetCapabilities responses, and of the objects derived
+    from them by the plugin, so that a known server can be reopened
+    without downloading and parsing its capabilities again.
+
+    For each capabilities URL, three files are stored in the cache folder:
+    the response itself (.xml), its HTTP validators and retrieval time
+    (.json), and the derived objects (.pickle).
+
+    argument:
+        >>> folder:
+            path (string) of the cache folder, which is created if needed.
+
+    """
+
+    # Changed whenever the pickled objects change, so that older entries
+    # are ignored.
+    FORMAT_VERSION = 2
+
+    def __init__(self, folder):
+        self.folder = folder
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    def _path(self, url, extension):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, key + extension)
+
+    def load(self, url):
+        """
+        Return the cached entry of a capabilities URL, or None.
+
+        return value:
+            >>> entry:
+                dict with 'content' (response, string), 'state' (derived
+                objects), 'etag' and 'last_modified' (response headers or
+                None) and 'fetched' (time.time() value of the last
+                retrieval or revalidation) keys.
+        """
+
+        try:
+            with open(self._path(url, '.json')) as f:
+                entry = json.load(f)
+            if entry.get('format') != self.FORMAT_VERSION:
+                return None
+            with open(self._path(url, '.pickle'), 'rb') as f:
+                entry['state'] = pickle.load(f)
+            with open(self._path(url, '.xml'), 'rb') as f:
+                entry['content'] = f.read()
+        except Exception:
+            # Missing, partial or unreadable entry.
+            return None
+
+        return entry
+
+    def save(self, url, content, headers, state):
+        """
+        Store a GetCapabilities response and its derived objects.
+
+        arguments:
+            >>> url:
+                capabilities URL (string).
+            >>> content:
+                response content (string).
+            >>> headers:
+                response headers (dict-like).
+            >>> state:
+                picklable objects derived from the response.
+        """
+
+        with open(self._path(url, '.xml'), 'wb') as f:
+            f.write(content)
+        with open(self._path(url, '.pickle'), 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        self._writeValidators(url, {
+            'format': self.FORMAT_VERSION,
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+        })
+
+    def touch(self, url, entry):
+        """Record that a cached entry has just been revalidated."""
+
+        validators = dict((k, v) for k, v in entry.items()
+                          if k not in ('state', 'content'))
+        self._writeValidators(url, validators)
+
+    def _writeValidators(self, url, validators):
+        validators['fetched'] = time.time()
+        with open(self._path(url, '.json'), 'w') as f:
+            json.dump(validators, f)
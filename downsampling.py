@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+import numpy
+
+
+# Maximum number of visible points per pixel of plot width which are drawn
+# as they are. Denser curves are downsampled to 2 points per pixel.
+FULL_RESOLUTION_POINTS_PER_PIXEL = 4
+
+
+
+def getVisibleRange(x, x_min, x_max):
+    """
+    Return the (start, stop) index range of the points of a sorted x array
+    which lie between x_min and x_max, along with the closest point outside
+    on each side, so that lines leaving the visible area are still drawn.
+    """
+
+    start = max(numpy.searchsorted(x, x_min, side='left') - 1, 0)
+    stop = min(numpy.searchsorted(x, x_max, side='right') + 1, len(x))
+
+    return start, stop
+
+
+
+def minMaxDownsample(x, y, x_min, x_max, pixels):
+    """
+    Downsample the visible part of a curve for drawing.
+
+    The visible x range is split into one bucket per pixel and each
+    non-empty bucket is replaced by two points, its minimum and its
+    maximum, at their own x positions and in x order (as M4 aggregation
+    does), so that peaks and the direction of rising or falling edges are
+    kept at any zoom level. When there are no
+    more than FULL_RESOLUTION_POINTS_PER_PIXEL visible points per pixel,
+    they are returned as they are.
+
+    arguments:
+        >>> x:
+            sorted float64 numpy array.
+        >>> y:
+            float64 numpy array. NaN values are ignored, unless a bucket
+            only contains NaN values.
+        >>> x_min, x_max:
+            visible x range (floats).
+        >>> pixels:
+            plot width in pixels (number).
+
+    return values:
+        >>> x_drawn:
+            float64 numpy array.
+        >>> y_drawn:
+            float64 numpy array.
+    """
+
+    start, stop = getVisibleRange(x, x_min, x_max)
+    x = x[start:stop]
+    y = y[start:stop]
+    buckets = max(int(pixels), 1)
+    if len(x) <= FULL_RESOLUTION_POINTS_PER_PIXEL * buckets:
+        return x, y
+
+    # The closest points outside the visible range go to the first and last
+    # buckets.
+    edges = numpy.searchsorted(x, numpy.linspace(max(x[0], x_min),
+                                                 min(x[-1], x_max),
+                                                 buckets + 1))
+    edges[0] = 0
+    edges[-1] = len(x)
+    starts = edges[:-1]
+    stops = edges[1:]
+    filled = stops > starts
+    starts = starts[filled]
+    stops = stops[filled]
+
+    # Segments of reduceat go from one start to the next one, that is
+    # exactly the non-empty buckets.
+    y_minimum = numpy.fmin.reduceat(y, starts)
+    y_maximum = numpy.fmax.reduceat(y, starts)
+    buckets = numpy.repeat(numpy.arange(len(starts)), stops - starts)
+    first_minimum = _findFirst(y == y_minimum[buckets], starts)
+    first_maximum = _findFirst(y == y_maximum[buckets], starts)
+    first = numpy.minimum(first_minimum, first_maximum)
+    last = numpy.maximum(first_minimum, first_maximum)
+
+    x_drawn = numpy.empty(2 * len(starts))
+    y_drawn = numpy.empty(2 * len(starts))
+    x_drawn[0::2] = x[first]
+    x_drawn[1::2] = x[last]
+    y_drawn[0::2] = y[first]
+    y_drawn[1::2] = y[last]
+
+    return x_drawn, y_drawn
+
+
+
+def _findFirst(found, starts):
+    # Index of the first True value of each bucket, or its start if there is
+    # none (buckets of NaN values only).
+    indices = numpy.where(found, numpy.arange(len(found)), len(found))
+    first = numpy.minimum.reduceat(indices, starts)
+    return numpy.where(first < len(found), first, starts)
@@ -9,35 +9,55 @@
 # =============================================================================
 
 
-from PyQt4 import QtGui
-import csv
+import os
+import re
+
+import numpy
+from matplotlib import dates as mdates
 
 from qgis.core import *
 
-from ui.gui import PlotSeriesWindow
+from ui.gui import PlotSeriesWindow, TimeSeriesTableWindow
+from settings import readSetting
+from writers import getSeriesWriter
 
 
 
 
-def plotSeries(dates, values, observedproperty, unit):
+def toPlotDates(times):
+    """
+    Convert a 'datetime64[ms]' numpy array to matplotlib dates (float days 
+    since matplotlib epoch) at once, instead of one datetime at a time.
+    """
+    
+    if hasattr(mdates, 'get_epoch'):
+        epoch = numpy.datetime64(mdates.get_epoch(), 'ms')
+        offset = 0.0
+    else:
+        # Older matplotlib versions count days from 0001-01-01 (day 1).
+        epoch = numpy.datetime64('1970-01-01', 'ms')
+        offset = mdates.date2num(epoch.astype(object))
+    
+    return (times - epoch).astype(numpy.int64) / 86400000.0 + offset
+    
+    
+    
+def plotSeries(series):
     """
     Plot time series.
     
-    arguments: 
-        >>> dates:
-            list of 'datetime.datetime' objects containing entries of 
-            time series date and time column.
-        >>> values: 
-            list of float objects containing entries of time series value 
-            column.
-        >>> observedproperty:
-            (string).
-        >>> unit: 
-            unit of measured observed property (string).     
+    argument: 
+        >>> series:
+            timeseries.TimeSeries object.
+    
+    return value:
+        >>> plot_window:
+            ui.gui.PlotSeriesWindow object, or None if time series is 
+            empty.
     
     """
     
-    if dates == [] or values == []:
+    if series.isEmpty():
         pass
     
     else:
@@ -47,90 +67,205 @@ def plotSeries(dates, values, observedproperty, unit):
         plot_window = PlotSeriesWindow()
         
         ax = plot_window.figure.add_subplot(1,1,1)
-        ax.plot(dates, values)
+        ax.xaxis_date()
+        # Dense time series are downsampled to the plot width, and 
+        # resampled from full resolution data on zoom and pan.
+        plot_window.plotCurve(ax, toPlotDates(series.times), series.values, 
+                              downsampling=readSetting('plot_downsampling'))
         ax.grid()
-        ax.set_ylabel(observedproperty + "(" + unit +")")
+        ax.set_ylabel(series.getLabel())
         
         plot_window.show()
+        return plot_window
     
 
 
-def arraySeries(dates, values, observedproperty, unit):
+def plotMultipleSeries(series_list, shared_axes=True):
     """
-    Display time series in tabular format.
+    Plot several time series together, e.g. the same observed property at 
+    several stations, with a legend giving their offering.
     
     arguments: 
-        >>> dates:
-            list of 'datetime.datetime' objects containing entries of 
-            time series date and time column.
-        >>> values: 
-            list of float objects containing entries of time series value 
-            column.
-        >>> observedproperty:
-            (string).
-        >>> unit: 
-            unit of measured observed property (string).     
+        >>> series_list:
+            list of timeseries.TimeSeries objects.
+        >>> shared_axes:
+            if True, time series are plotted on the same axes. Otherwise, 
+            e.g. for several observed properties with different units, each 
+            time series is plotted on its own axes, one above the other, 
+            sharing the time axis.
     
     """
     
-    if dates == [] or values == []:
+    series_list = [series for series in series_list if not series.isEmpty()]
+    if series_list == []:
         pass
     
     else:
-        global view
-        view = QtGui.QTableView()
-    
-        model = QtGui.QStandardItemModel(len(values), 2)
-        model.setHorizontalHeaderItem(0, QtGui.QStandardItem("Date"))
-        model.setHorizontalHeaderItem(
-            1, QtGui.QStandardItem(observedproperty + "(" + unit +")"))
+        global  plot_window
+        plot_window = PlotSeriesWindow()
+        
+        downsampling = readSetting('plot_downsampling')
+        if shared_axes:
+            ax = plot_window.figure.add_subplot(1,1,1)
+            ax.xaxis_date()
+            groups = [(ax, series_list)]
+        else:
+            groups = []
+            for i, series in enumerate(series_list):
+                ax = plot_window.figure.add_subplot(
+                    len(series_list), 1, i + 1, 
+                    sharex=groups[0][0] if groups else None)
+                ax.xaxis_date()
+                groups.append((ax, [series]))
+        
+        names = dict(zip(map(id, series_list), getSeriesNames(series_list)))
+        x_min = min(toPlotDates(s.times[:1])[0] for s in series_list)
+        x_max = max(toPlotDates(s.times[-1:])[0] for s in series_list)
+        for ax, group in groups:
+            for series in group:
+                plot_window.plotCurve(ax, toPlotDates(series.times), 
+                                      series.values, 
+                                      downsampling=downsampling, 
+                                      label=names[id(series)])
+            # Show every curve, which also resamples them for this x range.
+            ax.set_xlim(x_min, x_max)
+            ax.relim()
+            ax.autoscale_view(scalex=False)
+            ax.grid()
+            labels = set(series.getLabel() for series in group)
+            if len(group) > 1:
+                ax.legend(loc='best', fontsize='small')
+            if len(labels) == 1:
+                ax.set_ylabel(labels.pop())
         
-        for i in range(len(values)):
-            model.setItem(i, 0, QtGui.QStandardItem(str(dates[i])))
-            model.setItem(i, 1, QtGui.QStandardItem(str(values[i])))
-            
-        view.setModel(model)
-        view.setWindowTitle('Time series table view')
+        plot_window.show()
+    
+
+
+def arraySeries(series):
+    """
+    Display time series in tabular format.
+    
+    argument: 
+        >>> series:
+            timeseries.TimeSeries object.
+    
+    """
+    
+    if series.isEmpty():
+        pass
+    
+    else:
+        global view
+        # Use TimeSeriesTableWindow() imported from gui module 
+        # located in "ui" subdirectory. Its table model reads the time 
+        # series arrays directly, only for displayed rows.
+        view = TimeSeriesTableWindow(series)
         view.show()
     
 
 
-def exportSeries(dates, values, observedproperty, unit, path):
+def exportSeries(series, path):
     """
-    Export time series as CSV file.
+    Export time series as a CSV, Parquet, Arrow or NetCDF file, depending 
+    on path extension (see writers.getSeriesWriter).
     
     arguments: 
-        >>> dates:
-            list of 'datetime.datetime' objects containing entries of 
-            time series date and time column.
-        >>> values: 
-            list of float objects containing entries of time series value 
-            column.
-        >>> observedproperty:
-            (string).
-        >>> unit: 
-            unit of measured observed property (string).  
+        >>> series:
+            timeseries.TimeSeries object.
         >>> path: 
-            complete path (folder + file name) where the CSV file will be
+            complete path (folder + file name) where the file will be
             saved (unicode).  
     
     """
-    if dates == [] or values == []:
+    if series.isEmpty():
         pass
 
     else:
-        rows = zip(dates, values)
         try:
-            with open(path, 'wb') as f:
-                writer = csv.writer(f)
-                writer.writerow(["Date", observedproperty + "(" + unit +")"])
-                for row in rows:
-                    writer.writerow(row)
+            writer = getSeriesWriter(
+                path, compression=readSetting('export_compression'))
+            try:
+                writer.write(series)
+            finally:
+                writer.close()
 
         except IOError:
             pass
-    
 
 
+
+def getSeriesNames(series_list):
+    """
+    Return a distinct name (string) for each time series of a list: its 
+    offering, followed by its observed property when several time series 
+    share the offering, and by its feature of interest when they also 
+    share the observed property. Names which are still the same are 
+    numbered.
+    """
+    
+    names = []
+    for series in series_list:
+        same_offering = [other for other in series_list 
+                         if other.offering == series.offering]
+        name = series.offering
+        if len(same_offering) > 1:
+            name += '_' + series.observed_property
+            if (series.feature_of_interest 
+                    and len([other for other in same_offering 
+                             if other.observed_property 
+                             == series.observed_property]) > 1):
+                name += '_' + series.feature_of_interest
+        names.append(name)
+    
+    used = set()
+    for i, name in enumerate(names):
+        unique_name = name
+        number = 2
+        while unique_name in used:
+            unique_name = '%s_%d' % (name, number)
+            number += 1
+        used.add(unique_name)
+        names[i] = unique_name
+        
+    return names
+    
+    
+    
+def exportMultipleSeries(series_list, folder, extension='.csv'):
+    """
+    Export several time series, one file per time series named after its 
+    offering, in a folder. When several time series share an offering, file 
+    names also give their observed property and, if needed, their feature 
+    of interest (see getSeriesNames). A file is never written twice.
+    
+    arguments: 
+        >>> series_list:
+            list of timeseries.TimeSeries objects.
+        >>> folder: 
+            folder (unicode) where files will be saved.
+        >>> extension: 
+            file extension (string) giving the export format (see 
+            writers.getSeriesWriter).
+    
+    return value:
+        >>> paths:
+            list of the paths of written files.
+    """
+    
+    series_list = [series for series in series_list if not series.isEmpty()]
+    paths = []
+    for series, name in zip(series_list, getSeriesNames(series_list)):
+        # Offering ids and observed properties are often URNs or URLs.
+        name = re.sub(r'[^\w.-]+', '_', name).strip('_') or 'offering'
+        # Different names may still give the same file name once cleaned.
+        path = os.path.join(folder, name + extension)
+        number = 2
+        while path in paths:
+            path = os.path.join(folder, '%s_%d%s' % (name, number, 
+                                                     extension))
+            number += 1
+        exportSeries(series, path)
+        paths.append(path)
         
- 
\ No newline at end of file
+    return paths
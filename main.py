@@ -13,6 +13,7 @@ import os
 from PyQt4 import QtGui, QtCore, uic
 
 from ui.mainwindow_dialog import MainWindowDialog
+from transport import transport
 
 
 
@@ -69,6 +70,8 @@ class SOSpluginMain:
                                         self.action)
         # remove the toolbar
         self.iface.removeToolBarIcon(self.action)
+        # Close connections kept alive with SOS servers.
+        transport.close()
         
     def run(self): 
         """Run method that performs all the real work"""
@@ -0,0 +1,1242 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+import codecs
+import copy
+import json
+import re
+
+import numpy
+from dateutil import parser as dateparser
+
+from owslib import ows
+from owslib.etree import etree
+from owslib.swe.observation import sos200
+
+from timeseries import TimeSeries
+
+
+SOS20_NS = 'http://www.opengis.net/sos/2.0'
+OM20_NS = 'http://www.opengis.net/om/2.0'
+GML32_NS = 'http://www.opengis.net/gml/3.2'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+SAMS20_NS = 'http://www.opengis.net/samplingSpatial/2.0'
+SWE20_NS = 'http://www.opengis.net/swe/2.0'
+# GetDataAvailability responses: version 1.0 (52North servers up to 4.3) 
+# and version 2.0, which adds offerings and observation counts.
+GDA10_NS = 'http://www.opengis.net/sosgda/1.0'
+GDA20_NS = 'http://www.opengis.net/sosgda/2.0'
+NAMESPACES = {'sos': SOS20_NS, 'om': OM20_NS, 'gml': GML32_NS, 
+              'xlink': XLINK_NS, 'sams': SAMS20_NS, 'swe': SWE20_NS}
+
+OM_OBSERVATION_TAG = '{%s}OM_Observation' % OM20_NS
+RESULT_VALUES_TAG = '{%s}resultValues' % SOS20_NS
+OM_MEASUREMENT = (
+    'http://www.opengis.net/def/observationType/OGC-OM/2.0/OM_Measurement')
+
+# Number of observations parsed between two progress updates.
+PROGRESS_STEP = 1000
+# Number of observations of each batch in batch parsing mode.
+BATCH_SIZE = 10000
+# Number of bytes read at once by feed parsers (see iterResultBatches).
+READ_SIZE = 65536
+
+# Integer value of 'Not a Time' in datetime64 arrays.
+NAT = numpy.datetime64('NaT').view(numpy.int64)
+
+# Beginning of the observations array of JSON GetObservation responses.
+JSON_OBSERVATIONS = re.compile(r'"observations"\s*:\s*\[')
+JSON_SEPARATORS = re.compile(r'[\s,]*')
+
+# ISO 8601 timestamps such as 2012-11-19T13:00:00.000+01:00
+ISO_TIMESTAMP = re.compile(
+    r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:\d{2})?$')
+
+
+
+def iterObservationElements(source):
+    """
+    Incrementally parse a SOS 2.0 GetObservation response and yield its
+    om:OM_Observation elements one at a time.
+
+    Each element is cleared and detached from the document once the
+    consumer is done with it, so that memory use does not depend on the
+    response size.
+
+    argument:
+        >>> source:
+            file-like object (e.g. transport.ResponseStream) or file name.
+
+    yield value:
+        >>> elem:
+            om:OM_Observation element. It is only valid until the next
+            element is requested.
+    """
+
+    if hasattr(etree, 'XPath'):
+        # lxml library: only om:OM_Observation end events are reported.
+        context = etree.iterparse(source, events=('end',), 
+                                  tag=OM_OBSERVATION_TAG)
+        for event, elem in context:
+            yield elem
+            # Drop consumed elements (and their sos:observationData parents).
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+            parent = elem.getparent()
+            if parent is not None and parent.getparent() is not None:
+                while parent.getprevious() is not None:
+                    del parent.getparent()[0]
+        root = context.root
+        
+    else:
+        context = etree.iterparse(source, events=('start', 'end'))
+        root = None
+        depth = 0
+        for event, elem in context:
+            if event == 'start':
+                if root is None:
+                    root = elem
+                depth += 1
+                continue
+            depth -= 1
+            if elem.tag == OM_OBSERVATION_TAG:
+                yield elem
+                elem.clear()
+            if depth == 1 and not root.tag.endswith('}ExceptionReport'):
+                # A direct child of the document root (sos:observationData)
+                # has been consumed: drop it.
+                elem.clear()
+                root.remove(elem)
+                
+    if root is not None and root.tag.endswith('}ExceptionReport'):
+        # Raise exception reports as OWSLib does.
+        raise ows.ExceptionReport(root)
+
+
+
+def decodeObservation(elem):
+    """
+    Decode an om:OM_Observation element using OWSLib library.
+
+    argument:
+        >>> elem:
+            om:OM_Observation element.
+
+    return value:
+        >>> obs:
+            OWSLib observation object, as found in the observations list of
+            a sos200.SOSGetObservationResponse object.
+    """
+
+    response = etree.Element('{%s}GetObservationResponse' % SOS20_NS)
+    observation_data = etree.SubElement(
+        response, '{%s}observationData' % SOS20_NS)
+    observation_data.append(copy.deepcopy(elem))
+
+    return sos200.SOSGetObservationResponse(response).observations[0]
+
+
+
+def iterObservations(source):
+    """
+    Incrementally parse a SOS 2.0 GetObservation response and yield its
+    observations as they are parsed.
+
+    argument:
+        >>> source:
+            file-like object (e.g. transport.ResponseStream) or file name.
+
+    yield value:
+        >>> obs:
+            OWSLib observation object.
+    """
+
+    for elem in iterObservationElements(source):
+        yield decodeObservation(elem)
+
+
+
+class MeasurementExtractor:
+    """
+    Extract time series data from om:OM_Observation elements of the 
+    OM_Measurement type without building OWSLib objects, using precompiled 
+    XPath expressions (when lxml is available). Times and values are 
+    collected as strings and decoded in bulk into arrays at the end.
+    
+    Observations of other types are decoded with OWSLib library instead 
+    (see decodeObservation), and their time and value are added to the 
+    same arrays.
+    
+    Contrary to OWSLib, a result time given as a reference to the 
+    phenomenon time (xlink:href="#phenomenonTime_1") is resolved.
+    
+    """
+    
+    def __init__(self):
+        self.times = []             # ISO 8601 result times (strings).
+        self.values = []            # Result values (strings or floats).
+        self.unit = None            # Unit of the first observation.
+        self.observations_count = 0
+        
+        if hasattr(etree, 'XPath'):
+            xpath = lambda path: etree.XPath(path, namespaces=NAMESPACES, 
+                                             smart_strings=False)
+            self._type = xpath('string(om:type/@xlink:href)')
+            self._time = xpath(
+                'string(om:resultTime/gml:TimeInstant/gml:timePosition)')
+            self._time_href = xpath('string(om:resultTime/@xlink:href)')
+            self._time_by_id = xpath(
+                'string(om:phenomenonTime/gml:TimeInstant[@gml:id=$id]'
+                '/gml:timePosition)')
+            self._result = xpath('om:result')
+        else:
+            self._type = self._findAttribute(
+                'om:type', '{%s}href' % XLINK_NS)
+            self._time = self._findText(
+                'om:resultTime/gml:TimeInstant/gml:timePosition')
+            self._time_href = self._findAttribute(
+                'om:resultTime', '{%s}href' % XLINK_NS)
+            self._time_by_id = self._findTimeById
+            self._result = lambda elem: elem.findall('om:result', NAMESPACES)
+            
+    def _findAttribute(self, path, attribute):
+        def find(elem):
+            child = elem.find(path, NAMESPACES)
+            return child.get(attribute, '') if child is not None else ''
+        return find
+        
+    def _findText(self, path):
+        def find(elem):
+            return elem.findtext(path, '', NAMESPACES)
+        return find
+        
+    def _findTimeById(self, elem, id):
+        for instant in elem.findall('om:phenomenonTime/gml:TimeInstant', 
+                                    NAMESPACES):
+            if instant.get('{%s}id' % GML32_NS) == id:
+                return instant.findtext('gml:timePosition', '', NAMESPACES)
+        return ''
+        
+    def extract(self, elem):
+        """
+        Extract result time, value and unit of an om:OM_Observation element.
+        
+        argument:
+            >>> elem:
+                om:OM_Observation element.
+        """
+        
+        self.observations_count += 1
+        
+        if self._type(elem) != OM_MEASUREMENT:
+            self._extractWithOWSLib(elem)
+            return
+            
+        result = self._result(elem)
+        if not result:
+            return
+        if self.unit is None:
+            self.unit = result[0].get('uom', '')
+            
+        time = self._time(elem)
+        if not time:
+            href = self._time_href(elem)
+            if href.startswith('#'):
+                time = self._time_by_id(elem, id=href[1:])
+        value = (result[0].text or '').strip()
+        if time and value:
+            self.times.append(time.strip())
+            self.values.append(value)
+            
+    def _extractWithOWSLib(self, elem):
+        obs = decodeObservation(elem)
+        result = obs.get_result()
+        if self.unit is None:
+            self.unit = getattr(result, 'uom', '')
+        if obs.resultTime is not None and result.value is not None:
+            self.times.append(obs.resultTime.isoformat())
+            self.values.append(result.value)
+            
+    def getArrays(self):
+        """
+        Decode collected times and values.
+        
+        return values:
+            >>> times:
+                'datetime64[ms]' numpy array of UTC result times.
+            >>> values:
+                float64 numpy array of result values. Non-numeric values 
+                (e.g. category results) are given as NaN.
+        """
+        
+        times = decodeIsoTimestamps(self.times)
+        try:
+            values = numpy.array(self.values, dtype=numpy.float64)
+        except (TypeError, ValueError):
+            values = numpy.array([_decodeNumber(v) for v in self.values], 
+                                 dtype=numpy.float64)
+        
+        valid = times.view(numpy.int64) != NAT
+        if not valid.all():
+            times = times[valid]
+            values = values[valid]
+        
+        return times, values
+        
+    def popArrays(self):
+        """
+        Decode collected times and values (see getArrays), and then forget 
+        them, so that the next ones are collected from scratch.
+        """
+        
+        arrays = self.getArrays()
+        self.times = []
+        self.values = []
+        
+        return arrays
+
+
+
+class PropertyDemultiplexer:
+    """
+    Split the observations of a GetObservation response asking for several 
+    observed properties by observed property: each om:OM_Observation 
+    element is handed to the MeasurementExtractor of its 
+    om:observedProperty, so that each property gets its own time series 
+    and unit.
+    
+    """
+    
+    def __init__(self):
+        self.extractors = {}        # MeasurementExtractor objects, by 
+                                    # observed property.
+        self.observations_count = 0
+        
+        if hasattr(etree, 'XPath'):
+            self._property = etree.XPath(
+                'string(om:observedProperty/@xlink:href)', 
+                namespaces=NAMESPACES, smart_strings=False)
+        else:
+            self._property = self._findProperty
+            
+    def _findProperty(self, elem):
+        child = elem.find('om:observedProperty', NAMESPACES)
+        if child is None:
+            return ''
+        return child.get('{%s}href' % XLINK_NS, '')
+        
+    def extract(self, elem):
+        """Extract an om:OM_Observation element (see MeasurementExtractor)."""
+        
+        self.observations_count += 1
+        key = self.getKey(elem)
+        extractor = self.extractors.get(key)
+        if extractor is None:
+            extractor = self.extractors[key] = MeasurementExtractor()
+        extractor.extract(elem)
+        
+    def getKey(self, elem):
+        """Return the key of the time series of an observation."""
+        return self._property(elem)
+        
+    def getMetadata(self, key):
+        """Return the time series metadata given by its key."""
+        return {'observed_property': key}
+        
+    def getSeries(self):
+        """
+        Decode collected times and values into a dict mapping each observed 
+        property to its timeseries.TimeSeries object.
+        """
+        
+        series = {}
+        for key, extractor in self.extractors.items():
+            times, values = extractor.getArrays()
+            series[key] = TimeSeries(times, values, unit=extractor.unit, 
+                                     **self.getMetadata(key))
+            
+        return series
+
+
+
+class FeatureDemultiplexer(PropertyDemultiplexer):
+    """
+    Split the observations of a GetObservation response by feature of 
+    interest, e.g. the response to a spatially filtered request for one 
+    observed property, which gathers the observations of every station of 
+    an area.
+    
+    Features of interest are identified by their xlink:href reference, or 
+    by the gml:identifier of inline features. References to inline 
+    features of the same response ("#gml_id") are resolved. The procedure 
+    and the sampling position, when available, of each feature of interest 
+    are collected along the way, so that its time series can be linked 
+    back to a station.
+    
+    """
+    
+    def __init__(self):
+        PropertyDemultiplexer.__init__(self)
+        self.procedures = {}        # First procedure (string) of each 
+                                    # feature of interest.
+        self.positions = {}         # (lat, long) tuple of each inline 
+                                    # feature of interest.
+        self.feature_ids = {}       # Inline feature of interest of each 
+                                    # gml:id.
+        
+        if hasattr(etree, 'XPath'):
+            xpath = lambda path: etree.XPath(path, namespaces=NAMESPACES, 
+                                             smart_strings=False)
+            self._feature_href = xpath(
+                'string(om:featureOfInterest/@xlink:href)')
+            self._feature = xpath('om:featureOfInterest/*')
+            self._procedure = xpath('string(om:procedure/@xlink:href)')
+        else:
+            self._feature_href = self._findHref('om:featureOfInterest')
+            self._feature = lambda elem: elem.findall(
+                'om:featureOfInterest/*', NAMESPACES)
+            self._procedure = self._findHref('om:procedure')
+            
+    def _findHref(self, path):
+        def find(elem):
+            child = elem.find(path, NAMESPACES)
+            return child.get('{%s}href' % XLINK_NS, '') if child is not None \
+                else ''
+        return find
+        
+    def getKey(self, elem):
+        href = self._feature_href(elem)
+        if href.startswith('#'):
+            feature = self.feature_ids.get(href[1:], href)
+        elif href:
+            feature = href
+        else:
+            feature = self._readInlineFeature(elem)
+        if feature not in self.procedures:
+            self.procedures[feature] = self._procedure(elem)
+        return feature
+        
+    def _readInlineFeature(self, elem):
+        inline = self._feature(elem)
+        if not inline:
+            return ''
+        inline = inline[0]
+        feature = (inline.findtext('gml:identifier', '', NAMESPACES).strip() 
+                   or inline.get('{%s}id' % GML32_NS, ''))
+        gml_id = inline.get('{%s}id' % GML32_NS)
+        if gml_id:
+            self.feature_ids[gml_id] = feature
+        pos = inline.findtext('sams:shape/gml:Point/gml:pos', '', NAMESPACES)
+        try:
+            lat, lon = [float(c) for c in pos.split()[:2]]
+            self.positions[feature] = (lat, lon)
+        except ValueError:
+            pass
+        return feature
+        
+    def getMetadata(self, key):
+        return {}
+
+
+
+def parseMeasurements(source, extractor=None, monitor=None):
+    """
+    Incrementally parse a SOS 2.0 GetObservation response into a time 
+    series (see MeasurementExtractor).
+    
+    arguments:
+        >>> source:
+            file-like object (e.g. transport.ResponseStream) or file name.
+        >>> extractor:
+            MeasurementExtractor object, or None to use a new one.
+        >>> monitor:
+            retrieval.RetrievalMonitor object informed of parsed 
+            observations every PROGRESS_STEP observations, or None.
+    
+    return value:
+        >>> series:
+            timeseries.TimeSeries object of UTC result times and result 
+            values, with its unit. Offering and observed property are left 
+            empty.
+    """
+    
+    if extractor is None:
+        extractor = MeasurementExtractor()
+    extractObservations(source, extractor, monitor)
+    times, values = extractor.getArrays()
+    
+    return TimeSeries(times, values, unit=extractor.unit)
+
+
+
+def parseMeasurementsByProperty(source, monitor=None):
+    """
+    Incrementally parse a SOS 2.0 GetObservation response which may 
+    contain observations of several observed properties into one time 
+    series per observed property (see PropertyDemultiplexer).
+    
+    arguments:
+        >>> source, monitor:
+            see parseMeasurements.
+    
+    return value:
+        >>> series:
+            dict mapping each observed property (string) found in the 
+            response to its timeseries.TimeSeries object, with its unit. 
+            Offering is left empty.
+    """
+    
+    demultiplexer = PropertyDemultiplexer()
+    extractObservations(source, demultiplexer, monitor)
+    
+    return demultiplexer.getSeries()
+
+
+
+def parseMeasurementsByFeature(source, monitor=None):
+    """
+    Incrementally parse a SOS 2.0 GetObservation response which may 
+    contain observations of several features of interest into one time 
+    series per feature of interest (see FeatureDemultiplexer).
+    
+    arguments:
+        >>> source, monitor:
+            see parseMeasurements.
+    
+    return values:
+        >>> series:
+            dict mapping each feature of interest (string) found in the 
+            response to its timeseries.TimeSeries object, with its unit. 
+            Offering and observed property are left empty.
+        >>> features:
+            dict mapping each feature of interest to a dict with 
+            'procedure' (string) and 'position' ((lat, long) tuple, or 
+            None) keys.
+    """
+    
+    demultiplexer = FeatureDemultiplexer()
+    extractObservations(source, demultiplexer, monitor)
+    features = dict((feature, {
+                        'procedure': demultiplexer.procedures.get(feature, ''), 
+                        'position': demultiplexer.positions.get(feature)}) 
+                    for feature in demultiplexer.extractors)
+    
+    return demultiplexer.getSeries(), features
+
+
+
+def extractObservations(source, extractor, monitor=None):
+    """
+    Hand every om:OM_Observation element of a GetObservation response to 
+    an extractor (see parseMeasurements).
+    """
+    
+    for i, elem in enumerate(iterObservationElements(source), 1):
+        extractor.extract(elem)
+        if monitor is not None and i % PROGRESS_STEP == 0:
+            monitor.update(observations=PROGRESS_STEP)
+    if monitor is not None:
+        monitor.update(observations=extractor.observations_count 
+                       % PROGRESS_STEP)
+
+
+
+class ResultTemplate:
+    """
+    Structure and encoding of the results of a GetResult response, as 
+    given by a GetResultTemplate response (SOS 2.0 Result Handling 
+    extension): each observation is a block of tokens, one token per 
+    simple component of a SWE Common 2.0 data record.
+    
+    attributes:
+        >>> token_separator, block_separator, decimal_separator:
+            separators of swe:TextEncoding (strings).
+        >>> columns:
+            number (int) of tokens of each block.
+        >>> time_column:
+            index (int) of the token giving the time of an observation: its 
+            result time if the record has one, its phenomenon time (end of 
+            time range) otherwise.
+        >>> value_column:
+            index (int) of the token giving the measured value.
+        >>> unit:
+            unit of measured value (string).
+    
+    """
+    
+    # Number of tokens of each simple SWE Common component.
+    SIMPLE_COMPONENTS = {'Time': 1, 'Quantity': 1, 'Count': 1, 'Boolean': 1, 
+                         'Text': 1, 'Category': 1, 'TimeRange': 2, 
+                         'QuantityRange': 2, 'CountRange': 2, 
+                         'CategoryRange': 2}
+    
+    def __init__(self, structure, encoding, observed_property=''):
+        self.token_separator = encoding.get('tokenSeparator', ',')
+        self.block_separator = encoding.get('blockSeparator', '@@')
+        self.decimal_separator = encoding.get('decimalSeparator', '.')
+        
+        # (name, definition, type, first column, unit) of every simple 
+        # component.
+        self.components = []
+        self.columns = self._addComponent(structure, '', 0)
+        
+        times = [c for c in self.components if c[2] in ('Time', 'TimeRange')]
+        values = [c for c in self.components if c[2] in ('Quantity', 'Count')]
+        if not times or not values:
+            raise ValueError('result structure has no time or no value')
+        time = (self._findComponent(times, 'resulttime') 
+                or self._findComponent(times, 'phenomenontime') or times[0])
+        self.time_column = time[3] + (1 if time[2] == 'TimeRange' else 0)
+        value = ([c for c in values if c[1] == observed_property] 
+                 or values)[0]
+        self.value_column = value[3]
+        self.unit = value[4]
+        
+    def _findComponent(self, components, word):
+        for component in components:
+            if word in (component[0] + ' ' + component[1]).lower():
+                return component
+        return None
+        
+    def _addComponent(self, elem, name, column):
+        """
+        Add a component and its children to self.components, and return 
+        the next column.
+        """
+        
+        tag = elem.tag.split('}')[-1]
+        if tag in self.SIMPLE_COMPONENTS:
+            uom = elem.find('swe:uom', NAMESPACES)
+            unit = uom.get('code', '') if uom is not None else ''
+            self.components.append((name, elem.get('definition', ''), tag, 
+                                    column, unit))
+            return column + self.SIMPLE_COMPONENTS[tag]
+        if tag == 'DataRecord':
+            children = elem.findall('swe:field', NAMESPACES)
+        elif tag == 'Vector':
+            children = elem.findall('swe:coordinate', NAMESPACES)
+        elif tag == 'DataArray':
+            # The record of each block is the array element type.
+            children = elem.findall('swe:elementType', NAMESPACES)
+        else:
+            raise ValueError('unsupported result component: %s' % tag)
+        for child in children:
+            for component in child:
+                if isinstance(component.tag, str):
+                    column = self._addComponent(
+                        component, child.get('name', ''), column)
+        return column
+
+
+
+def parseResultTemplate(content, observed_property=''):
+    """
+    Parse a GetResultTemplate response.
+    
+    arguments:
+        >>> content:
+            GetResultTemplate response (string).
+        >>> observed_property:
+            requested observed property (string), used to find the value 
+            of records with several quantities.
+    
+    return value:
+        >>> template:
+            ResultTemplate object. An owslib.ows.ExceptionReport is raised 
+            for exception reports, and a ValueError for responses whose 
+            result structure or encoding is not supported.
+    """
+    
+    root = etree.fromstring(content)
+    if root.tag.endswith('}ExceptionReport'):
+        raise ows.ExceptionReport(root)
+    structure = root.find('sos:resultStructure/*', NAMESPACES)
+    encoding = root.find('sos:resultEncoding/swe:TextEncoding', NAMESPACES)
+    if structure is None or encoding is None:
+        raise ValueError('result template without text encoding')
+        
+    return ResultTemplate(structure, encoding, observed_property)
+
+
+
+def parseResultValues(source, template, monitor=None):
+    """
+    Parse a GetResult response into a time series (see iterResultBatches).
+    
+    arguments:
+        >>> source:
+            file-like object (e.g. transport.ResponseStream) or file name.
+        >>> template:
+            ResultTemplate object of requested offering and observed 
+            property.
+        >>> monitor:
+            retrieval.RetrievalMonitor object informed of parsed 
+            observations, or None.
+    
+    return value:
+        >>> series:
+            timeseries.TimeSeries object of UTC times and values, with the 
+            unit of the template. Offering and observed property are left 
+            empty.
+    """
+    
+    batches = list(iterResultBatches(source, template, monitor=monitor))
+    
+    return TimeSeries(numpy.concatenate([b.times for b in batches]), 
+                      numpy.concatenate([b.values for b in batches]), 
+                      unit=template.unit)
+    
+    
+    
+def iterResultBatches(source, template, batch_size=BATCH_SIZE, 
+                      monitor=None):
+    """
+    Incrementally parse a GetResult response into successive time series 
+    batches, in bounded memory. The response is fed to the XML parser 
+    READ_SIZE bytes at a time, and the text of its sos:resultValues 
+    element is split into blocks as it is received (see 
+    ResultValuesTarget): the times and values of every batch_size blocks 
+    are then decoded in bulk (see decodeIsoTimestamps).
+    
+    arguments:
+        >>> source, template:
+            see parseResultValues.
+        >>> batch_size:
+            number (int) of observations of each batch.
+        >>> monitor:
+            retrieval.RetrievalMonitor object informed of parsed 
+            observations after each batch, or None.
+    
+    return value:
+        >>> batches:
+            generator of timeseries.TimeSeries objects (see 
+            parseResultValues), in response order. The last one may be 
+            empty. Exception reports are raised as 
+            owslib.ows.ExceptionReport.
+    """
+    
+    target = ResultValuesTarget(template)
+    if hasattr(etree, 'XPath'):
+        # lxml library limits text nodes to 10 MB unless told otherwise.
+        parser = etree.XMLParser(target=target, huge_tree=True)
+    else:
+        parser = etree.XMLParser(target=target)
+    opened = not hasattr(source, 'read')
+    if opened:
+        source = open(source, 'rb')
+    try:
+        while True:
+            chunk = source.read(READ_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            while len(target.blocks) >= batch_size:
+                yield _decodeResultBatch(target.popBlocks(batch_size), 
+                                         template, monitor)
+        root = parser.close()
+    finally:
+        if opened:
+            source.close()
+    if root is not None and root.tag.endswith('}ExceptionReport'):
+        raise ows.ExceptionReport(root)
+        
+    yield _decodeResultBatch(target.popBlocks(), template, monitor)
+    
+    
+    
+class ResultValuesTarget:
+    """
+    Parser target (see etree.XMLParser) of GetResult responses: the text 
+    of the sos:resultValues element is split into blocks as the parser 
+    delivers it, and only the incomplete last block is kept as text. The 
+    rest of the document is built as usual, so that exception reports can 
+    be raised.
+    
+    Some servers give the number of blocks first, as a block of its own or 
+    as an additional first token: it is dropped.
+    
+    argument:
+        >>> template:
+            ResultTemplate object giving the separators.
+    
+    """
+    
+    def __init__(self, template):
+        self.template = template
+        self.builder = etree.TreeBuilder()
+        self.blocks = []            # Complete blocks (strings).
+        self.pending = ''           # Text of the block being received.
+        self.in_values = False
+        self.first = True           # No block has been received yet.
+        
+    def start(self, tag, attrib):
+        self.in_values = tag == RESULT_VALUES_TAG
+        return self.builder.start(tag, attrib)
+        
+    def end(self, tag):
+        if self.in_values:
+            self.addBlock(self.pending)
+            self.pending = ''
+            self.in_values = False
+        return self.builder.end(tag)
+        
+    def data(self, text):
+        if not self.in_values:
+            self.builder.data(text)
+            return
+        blocks = (self.pending + text).split(self.template.block_separator)
+        self.pending = blocks.pop()
+        for block in blocks:
+            self.addBlock(block)
+            
+    def close(self):
+        return self.builder.close()
+        
+    def addBlock(self, block):
+        """Add a received block, unless it is blank or a block count."""
+        
+        if not block.strip():
+            return
+        if self.first:
+            self.first = False
+            token = self.template.token_separator
+            tokens = block.split(token)
+            if len(tokens) == 1 and tokens[0].strip().isdigit():
+                return
+            if (len(tokens) == self.template.columns + 1 
+                    and tokens[0].strip().isdigit()):
+                block = token.join(tokens[1:])
+        self.blocks.append(block)
+        
+    def popBlocks(self, count=None):
+        """Remove and return the first count blocks (all by default)."""
+        
+        if count is None:
+            count = len(self.blocks)
+        blocks = self.blocks[:count]
+        del self.blocks[:count]
+        
+        return blocks
+        
+        
+        
+def _decodeResultBatch(blocks, template, monitor=None):
+    # Decode GetResult blocks into a time series (see iterResultBatches).
+    token = template.token_separator
+    columns = template.columns
+    tokens = token.join(blocks).split(token) if blocks else []
+    if len(tokens) != len(blocks) * columns:
+        # Malformed blocks are dropped.
+        tokens = []
+        for block in blocks:
+            block_tokens = block.split(token)
+            if len(block_tokens) == columns:
+                tokens.extend(block_tokens)
+                
+    times = [t.strip() for t in tokens[template.time_column::columns]]
+    values = [v.strip() for v in tokens[template.value_column::columns]]
+    if template.decimal_separator != '.':
+        values = [v.replace(template.decimal_separator, '.') for v in values]
+    try:
+        values = numpy.array(values, dtype=numpy.float64)
+    except ValueError:
+        values = numpy.array([_decodeNumber(v) for v in values], 
+                             dtype=numpy.float64)
+    times = decodeIsoTimestamps(times)
+    
+    valid = times.view(numpy.int64) != NAT
+    if not valid.all():
+        times = times[valid]
+        values = values[valid]
+    if monitor is not None:
+        monitor.update(observations=len(times))
+        
+    return TimeSeries(times, values, unit=template.unit)
+    
+    
+    
+def _decodeNumber(string):
+    try:
+        return float(string)
+    except (TypeError, ValueError):
+        return numpy.nan
+
+
+
+def parseJsonMeasurements(source, monitor=None):
+    """
+    Parse a GetObservation response of the JSON binding of 52North SOS 
+    servers into a time series, giving exactly what parseMeasurements gives 
+    for the same observations encoded in OM 2.0 XML: result times (or 
+    phenomenon times, when result times are not given), values and the 
+    unit of the first observation. Observations without value are dropped, 
+    and non-numeric values (e.g. category observations) are given as NaN.
+    
+    Observations are decoded one at a time while the response is being 
+    received (see iterJsonObservations), and only their times and values 
+    are kept, as for XML responses.
+    
+    arguments:
+        >>> source:
+            file-like object (e.g. transport.ResponseStream).
+        >>> monitor:
+            retrieval.RetrievalMonitor object informed of parsed 
+            observations every PROGRESS_STEP observations, or None.
+    
+    return value:
+        >>> series:
+            timeseries.TimeSeries object (see parseMeasurements). Exception 
+            reports are raised as owslib.ows.ExceptionReport, as for XML 
+            responses.
+    """
+    
+    unit = None
+    times = []
+    values = []
+    count = 0
+    for obs in iterJsonObservations(source):
+        count += 1
+        if monitor is not None and count % PROGRESS_STEP == 0:
+            monitor.update(observations=PROGRESS_STEP)
+        result = obs.get('result')
+        if isinstance(result, dict):
+            if unit is None:
+                unit = result.get('uom', '')
+            value = result.get('value')
+        else:
+            if unit is None:
+                unit = ''
+            value = result
+        time = obs.get('resultTime') or obs.get('phenomenonTime')
+        if isinstance(time, list):
+            # Time period: its end, as 52North servers give result times.
+            time = time[-1]
+        if time and value is not None and value != '':
+            times.append(time)
+            values.append(value)
+    if monitor is not None:
+        monitor.update(observations=count % PROGRESS_STEP)
+        
+    times = decodeIsoTimestamps(times)
+    try:
+        values = numpy.array(values, dtype=numpy.float64)
+    except (TypeError, ValueError):
+        values = numpy.array([_decodeNumber(v) for v in values], 
+                             dtype=numpy.float64)
+    valid = times.view(numpy.int64) != NAT
+    if not valid.all():
+        times = times[valid]
+        values = values[valid]
+        
+    return TimeSeries(times, values, unit=unit)
+
+
+
+def iterJsonObservations(source):
+    """
+    Incrementally decode a GetObservation response of the JSON binding of 
+    52North SOS servers, and yield its observations one at a time. The 
+    response is read READ_SIZE bytes at a time, and each member of its 
+    "observations" array is decoded as soon as it has been received, so 
+    that the whole document is never kept in memory.
+    
+    argument:
+        >>> source:
+            file-like object (e.g. transport.ResponseStream).
+    
+    yield value:
+        >>> obs:
+            observation (dict). Exception reports, which have no 
+            observations array, are raised as owslib.ows.ExceptionReport.
+    """
+    
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    state = {'text': '', 'end': False}
+    
+    def readMore():
+        chunk = source.read(READ_SIZE)
+        if not chunk:
+            state['end'] = True
+            chunk = b''
+        if isinstance(chunk, bytes):
+            chunk = utf8.decode(chunk, final=state['end'])
+        state['text'] += chunk
+        
+    # Members before the observations array are few and small.
+    match = None
+    while match is None and not state['end']:
+        readMore()
+        match = JSON_OBSERVATIONS.search(state['text'])
+    if match is None:
+        document = json.loads(state['text']) if state['text'].strip() else {}
+        if 'exceptions' in document:
+            raise ows.ExceptionReport(jsonExceptionReport(document))
+        return
+        
+    position = match.end()
+    while True:
+        text = state['text']
+        position = JSON_SEPARATORS.match(text, position).end()
+        if position < len(text) and text[position] == ']':
+            return
+        try:
+            obs, position = decoder.raw_decode(text, position)
+        except ValueError:
+            # Incomplete observation: read more of the response.
+            if state['end']:
+                raise
+            state['text'] = text[position:]
+            position = 0
+            readMore()
+            continue
+        yield obs
+        
+        
+        
+def jsonExceptionReport(document):
+    """
+    Convert a JSON exception report of 52North SOS servers into the 
+    ows:ExceptionReport element an XML request would have got.
+    """
+    
+    ows_ns = ows.DEFAULT_OWS_NAMESPACE
+    report = etree.Element('{%s}ExceptionReport' % ows_ns)
+    report.set('version', document.get('version', '1.1.0'))
+    for exception in document.get('exceptions', []):
+        elem = etree.SubElement(report, '{%s}Exception' % ows_ns)
+        elem.set('exceptionCode', exception.get('code', ''))
+        if exception.get('locator'):
+            elem.set('locator', exception['locator'])
+        text = etree.SubElement(elem, '{%s}ExceptionText' % ows_ns)
+        text.text = exception.get('text', '')
+        
+    return report
+
+
+
+def parseDataAvailability(content):
+    """
+    Parse a GetDataAvailability response.
+    
+    argument:
+        >>> content:
+            GetDataAvailability response (string).
+    
+    return value:
+        >>> members:
+            list of dicts with 'offering' (None for version 1.0 responses), 
+            'procedure', 'observed_property', 'feature', 'starting_time' 
+            and 'ending_time' (UTC datetime objects) and 'count' (number of 
+            observations, or None if not given) keys. An 
+            owslib.ows.ExceptionReport is raised for exception reports.
+    """
+    
+    root = etree.fromstring(content)
+    if root.tag.endswith('}ExceptionReport'):
+        raise ows.ExceptionReport(root)
+    gda_ns = GDA20_NS if root.tag.startswith('{%s}' % GDA20_NS) else GDA10_NS
+    
+    def href(member, name):
+        elem = member.find('{%s}%s' % (gda_ns, name))
+        if elem is None:
+            return None
+        return elem.get('{%s}href' % XLINK_NS) or (elem.text or '').strip()
+        
+    # Members sharing a time period refer to the first one by gml:id.
+    periods = {}
+    for period in root.iter('{%s}TimePeriod' % GML32_NS):
+        periods[period.get('{%s}id' % GML32_NS)] = (
+                period.findtext('gml:beginPosition', '', NAMESPACES).strip(), 
+                period.findtext('gml:endPosition', '', NAMESPACES).strip())
+            
+    members = []
+    bounds = []
+    for member in root.iter('{%s}dataAvailabilityMember' % gda_ns):
+        phenomenon_time = member.find('{%s}phenomenonTime' % gda_ns)
+        if phenomenon_time is None:
+            continue
+        period = phenomenon_time.find('gml:TimePeriod', NAMESPACES)
+        if period is not None:
+            key = period.get('{%s}id' % GML32_NS)
+        else:
+            key = (phenomenon_time.get('{%s}href' % XLINK_NS) or '')[1:]
+        if key not in periods:
+            continue
+        count = member.findtext('{%s}count' % gda_ns)
+        members.append({'offering': href(member, 'offering'), 
+                        'procedure': href(member, 'procedure'), 
+                        'observed_property': href(member, 'observedProperty'), 
+                        'feature': href(member, 'featureOfInterest'), 
+                        'count': int(count) if count else None})
+        bounds.extend(periods[key])
+        
+    times = decodeIsoTimestamps(bounds).astype(object)
+    for i, member in enumerate(members):
+        member['starting_time'] = times[2 * i]
+        member['ending_time'] = times[2 * i + 1]
+        
+    return [member for member in members 
+            if member['starting_time'] is not None 
+            and member['ending_time'] is not None]
+
+
+
+def decodeIsoTimestamps(strings):
+    """
+    Decode ISO 8601 timestamps in bulk.
+    
+    Timestamps sharing the same layout - which is the case of almost every 
+    timestamp of a GetObservation response - are decoded at once, digit 
+    by digit, with numpy. Other timestamps are decoded one by one with 
+    dateutil.
+    
+    argument:
+        >>> strings:
+            list of ISO 8601 timestamps (strings).
+    
+    return value:
+        >>> times:
+            'datetime64[ms]' numpy array. Timestamps with a time zone are 
+            converted to UTC, timestamps without are kept as they are, and 
+            unreadable timestamps are set to NaT.
+    """
+    
+    times = numpy.empty(len(strings), dtype='datetime64[ms]')
+    if not strings:
+        return times
+        
+    lengths = numpy.array([len(t) for t in strings])
+    for length in numpy.unique(lengths):
+        rows = numpy.flatnonzero(lengths == length)
+        group = [strings[i] for i in rows]
+        decoded = _decodeIsoLayout(group)
+        if decoded is None:
+            decoded = numpy.array([_decodeIsoTimestamp(t) for t in group], 
+                                  dtype='datetime64[ms]')
+        times[rows] = decoded
+        
+    return times
+    
+    
+    
+def _decodeIsoTimestamp(string):
+    try:
+        dt = dateparser.parse(string)
+    except Exception:
+        # Unreadable timestamps are dropped, as OWSLib does.
+        return numpy.datetime64('NaT')
+    if dt.utcoffset() is not None:
+        dt = dt.replace(tzinfo=None) - dt.utcoffset()
+    return numpy.datetime64(dt, 'ms')
+    
+    
+    
+def _decodeIsoLayout(group):
+    """
+    Decode timestamps of the same length at once, if they all share the 
+    layout of the first one. Return None otherwise.
+    """
+    
+    match = ISO_TIMESTAMP.match(group[0])
+    if match is None:
+        return None
+        
+    length = len(group[0])
+    try:
+        chars = numpy.array(group, dtype='S%d' % length)
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return None
+    chars = chars.view(numpy.uint8).reshape(-1, length)
+    
+    # Check that separators are at the same place for every timestamp.
+    template = numpy.frombuffer(group[0].encode('ascii'), dtype=numpy.uint8)
+    digits = (template >= ord('0')) & (template <= ord('9'))
+    fixed = ~digits
+    tz_start = match.start(2) if match.group(2) else length
+    if match.group(2) and match.group(2) != 'Z':
+        fixed[tz_start] = False         # Either '+' or '-'.
+        sign = chars[:, tz_start]
+        if not numpy.all((sign == ord('+')) | (sign == ord('-'))):
+            return None
+    if not numpy.all(chars[:, fixed] == template[fixed]):
+        return None
+    # Separators wrap around to large numbers in uint8.
+    numbers = chars - numpy.uint8(ord('0'))
+    if numbers[:, digits].max() > 9:
+        return None
+        
+    def field(start, stop):
+        value = numpy.zeros(len(group), dtype=numpy.int64)
+        for column in range(start, stop):
+            value = value * 10 + numbers[:, column]
+        return value
+        
+    times = (field(0, 4) - 1970).astype('datetime64[Y]').astype(
+        'datetime64[M]')
+    times = times + (field(5, 7) - 1).astype('timedelta64[M]')
+    times = times.astype('datetime64[D]') + (
+        field(8, 10) - 1).astype('timedelta64[D]')
+    milliseconds = ((field(11, 13) * 60 + field(14, 16)) * 60 
+                    + field(17, 19)) * 1000
+    if match.group(1):
+        # Keep milliseconds of the fraction of a second.
+        fraction_digits = min(len(match.group(1)) - 1, 3)
+        fraction = field(20, 20 + fraction_digits)
+        milliseconds += fraction * 10 ** (3 - fraction_digits)
+    if match.group(2) and match.group(2) != 'Z':
+        offset = (field(tz_start + 1, tz_start + 3) * 60 
+                  + field(tz_start + 4, tz_start + 6)) * 60000
+        offset[chars[:, tz_start] == ord('-')] *= -1
+        milliseconds -= offset
+        
+    return times.astype('datetime64[ms]') + milliseconds.astype(
+        'timedelta64[ms]')
+
+
+
+def iterMeasurementBatches(source, batch_size=BATCH_SIZE, monitor=None):
+    """
+    Incrementally parse a SOS 2.0 GetObservation response into successive 
+    time series batches, so that they can be processed (e.g. written to a 
+    file) while the response is being received, in bounded memory.
+    
+    arguments:
+        >>> source:
+            file-like object (e.g. transport.ResponseStream) or file name.
+        >>> batch_size:
+            number (int) of observations of each batch.
+        >>> monitor:
+            retrieval.RetrievalMonitor object informed of parsed 
+            observations every PROGRESS_STEP observations, or None.
+    
+    return value:
+        >>> batches:
+            generator of timeseries.TimeSeries objects (see 
+            parseMeasurements), in response order. The last one may be 
+            empty.
+    """
+    
+    extractor = MeasurementExtractor()
+    for i, elem in enumerate(iterObservationElements(source), 1):
+        extractor.extract(elem)
+        if monitor is not None and i % PROGRESS_STEP == 0:
+            monitor.update(observations=PROGRESS_STEP)
+        if i % batch_size == 0:
+            times, values = extractor.popArrays()
+            yield TimeSeries(times, values, unit=extractor.unit)
+    if monitor is not None:
+        monitor.update(observations=extractor.observations_count 
+                       % PROGRESS_STEP)
+    times, values = extractor.popArrays()
+    
+    yield TimeSeries(times, values, unit=extractor.unit)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+import numpy
+
+from qgis.core import *
+
+
+
+class BboxReprojector:
+    """
+    Reproject offering bounding boxes to WGS84 coordinate reference system.
+
+    One QgsCoordinateTransform is created per source SRS code and then kept
+    in cache, instead of one per offering. Bounding boxes are reprojected in
+    a single pass over arrays: boxes are grouped by SRS code, duplicated
+    boxes (offerings of a same station) are reprojected only once, and boxes
+    which are already expressed in WGS84 are simply copied.
+
+    argument:
+        >>> target_code:
+            code (string) of the target coordinate reference system.
+
+    """
+
+    def __init__(self, target_code='EPSG:4326'):
+        self.target_code = target_code
+        self.target_crs = QgsCoordinateReferenceSystem(target_code)
+        self._transformers = {}
+
+    def getTransformer(self, code):
+        """
+        Return the cached QgsCoordinateTransform object from SRS code to
+        target coordinate reference system, or None if this SRS is unknown.
+
+        argument:
+            >>> code:
+                SRS code (string) such as 'EPSG:2154', or None.
+
+        """
+
+        if code not in self._transformers:
+            transformer = None
+            try:
+                former_srs = QgsCoordinateReferenceSystem(code)
+                if former_srs.isValid():
+                    transformer = QgsCoordinateTransform(former_srs,
+                                                         self.target_crs)
+            except:
+                pass
+            self._transformers[code] = transformer
+
+        return self._transformers[code]
+
+    def reprojectBboxes(self, codes, bboxes):
+        """
+        Reproject N bounding boxes at once.
+
+        arguments:
+            >>> codes:
+                sequence of N SRS codes (string or None).
+            >>> bboxes:
+                (N, 4) array-like of (left, bottom, right, top) bounding
+                boxes, as defined by OWSLib library. Boxes which are unknown
+                are filled with NaN.
+
+        return value:
+            >>> wgs84_bboxes:
+                (N, 4) float array of (bottom, left, top, right) bounding
+                boxes, ie. lat/long pairs of coordinates as returned by
+                WGS84conversion. Boxes whose SRS is unknown, or which could
+                not be transformed, keep their original coordinates.
+
+        """
+
+        bboxes = numpy.asarray(bboxes, dtype=float).reshape(-1, 4)
+        codes = numpy.asarray(codes, dtype=object).reshape(-1)
+
+        # Fallback values: original coordinates, reordered.
+        wgs84_bboxes = bboxes[:, [1, 0, 3, 2]]
+
+        for code in set(codes.tolist()):
+            if code == self.target_code:
+                # Nothing to transform.
+                continue
+            transformer = self.getTransformer(code)
+            if transformer is None:
+                continue
+
+            # Transform each distinct box of this SRS only once, as all the
+            # offerings of a station share the same bounding box.
+            transformed = {}
+            for row in numpy.flatnonzero(codes == code):
+                if numpy.isnan(bboxes[row]).any():
+                    continue
+                bbox = tuple(bboxes[row].tolist())
+                if bbox not in transformed:
+                    transformed[bbox] = self._transformBbox(transformer, bbox)
+                if transformed[bbox] is not None:
+                    wgs84_bboxes[row] = transformed[bbox]
+
+        return wgs84_bboxes
+
+    def _transformBbox(self, transformer, bbox):
+        """Transform both corners of a (left, bottom, right, top) box."""
+
+        left, bottom, right, top = bbox
+        try:
+            wgs84_left, wgs84_bottom = transformer.transform(left, bottom)
+            wgs84_right, wgs84_top = transformer.transform(right, top)
+        except:
+            return None
+
+        return (wgs84_bottom, wgs84_left, wgs84_top, wgs84_right)
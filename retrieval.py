@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+import datetime
+import random
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import numpy
+import requests
+
+from timeseries import TimeSeries
+
+
+# Default time window of each GetObservation request in chunked retrieval
+# mode, and default number of requests sent at the same time.
+DEFAULT_WINDOW = datetime.timedelta(days=7)
+DEFAULT_WORKERS = 4
+
+# When the number of observations of a time series can be estimated (see 
+# planRetrieval): expected duration (seconds) of each request, shortest 
+# time window, and read timeout of each request as a multiple of its 
+# expected duration, with a minimum (seconds).
+REQUEST_TIME_BUDGET = 60
+MINIMUM_WINDOW = datetime.timedelta(hours=1)
+TIMEOUT_MARGIN = 3
+MINIMUM_READ_TIMEOUT = 30
+
+# Number of retries of a request failing for a transient reason (see 
+# fetchRetrying), and bounds (seconds) of the exponential backoff between 
+# two attempts.
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.
+BACKOFF_MAX = 60.
+
+
+
+class RetrievalCancelled(Exception):
+    """Raised when the user cancels a time series retrieval."""
+
+
+
+class RetrievalMonitor:
+    """
+    Follow the progress of a time series retrieval, which may be made of 
+    several GetObservation requests running in different threads, and 
+    allow its cancellation.
+    
+    Counters are updated by transport.ResponseStream (bytes) and 
+    parsing.parseMeasurements (observations). Each update raises 
+    RetrievalCancelled once the retrieval has been cancelled. The 
+    retrieval paths actually used (e.g. GetResult requests, see 
+    sos.RETRIEVAL_PATHS) are recorded in the paths list, and the timing 
+    of every completed request in the timings list (see recordTiming).
+    
+    arguments:
+        >>> callback:
+            function called with the number of bytes received (as sent on 
+            the wire), the number of observations parsed and the number of 
+            decoded bytes so far, or None. It is called from the threads 
+            sending the requests.
+        >>> interval:
+            minimum time (float) in seconds between two callback calls.
+    
+    """
+    
+    def __init__(self, callback=None, interval=0.2):
+        self.callback = callback
+        self.interval = interval
+        self.bytes_received = 0
+        self.observations = 0
+        self.decoded_bytes = 0
+        self.paths = []
+        self.timings = []
+        self._last_call = 0
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        
+    def update(self, bytes_received=0, observations=0, decoded_bytes=0):
+        """Add received bytes and parsed observations to the counters."""
+        
+        if self._cancelled.is_set():
+            raise RetrievalCancelled()
+            
+        with self._lock:
+            self.bytes_received += bytes_received
+            self.observations += observations
+            self.decoded_bytes += decoded_bytes
+            now = time.time()
+            call = (self.callback is not None 
+                    and now - self._last_call >= self.interval)
+            if call:
+                self._last_call = now
+                counters = (self.bytes_received, self.observations, 
+                            self.decoded_bytes)
+        if call:
+            self.callback(*counters)
+            
+    def recordPath(self, path):
+        """Record that a retrieval path has been used."""
+        
+        with self._lock:
+            if path not in self.paths:
+                self.paths.append(path)
+                
+    def recordTiming(self, offering, latency, observations, duration, 
+                     period=None):
+        """
+        Record the timing of a completed request (see Throughput.update), 
+        as an (offering, latency, observations, duration, period) tuple.
+        """
+        
+        with self._lock:
+            self.timings.append((offering, latency, observations, duration, 
+                                 period))
+                                 
+    def cancel(self):
+        self._cancelled.set()
+        
+    def isCancelled(self):
+        return self._cancelled.is_set()
+        
+    def wait(self, seconds):
+        """
+        Wait for some time (seconds), unless the retrieval is cancelled 
+        meanwhile, which raises RetrievalCancelled.
+        """
+        
+        if self._cancelled.wait(seconds):
+            raise RetrievalCancelled()
+
+
+
+class Throughput:
+    """
+    Throughput of the requests sent to a SOS server for an offering, as 
+    measured on completed requests (see RetrievalMonitor.recordTiming). 
+    Each figure is an exponential moving average, so that recent requests 
+    matter most. Default figures are used until a request is measured.
+    
+    arguments:
+        >>> latency:
+            time (seconds) until the response headers are received.
+        >>> rate:
+            number of observations received and parsed per second once 
+            the response has started.
+        >>> density:
+            number of observations per second of time series time, or None 
+            if unknown.
+        >>> samples:
+            number (int) of measured requests.
+    
+    """
+    
+    # Weight of each new measure.
+    SMOOTHING = 0.3
+    
+    def __init__(self, latency=1., rate=1000., density=None, samples=0):
+        self.latency = latency
+        self.rate = rate
+        self.density = density
+        self.samples = samples
+        
+    def update(self, latency, observations, duration, period=None):
+        """
+        Add the measure of a completed request.
+        
+        arguments:
+            >>> latency:
+                response latency (seconds).
+            >>> observations:
+                number (int) of observations received.
+            >>> duration:
+                total duration (seconds) of the request.
+            >>> period:
+                duration (seconds) of the requested time period, or None if 
+                observations do not belong to a single time series.
+        """
+        
+        weight = 1. if self.samples == 0 else self.SMOOTHING
+        self.latency += weight * (latency - self.latency)
+        if observations:
+            rate = observations / max(duration - latency, 0.001)
+            self.rate += weight * (rate - self.rate)
+        if period:
+            density = float(observations) / period
+            if self.density is None:
+                self.density = density
+            else:
+                self.density += weight * (density - self.density)
+        self.samples += 1
+        
+    def getExpectedDuration(self, observations):
+        """Return the expected duration (seconds) of a request."""
+        return self.latency + observations / self.rate
+
+
+
+def splitPeriod(starting_time, ending_time, window):
+    """
+    Split a time period into consecutive time windows.
+
+    arguments:
+        >>> starting_time:
+            datetime object.
+        >>> ending_time:
+            datetime object.
+        >>> window:
+            timedelta object, maximum duration of each time window.
+
+    return value:
+        >>> windows:
+            list of (window_starting_time, window_ending_time) tuples, in
+            time order. Each window starts where the previous one ends.
+    """
+
+    windows = []
+    window_start = starting_time
+    while True:
+        window_end = min(window_start + window, ending_time)
+        windows.append((window_start, window_end))
+        if window_end >= ending_time:
+            break
+        window_start = window_end
+
+    return windows
+
+
+
+def mergeChunks(chunks):
+    """
+    Merge time series chunks retrieved for consecutive time windows.
+
+    As consecutive windows share their bounds, an observation made at a
+    window bound may be sent twice: each chunk only keeps the observations
+    which are later than every observation of the previous chunks.
+
+    argument:
+        >>> chunks:
+            non-empty list of timeseries.TimeSeries objects, in time order.
+
+    return value:
+        >>> series:
+            timeseries.TimeSeries object, with the metadata of the first 
+            chunk and the first unit found.
+    """
+
+    kept_times = []
+    kept_values = []
+    last_time = None
+    for chunk in chunks:
+        times, values = chunk.times, chunk.values
+        if last_time is not None and len(times):
+            later = times > last_time
+            times = times[later]
+            values = values[later]
+        if len(times):
+            kept_times.append(times)
+            kept_values.append(values)
+            last_time = times.max() if last_time is None else max(
+                last_time, times.max())
+
+    unit = next((chunk.unit for chunk in chunks if chunk.unit), '')
+    if not kept_times:
+        return chunks[0].copy(times=[], values=[], unit=unit)
+
+    return chunks[0].copy(times=numpy.concatenate(kept_times), 
+                          values=numpy.concatenate(kept_values), unit=unit)
+
+
+
+def fetchChunked(fetch, starting_time, ending_time, window=DEFAULT_WINDOW,
+                 workers=DEFAULT_WORKERS, monitor=None):
+    """
+    Retrieve a time series window by window, sending up to 'workers'
+    GetObservation requests at the same time, and merge the results.
+
+    arguments:
+        >>> fetch:
+            function taking window starting and ending times (datetime
+            objects) and returning a (timeseries.TimeSeries object,
+            response) tuple for this window, as sos.fetchObservations does.
+        >>> starting_time:
+            datetime object.
+        >>> ending_time:
+            datetime object.
+        >>> window:
+            timedelta object, maximum duration of each request time window.
+        >>> workers:
+            maximum number (int) of requests sent at the same time.
+        >>> monitor:
+            RetrievalMonitor object of the retrieval, or None (see 
+            fetchRetrying).
+
+    return values:
+        >>> series:
+            timeseries.TimeSeries object.
+        >>> response:
+            response to the first request (string).
+    """
+
+    results = fetchWindows(fetch, starting_time, ending_time, window,
+                           workers, monitor)
+    series = mergeChunks([r[0] for r in results])
+
+    return series, results[0][1]
+
+
+
+def fetchWindows(fetch, starting_time, ending_time, window=DEFAULT_WINDOW,
+                 workers=DEFAULT_WORKERS, monitor=None):
+    """
+    Call a fetch function window by window, up to 'workers' windows at the
+    same time (see fetchChunked), and return its results in windows order.
+    Windows whose request times out are split (see fetchSplitting), and 
+    requests failing for a transient reason are retried (see 
+    fetchRetrying). The first error raised by a call is raised here.
+    """
+
+    windows = splitPeriod(starting_time, ending_time, window)
+
+    if len(windows) == 1 or workers <= 1:
+        results = [fetchSplitting(fetch, *w, monitor=monitor) 
+                   for w in windows]
+    else:
+        pool = ThreadPool(min(workers, len(windows)))
+        try:
+            results = pool.map(
+                    lambda w: fetchSplitting(fetch, *w, monitor=monitor), 
+                    windows)
+        finally:
+            pool.terminate()
+
+    return [result for window_results in results 
+            for result in window_results]
+
+
+
+def fetchSplitting(fetch, starting_time, ending_time, monitor=None):
+    """
+    Call a fetch function for a time window (see fetchRetrying) and, if 
+    the server does not answer in time, for each half of the window 
+    instead, down to windows of MINIMUM_WINDOW, so that a too large window 
+    only costs the retrieval of this window again.
+
+    return value:
+        >>> results:
+            list of fetch results, in time order.
+    """
+
+    try:
+        return [fetchRetrying(fetch, starting_time, ending_time, monitor)]
+    except requests.exceptions.ReadTimeout:
+        if ending_time - starting_time < 2 * MINIMUM_WINDOW:
+            raise
+    middle = starting_time + (ending_time - starting_time) // 2
+
+    return (fetchSplitting(fetch, starting_time, middle, monitor) 
+            + fetchSplitting(fetch, middle, ending_time, monitor))
+
+
+
+def isTransientError(error):
+    """
+    Return True if a request error may not happen again: connection 
+    failures, interrupted responses, and server overload or unavailability 
+    (HTTP 429 and 5xx status codes). Read timeouts are handled by 
+    splitting the time window instead (see fetchSplitting).
+    """
+
+    if isinstance(error, requests.exceptions.HTTPError):
+        response = error.response
+        return response is not None and (response.status_code == 429 
+                                         or response.status_code >= 500)
+
+    return isinstance(error, (requests.exceptions.ConnectionError, 
+                              requests.exceptions.ChunkedEncodingError))
+
+
+
+def fetchRetrying(fetch, starting_time, ending_time, monitor=None, 
+                  retries=MAX_RETRIES):
+    """
+    Call a fetch function for a time window, and call it again if it fails 
+    for a transient reason (see isTransientError), up to 'retries' times. 
+    Attempts are separated by a random delay ("full jitter") of up to 
+    BACKOFF_BASE seconds, doubled at each attempt and limited to 
+    BACKOFF_MAX seconds, so that concurrent requests do not retry all at 
+    once.
+
+    arguments:
+        >>> fetch, starting_time, ending_time:
+            see fetchChunked.
+        >>> monitor:
+            RetrievalMonitor object, whose cancellation interrupts the 
+            delays, or None.
+        >>> retries:
+            maximum number (int) of retries.
+
+    return value:
+        >>> result:
+            fetch result. The last error is raised once every attempt has 
+            failed.
+    """
+
+    attempt = 0
+    while True:
+        try:
+            return fetch(starting_time, ending_time)
+        except Exception as e:
+            if attempt >= retries or not isTransientError(e):
+                raise
+        delay = random.uniform(0, min(BACKOFF_MAX, 
+                                      BACKOFF_BASE * 2 ** attempt))
+        attempt += 1
+        if monitor is not None:
+            monitor.wait(delay)
+        else:
+            time.sleep(delay)
+
+
+
+def estimateObservations(availability, starting_time, ending_time):
+    """
+    Estimate the number of observations of a time series in a time period, 
+    assuming they are evenly spread over its data availability.
+
+    arguments:
+        >>> availability:
+            (starting_time, ending_time, count) tuple of the time series 
+            (see sos.getDataAvailability), or None.
+        >>> starting_time:
+            datetime object.
+        >>> ending_time:
+            datetime object.
+
+    return value:
+        >>> observations:
+            number (int) of observations, or None if unknown.
+    """
+
+    if availability is None or availability[2] is None:
+        return None
+    available_start, available_end, count = availability
+    overlap = (min(ending_time, available_end) 
+               - max(starting_time, available_start)).total_seconds()
+    if overlap <= 0:
+        return 0
+    duration = (available_end - available_start).total_seconds()
+    if duration <= 0:
+        return count
+
+    return int(round(count * min(overlap / duration, 1.)))
+
+
+
+def planRetrieval(observations, starting_time, ending_time, read_timeout,
+                  default_window=DEFAULT_WINDOW, throughput=None):
+    """
+    Choose the time window and read timeout of the requests of a time 
+    series retrieval from its expected number of observations and from 
+    the measured throughput of the server, so that each request is 
+    expected to last about REQUEST_TIME_BUDGET seconds and is given a 
+    read timeout matching its expected duration.
+
+    arguments:
+        >>> observations:
+            expected number (int) of observations (see 
+            estimateObservations), or None to estimate it from the 
+            observation density of the throughput, if known.
+        >>> starting_time:
+            datetime object.
+        >>> ending_time:
+            datetime object.
+        >>> read_timeout:
+            default read timeout (seconds), or 0 for no timeout.
+        >>> default_window:
+            timedelta object used when the number of observations cannot 
+            be estimated.
+        >>> throughput:
+            Throughput object of the server and offering, or None if 
+            unknown.
+
+    return values:
+        >>> window:
+            timedelta object (see fetchChunked).
+        >>> read_timeout:
+            read timeout (seconds) of each request. Until the server has 
+            been measured, it is never shorter than the default one.
+    """
+
+    period = (ending_time - starting_time).total_seconds()
+    if (observations is None and throughput is not None 
+            and throughput.density is not None):
+        observations = int(throughput.density * period)
+    if observations is None:
+        return default_window, read_timeout
+    measured = throughput is not None and throughput.samples > 0
+    if throughput is None:
+        throughput = Throughput()
+
+    # Number of observations a request can return within the time budget.
+    budget = max((REQUEST_TIME_BUDGET - throughput.latency) 
+                 * throughput.rate, 1.)
+    if observations <= budget or period <= 0:
+        window = max(ending_time - starting_time, MINIMUM_WINDOW)
+    else:
+        window = max(datetime.timedelta(seconds=int(period * budget 
+                                                     / observations)), 
+                     MINIMUM_WINDOW)
+    if read_timeout:
+        window_observations = observations
+        if period > 0:
+            window_observations *= min(window.total_seconds() / period, 1.)
+        timeout = max(int(TIMEOUT_MARGIN * throughput.getExpectedDuration(
+                              window_observations)), 
+                      MINIMUM_READ_TIMEOUT)
+        read_timeout = timeout if measured else max(read_timeout, timeout)
+
+    return window, read_timeout
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+from PyQt4 import QtCore
+
+
+# Plugin settings are stored in QGIS settings under this group, so that
+# they can be changed from the QGIS advanced settings editor
+# (Settings > Options > Advanced).
+SETTINGS_GROUP = 'sos_2_0_client'
+
+# Default value of each plugin setting.
+DEFAULT_SETTINGS = {
+    # Time (seconds) during which a cached GetCapabilities response is used
+    # without asking the server whether it has changed.
+    'capabilities_ttl': 3600,
+    # Connect and read timeouts (seconds) of every request sent to a SOS
+    # server. 0 means no timeout. Once the throughput of a server has been
+    # measured, time series requests get a read timeout matching their
+    # expected duration instead (see retrieval.planRetrieval).
+    'connect_timeout': 10,
+    'read_timeout': 300,
+    # Whether dense time series plots are downsampled to the plot width.
+    'plot_downsampling': True,
+    # Whether Parquet, Arrow and NetCDF exports are compressed.
+    'export_compression': True,
+    # How time series are retrieved: 'auto' chooses the cheapest way the
+    # server supports, 'result' (GetResult), 'json' (JSON GetObservation)
+    # and 'xml' (OM 2.0 GetObservation) force one.
+    'retrieval_strategy': 'auto',
+    # Whether the selected time series is retrieved in the background as
+    # soon as it is selected, for its default time period: 'off', 'series'
+    # (selected observed property) or 'offering' (every observed property
+    # of the selected offering).
+    'prefetch': 'series',
+    # Time (seconds) between two requests for new observations of a time
+    # series followed from its plot window.
+    'follow_interval': 60,
+}
+
+
+
+def readSetting(key):
+    """
+    Return the value of a plugin setting, or its default value if it has
+    not been set.
+
+    argument:
+        >>> key:
+            setting name (string), one of DEFAULT_SETTINGS keys.
+    """
+
+    default = DEFAULT_SETTINGS[key]
+    value = QtCore.QSettings().value(SETTINGS_GROUP + '/' + key, default)
+    if isinstance(default, bool):
+        return value in (True, 1, 'true', 'True', '1')
+    try:
+        return type(default)(value)
+    except (TypeError, ValueError):
+        return default
+
+
+
+def requestTimeout(read_timeout=None):
+    """
+    Return the (connect timeout, read timeout) tuple of a request, as
+    requests library takes it, from plugin settings.
+
+    argument:
+        >>> read_timeout:
+            read timeout in seconds asked by the user for this request, or
+            None to use the read_timeout setting.
+    """
+
+    if read_timeout is None:
+        read_timeout = readSetting('read_timeout')
+
+    return (readSetting('connect_timeout') or None, read_timeout or None)
@@ -11,17 +11,46 @@
 
 
 
+import datetime
+import json
+import time
+from multiprocessing.pool import ThreadPool
+
+import numpy
+import requests
+
 from qgis.core import *
 
+from owslib import ows
 from owslib.etree import etree
 from owslib.sos import SensorObservationService
 from owslib.swe.observation import sos200
 from owslib.swe.observation import sos100
 from ui.gui import GetCapabilityWindow
+from reprojection import BboxReprojector
+from transport import transport, openStream, DEFAULT_TIMEOUT
+from parsing import parseMeasurements, iterMeasurementBatches
+from parsing import parseMeasurementsByProperty, parseMeasurementsByFeature
+from parsing import decodeIsoTimestamps
+from parsing import parseResultTemplate, parseResultValues
+from parsing import iterResultBatches
+from parsing import parseJsonMeasurements
+from parsing import parseDataAvailability, GDA20_NS
+from timeseries import TimeSeries
+from retrieval import fetchChunked, fetchWindows, mergeChunks, splitPeriod
+from retrieval import fetchRetrying, fetchSplitting, isTransientError
+from retrieval import DEFAULT_WORKERS, Throughput
+from retrieval import RetrievalCancelled
         
 
 
 
+# Reprojection engine shared by the whole plugin, so that coordinate 
+# transformers are created once per SRS code and then reused.
+wgs84_reprojector = BboxReprojector('EPSG:4326')
+
+
+
 def WGS84conversion(off):
     """
     Make sure that offering spatial information is based on WGS84 
@@ -39,61 +68,534 @@ def WGS84conversion(off):
             by OWSLib library.
     """
     
-    try:
-        former_srs = QgsCoordinateReferenceSystem(off.bbox_srs.getcode())
-        wgs84 = QgsCoordinateReferenceSystem('EPSG:4326')
-        transformer = QgsCoordinateTransform(former_srs, wgs84) 
-        
-        former_left = off.bbox[0]
-        former_bottom = off.bbox[1]
-        wgs84_left, wgs84_bottom = transformer.transform(former_left, 
-                                                         former_bottom)
-        former_right = off.bbox[2]
-        former_top = off.bbox[3]                                                 
-        wgs84_right, wgs84_top = transformer.transform(former_right,
-                                                       former_top)
+    return WGS84conversions([off])[0]
     
-        return (wgs84_bottom, wgs84_left, wgs84_top, wgs84_right)
-        
-    except:
+    
+    
+def WGS84conversions(offerings):
+    """
+    Same as WGS84conversion, for a list of offerings at once. All bounding 
+    boxes are reprojected in a single pass, with one cached transformer per 
+    SRS code (see reprojection.BboxReprojector).
+    
+    argument: 
+        >>> offerings: 
+            list of owslib.swe.observation.sos200 offering objects.
+    
+    return value:
+        >>> wgs84_bboxes:
+            list of (wgs84_bottom, wgs84_left, wgs84_top, wgs84_right) tuples,
+            in the same order as offerings. Offerings with no bounding box 
+            get None, and offerings whose SRS is unknown keep their original 
+            coordinates.
+    """
+    
+    if not offerings:
+        return []
         
+    codes = []
+    bboxes = []
+    for off in offerings:
+        try:
+            codes.append(off.bbox_srs.getcode())
+        except:
+            codes.append(None)
         if off.bbox is not None:
-            left = off.bbox[0]
-            bottom = off.bbox[1]
-            right = off.bbox[2]
-            top = off.bbox[3]  
-            return (bottom, left, top, right)
-            
+            bboxes.append(off.bbox[:4])
         else:
-            return off.bbox
+            bboxes.append((float('nan'),) * 4)
+            
+    wgs84_bboxes = wgs84_reprojector.reprojectBboxes(codes, bboxes)
+    
+    return [tuple(wgs84_bbox.tolist()) if off.bbox is not None else None 
+            for off, wgs84_bbox in zip(offerings, wgs84_bboxes)]
 
 
 
-class GetOfferingsList:
+class StationIndex:
     """
-    Create a list of offering when given a station of a given SOS 2.0 
-    server, using its WGS84 spatial information to identify 
-    this station. 
+    Index the offerings of a SOS 2.0 server by station, once per 
+    GetCapabilities response, so that the offerings and observed properties 
+    of a station are then looked up without scanning (and reprojecting) 
+    every offering of the server again.
+    
+    As everywhere else in this plugin, a station is identified by the WGS84 
+    bounding box of its offerings (see WGS84conversion). Stations are 
+    numbered in order of first appearance in the GetCapabilities response.
+    
+    argument: 
+        >>> sos: 
+            class 'owslib.swe.observation.sos200.SensorObservationService_2_0_0'
+            object, or ServiceDescription object.
+    
+    attributes:
+        >>> station_list:
+            list of station keys (WGS84 bounding boxes), indexed by station 
+            number.
+        >>> offerings:
+            dict mapping each station key to the list of its offerings 
+            (owslib.swe.observation.sos200 offering objects).
+        >>> observed_properties:
+            dict mapping each offering id to the list of its observed 
+            properties (strings).
     
     """
     
-    def __init__(self, sos, WGS84bbox):
-        self.offering_list = []
-        for off in sos.offerings:
-            if WGS84conversion(off) == WGS84bbox:
-                self.offering_list.append(off)
+    def __init__(self, sos):
+        self.station_list = []
+        self.offerings = {}
+        self.observed_properties = {}
+        
+        # Reproject every offering bounding box in a single pass.
+        offerings = list(sos.offerings)
+        for off, station in zip(offerings, WGS84conversions(offerings)):
+            if station not in self.offerings:
+                self.offerings[station] = []
+                self.station_list.append(station)
+            self.offerings[station].append(off)
+            self.observed_properties[off.id] = list(off.observed_properties)
+            
+    def getStation(self, station_number):
+        """Return the key of the station numbered station_number."""
+        return self.station_list[station_number]
+        
+    def getOfferings(self, station):
+        """Return the list of offerings of a station given its key."""
+        return self.offerings.get(station, [])
+        
+    def getOffering(self, station_number, offering_number):
+        """Return an offering given its station and offering numbers."""
+        station = self.station_list[station_number]
+        return self.offerings[station][offering_number]
+        
+    def getObservedProperties(self, offering_id):
+        """Return the list of observed properties of an offering."""
+        return self.observed_properties.get(offering_id, [])
                 
  
+class OfferingDescription:
+    """
+    Picklable copy of the offering information used by this plugin.
+    
+    argument: 
+        >>> off: 
+            owslib.swe.observation.sos200 offering object as defined by OWSLib 
+            library.
+    
+    """
+    
+    def __init__(self, off):
+        self.id = off.id
+        self.name = off.name
+        self.bbox = off.bbox
+        self.bbox_srs = off.bbox_srs
+        self.begin_position = off.begin_position
+        self.end_position = off.end_position
+        self.procedures = list(off.procedures)
+        self.observed_properties = list(off.observed_properties)
+        self.features_of_interest = list(off.features_of_interest)
+        self.response_formats = list(off.response_formats)
+        self.observation_models = list(off.observation_models)
+        
+        
+        
+class OperationDescription:
+    """
+    Picklable copy of an operation metadata advertised by a SOS server.
+    
+    argument: 
+        >>> op: 
+            owslib.ows.OperationsMetadata object.
+    
+    """
+    
+    def __init__(self, op):
+        self.name = op.name
+        self.methods = [{'type': m['type'], 'url': m['url']} 
+                        for m in op.methods]
+        self.parameters = dict((name, {'values': list(p.get('values', []))}) 
+                               for name, p in op.parameters.items())
+                               
+                               
+                               
+class ServiceDescription:
+    """
+    Picklable copy of the GetCapabilities information used by this plugin, 
+    which can be used instead of the OWSLib service object wherever the 
+    plugin needs one, and stored on disk along with the station index 
+    (see loadCapabilities).
+    
+    arguments: 
+        >>> sos: 
+            class 'owslib.swe.observation.sos200.SensorObservationService_2_0_0'
+            object.
+        >>> url: 
+            SOS service URL (string).
+    
+    """
+    
+    def __init__(self, sos, url):
+        self.url = url
+        self.version = sos.version
+        self.operations = [OperationDescription(op) for op in sos.operations]
+        self.offerings = [OfferingDescription(off) for off in sos.offerings]
+        filters = getattr(sos, 'filters', None)
+        self.spatial_operators = (list(filters.spatial_operators) 
+                                  if filters is not None else [])
+        self.capabilities = None    # ServerCapabilities object (see 
+                                    # probeCapabilities).
+        
+    def getOperationByName(self, name):
+        """Return a named operation, as OWSLib service objects do."""
+        for op in self.operations:
+            if op.name == name:
+                return op
+        raise KeyError("No operation named %s" % name)
+        
+        
+        
+class ServerCapabilities:
+    """
+    Retrieval features supported by a SOS server, which are used to choose 
+    the cheapest way of retrieving time series (see chooseStrategy).
+    
+    attributes:
+        >>> result_handling:
+            GetResultTemplate and GetResult operations are advertised.
+        >>> json_binding:
+            the server answers JSON encoded requests (see 
+            probeJsonBinding).
+        >>> data_availability:
+            GetDataAvailability operation is advertised.
+        >>> spatial_filter:
+            GetObservation requests can be filtered by bounding box.
+    
+    Several observed properties can always be asked for in a single 
+    GetObservation request, which is part of SOS 2.0 core.
+    
+    """
+    
+    FEATURES = [('result_handling', 'GetResult'), 
+                ('json_binding', 'JSON'), 
+                ('data_availability', 'GetDataAvailability'), 
+                ('spatial_filter', 'spatial filter')]
+    
+    def __init__(self):
+        for attribute, name in self.FEATURES:
+            setattr(self, attribute, False)
+            
+    def getSupported(self):
+        """Return the names of supported features (list of strings)."""
+        return [name for attribute, name in self.FEATURES 
+                if getattr(self, attribute)]
+                
+                
+                
+# Connect and read timeouts (seconds) of the JSON binding probe, which is 
+# sent while the GetCapabilities response is loaded: a server which does 
+# not answer JSON requests must not hold the plugin for long.
+JSON_PROBE_TIMEOUT = (5, 10)
+
+
+
+def probeCapabilities(sos, timeout=JSON_PROBE_TIMEOUT):
+    """
+    Find out which retrieval features a SOS 2.0 server supports, from its 
+    GetCapabilities response and, for the JSON binding which is not 
+    advertised, from a small request (see probeJsonBinding).
+    
+    arguments: 
+        >>> sos: 
+            ServiceDescription object.
+        >>> timeout: 
+            (connect timeout, read timeout) tuple or timeout in seconds of 
+            the JSON binding probe.
+    
+    return value:
+        >>> capabilities:
+            ServerCapabilities object.
+    """
+    
+    capabilities = ServerCapabilities()
+    capabilities.result_handling = supportsResultHandling(sos)
+    try:
+        sos.getOperationByName('GetDataAvailability')
+        capabilities.data_availability = True
+    except KeyError:
+        pass
+    try:
+        operation = sos.getOperationByName('GetObservation')
+    except KeyError:
+        return capabilities
+        
+    capabilities.spatial_filter = (
+        'BBOX' in getattr(sos, 'spatial_operators', []) 
+        or 'spatialFilter' in operation.parameters)
+    capabilities.json_binding = probeJsonBinding(sos, timeout)
+    
+    return capabilities
+    
+    
+    
+def probeJsonBinding(sos, timeout=JSON_PROBE_TIMEOUT):
+    """
+    Return True if a SOS server answers JSON encoded requests (see 
+    getJsonURL), which is checked with a JSON GetCapabilities request for 
+    the service identification only. Any failure, including a timeout, 
+    gives False: the result is then kept with the GetCapabilities response 
+    in the capabilities cache (see loadCapabilities), so that the server 
+    is not probed again until its response changes.
+    """
+    
+    request = {'request': 'GetCapabilities', 
+               'service': 'SOS', 
+               'sections': ['ServiceIdentification']}
+    try:
+        response = transport.post(getJsonURL(sos), json.dumps(request), 
+                                  headers={'Content-Type': 'application/json', 
+                                           'Accept': 'application/json'}, 
+                                  timeout=timeout)
+        json.loads(response.content.decode('utf-8'))
+    except Exception:
+        return False
+        
+    return 'json' in response.headers.get('Content-Type', '')
+    
+    
+    
+# Retrieval paths of a single time series, from the cheapest, and 
+# description of every retrieval path, as recorded by 
+# retrieval.RetrievalMonitor objects.
+RETRIEVAL_STRATEGIES = ['result', 'json', 'xml']
+RETRIEVAL_PATHS = {
+    'result': 'GetResult (SWE text)', 
+    'json': 'GetObservation (JSON)', 
+    'xml': 'GetObservation (OM 2.0 XML)', 
+    'properties': 'GetObservation of several observed properties '
+                  '(OM 2.0 XML)', 
+    'area': 'GetObservation with spatial filter (OM 2.0 XML)', 
+}
+
+
+
+def chooseStrategy(sos, override='auto'):
+    """
+    Choose the cheapest way of retrieving a time series from a SOS server: 
+    GetResult requests, JSON GetObservation requests or OM 2.0 
+    GetObservation requests, in this order, depending on the features the 
+    server supports (see probeCapabilities).
+    
+    arguments: 
+        >>> sos: 
+            ServiceDescription object, or OWSLib service object.
+        >>> override: 
+            'auto', or one of RETRIEVAL_STRATEGIES to use it whatever the 
+            server supports.
+    
+    return value:
+        >>> strategy:
+            one of RETRIEVAL_STRATEGIES.
+    """
+    
+    if override in RETRIEVAL_STRATEGIES:
+        return override
+    capabilities = getattr(sos, 'capabilities', None)
+    if capabilities is None:
+        return 'xml'
+    if capabilities.result_handling:
+        return 'result'
+    if capabilities.json_binding:
+        return 'json'
+        
+    return 'xml'
+    
+    
+    
+def getStrategyArguments(sos, strategy):
+    """
+    Return the getSeriesSOS200 arguments (dict) of a retrieval strategy 
+    (see chooseStrategy). GetResult requests fall back on JSON 
+    GetObservation requests when the server supports them, and then on 
+    OM 2.0 ones.
+    
+    arguments: 
+        >>> sos: 
+            ServiceDescription object, or OWSLib service object.
+        >>> strategy: 
+            one of RETRIEVAL_STRATEGIES.
+    """
+    
+    capabilities = getattr(sos, 'capabilities', None)
+    json_binding = capabilities is not None and capabilities.json_binding
+    
+    return {'result_handling': strategy == 'result', 
+            'json_binding': (strategy == 'json' 
+                             or (strategy == 'result' and json_binding))}
+    
+    
+    
+def recordPath(monitor, path):
+    """Record a retrieval path (see RETRIEVAL_PATHS) in a monitor, if any."""
+    
+    if monitor is not None:
+        monitor.recordPath(path)
+        
+        
+        
+def recordTiming(monitor, offering, stream, observations, starting_time=None, 
+                 ending_time=None):
+    """
+    Record the timing of a completed request in a monitor, if any (see 
+    retrieval.RetrievalMonitor.recordTiming).
+    
+    arguments: 
+        >>> monitor: 
+            retrieval.RetrievalMonitor object, or None.
+        >>> offering: 
+            requested offering id (string).
+        >>> stream: 
+            transport.ResponseStream object of the request.
+        >>> observations: 
+            number (int) of received observations.
+        >>> starting_time, ending_time: 
+            requested time period (datetime objects), if the observations 
+            belong to a single time series, or None.
+    """
+    
+    if monitor is None:
+        return
+    period = None
+    if starting_time is not None and ending_time is not None:
+        period = (ending_time - starting_time).total_seconds()
+    monitor.recordTiming(offering, stream.latency, observations, 
+                         stream.getDuration(), period)
+                         
+                         
+                         
+def updateThroughput(sos, cache, monitor):
+    """
+    Update the throughput of a SOS server stored in the cache for each 
+    offering (see retrieval.Throughput) with the timings of the requests 
+    of a retrieval.
+    
+    arguments: 
+        >>> sos: 
+            class 'owslib.swe.observation.sos200.SensorObservationService_2_0_0'
+            object, or ServiceDescription object.
+        >>> cache:
+            cache.ObservationCache object.
+        >>> monitor:
+            retrieval.RetrievalMonitor object of the retrieval.
+    """
+    
+    url = getObservationURL(sos)
+    by_offering = {}
+    for timing in monitor.timings:
+        by_offering.setdefault(timing[0], []).append(timing[1:])
+    for offering, timings in by_offering.items():
+        throughput = cache.getThroughput(url, offering) or Throughput()
+        for latency, observations, duration, period in timings:
+            throughput.update(latency, observations, duration, period)
+        cache.storeThroughput(url, offering, throughput)
+        
+        
+        
+def loadCapabilities(service_url, cache=None, ttl=3600, 
+                     timeout=DEFAULT_TIMEOUT):
+    """
+    Retrieve and parse the GetCapabilities response of a SOS 2.0 server, 
+    using the on-disk cache when possible, and probe the retrieval 
+    features the server supports (see probeCapabilities).
+    
+    A cached response younger than ttl is used as is. An older one is 
+    revalidated with the server (If-None-Match / If-Modified-Since 
+    headers), and only downloaded and parsed again if it has changed.
+    
+    arguments: 
+        >>> service_url: 
+            SOS service URL (string).
+        >>> cache: 
+            cache.CapabilitiesCache object, or None.
+        >>> ttl: 
+            time (number) in seconds during which a cached response is used 
+            without revalidation.
+        >>> timeout: 
+            (connect timeout, read timeout) tuple or timeout in seconds, or 
+            None.
+    
+    return values:
+        >>> sos:
+            ServiceDescription object.
+        >>> stations:
+            StationIndex object.
+        >>> content:
+            GetCapabilities response (string).
+    """
+    
+    capabilities_url = (service_url + '?REQUEST=GetCapabilities'
+                        '&SERVICE=SOS&ACCEPTVERSIONS=2.0.0')
+                        
+    entry = cache.load(capabilities_url) if cache is not None else None
+    headers = {}
+    if entry is not None:
+        if time.time() - entry['fetched'] < ttl:
+            return entry['state'] + (entry['content'],)
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+            
+    response = transport.get(capabilities_url, headers=headers, 
+                             timeout=timeout)
+    if response.status_code == 304 and entry is not None:
+        # Cached response is still valid.
+        cache.touch(capabilities_url, entry)
+        return entry['state'] + (entry['content'],)
+        
+    owslib_sos = SensorObservationService(None, xml=response.content, 
+                                          version="2.0.0")
+    sos = ServiceDescription(owslib_sos, service_url)
+    # The probe has its own short timeout (see JSON_PROBE_TIMEOUT).
+    sos.capabilities = probeCapabilities(sos)
+    stations = StationIndex(sos)
+    if cache is not None and response.status_code == 200:
+        cache.save(capabilities_url, response.content, response.headers, 
+                   (sos, stations))
+                   
+    return sos, stations, response.content
+    
+    
+    
+def findStationsInArea(stations, area):
+    """
+    Return the numbers (list of int) of the stations located in a WGS84 
+    (xmin, ymin, xmax, ymax) bounding box (long/lat), at the point shown 
+    on the 'Features of interest' layer.
+    """
+    
+    xmin, ymin, xmax, ymax = area
+    station_numbers = []
+    for station_number, station in enumerate(stations.station_list):
+        if station is None:
+            continue
+        lat = min(station[0], station[2])
+        lon = min(station[1], station[3])
+        if xmin <= lon <= xmax and ymin <= lat <= ymax:
+            station_numbers.append(station_number)
+            
+    return station_numbers
+    
+    
                
-def getCapabilitiesSOS200(getcap_response):
+def getCapabilitiesSOS200(getcap_content):
     """
     Retrieve information from GetCapabilities response,
     and then show the window displaying it.
     
     argument: 
-        >>> getcap_response: 
-            class 'requests.models.Response' object containing GetCapabilities 
-            request response retrieved from HTTP "Get" response.
+        >>> getcap_content: 
+            GetCapabilities request response (string) retrieved from HTTP 
+            "Get" response.
 
     """
     
@@ -102,7 +604,7 @@ def getCapabilitiesSOS200(getcap_response):
     # located in "ui" subdirectory. 
     cap_window = GetCapabilityWindow()
     
-    sos = SensorObservationService(None,xml=getcap_response.content)
+    sos = SensorObservationService(None,xml=getcap_content)
     sos_id = sos.identification
     cap_window.title_value.setPlainText(sos_id.title)
     cap_window.abstract_value.setPlainText(sos_id.abstract)
@@ -124,8 +626,1163 @@ def getCapabilitiesSOS200(getcap_response):
 
 
 
+def getObservationURL(sos):
+    """
+    Return the GetObservation "Get" URL advertised by a SOS 2.0 server 
+    (string), which is also used by this plugin to identify the server.
+    """
+    
+    return getOperationURL(sos, 'GetObservation')
+    
+    
+    
+def getOperationURL(sos, name):
+    """
+    Return the "Get" URL (string) advertised by a SOS 2.0 server for a 
+    named operation, or the service URL.
+    """
+    
+    try:
+        methods = sos.getOperationByName(name).methods
+        return [m['url'] for m in methods if m['type'].lower() == 'get'][0]
+    except:
+        return sos.url
+        
+        
+        
+def supportsResultHandling(sos):
+    """
+    Return True if a SOS 2.0 server advertises the GetResultTemplate and 
+    GetResult operations of the Result Handling extension.
+    """
+    
+    for name in ('GetResultTemplate', 'GetResult'):
+        try:
+            sos.getOperationByName(name)
+        except KeyError:
+            return False
+            
+    return True
+        
+        
+        
+def getObservationRequest(sos, offerings, observedProperties, responseFormat, 
+                          eventTime, **kwargs):
+    """
+    Build a KVP GetObservation request, the same way OWSLib library does, 
+    so that it can be sent by the plugin itself.
+    
+    arguments: 
+        >>> sos: 
+            class 'owslib.swe.observation.sos200.SensorObservationService_2_0_0'
+            object.
+        >>> offerings: 
+            list of offering ids (strings), which may be empty.
+        >>> observedProperties: 
+            list of observed properties (strings).
+        >>> responseFormat: 
+            response format (string).
+        >>> eventTime: 
+            temporal filter (string).
+        >>> **kwargs: 
+            additional request parameters, such as namespaces.
+    
+    return values:
+        >>> url:
+            GetObservation "Get" URL advertised by the server (string).
+        >>> params:
+            dict of request parameters.
+    """
+    
+    url = getObservationURL(sos)
+    params = {'service': 'SOS', 
+              'version': sos.version, 
+              'request': 'GetObservation',
+              'observedProperty': ','.join(observedProperties),
+              'responseFormat': responseFormat,
+              'temporalFilter': eventTime}
+    if offerings:
+        # Offerings are optional, e.g. when filtering by area.
+        params['offering'] = ','.join(offerings)
+    params.update(kwargs)
+    
+    return url, params
+    
+    
+    
+def getSpatialFilter(area):
+    """
+    Return the KVP spatialFilter parameter (string) selecting the features 
+    of interest whose sampling shape lies in a WGS84 bounding box, given as 
+    (xmin, ymin, xmax, ymax) long/lat tuple. Coordinates are written in 
+    EPSG:4326 axis order, that is latitude first.
+    """
+    
+    xmin, ymin, xmax, ymax = area
+    
+    return ('om:featureOfInterest/*/sams:shape,%r,%r,%r,%r,'
+            'http://www.opengis.net/def/crs/EPSG/0/4326' 
+            % (float(ymin), float(xmin), float(ymax), float(xmax)))
+    
+    
+    
+def openObservationStream(sos, offerings, observedProperties, starting_time, 
+                          ending_time, timeout=DEFAULT_TIMEOUT, monitor=None, 
+                          area=None, **kwargs):
+    """
+    Send a GetObservation request for OM 2.0 observations, and return its 
+    response as a stream.
+    
+    arguments: 
+        >>> sos: 
+            class 'owslib.swe.observation.sos200.SensorObservationService_2_0_0'
+            object.
+        >>> offerings: 
+            list of offering ids (strings).
+        >>> observedProperties: 
+            list of observed properties (strings).
+        >>> starting_time: 
+            datetime object.
+        >>> ending_time:
+            datetime object.
+        >>> timeout:
+            (connect timeout, read timeout) tuple or timeout in seconds, or 
+            None.
+        >>> monitor:
+            retrieval.RetrievalMonitor object following the progress of 
+            the request, or None.
+        >>> area:
+            (xmin, ymin, xmax, ymax) WGS84 bounding box (long/lat) of the 
+            features of interest whose observations are requested (see 
+            getSpatialFilter), or None.
+        >>> **kwargs: 
+            additional request parameters.
+    
+    return value:
+        >>> stream:
+            transport.ResponseStream object.
+    """
+    
+    # Selecting format.
+    omFormat = 'http://www.opengis.net/om/2.0'
+        
+    # Adding namespace.
+    namespace = 'xmlns(om,http://www.opengis.net/om/2.0)'
+    
+    # Selecting area.
+    if area is not None:
+        namespace += (',xmlns(sams,'
+                      'http://www.opengis.net/samplingSpatial/2.0)')
+        kwargs['spatialFilter'] = getSpatialFilter(area)
+    
+    # Selecting time period.
+    event_time = ("om:phenomenonTime," + starting_time.isoformat() + "/" 
+                  + ending_time.isoformat())
+    
+    url, params = getObservationRequest(sos, 
+                                        offerings, 
+                                        observedProperties, 
+                                        omFormat, 
+                                        event_time, 
+                                        namespaces=namespace, 
+                                        **kwargs)
+    
+    return openStream(url, params, timeout=timeout, monitor=monitor)
+    
+    
+    
+def fetchObservations(sos, offerings, observedProperties, starting_time, 
+                      ending_time, timeout=DEFAULT_TIMEOUT, monitor=None, 
+                      **kwargs):
+    """
+    Send a GetObservation request and parse its response while it is being 
+    received (see parsing.parseMeasurements).
+    
+    arguments: 
+        >>> sos, offerings, observedProperties, starting_time, ending_time, 
+            timeout, monitor, **kwargs: 
+            see openObservationStream.
+    
+    return values:
+        >>> series:
+            timeseries.TimeSeries object of UTC result times and result 
+            values. Its offering and observed property are the first ones 
+            requested.
+        >>> response:
+            beginning of GetObservation response (string).
+    """
+    
+    stream = openObservationStream(sos, offerings, observedProperties, 
+                                   starting_time, ending_time, 
+                                   timeout=timeout, monitor=monitor, **kwargs)
+    try:
+        # OM_Measurement observations are read directly from XML, 
+        # other observation types are decoded by OWSLib library.
+        series = parseMeasurements(stream, monitor=monitor)
+    finally:
+        stream.close()
+    series.offering = offerings[0]
+    series.observed_property = observedProperties[0]
+    recordTiming(monitor, offerings[0], stream, len(series), starting_time, 
+                 ending_time)
+        
+    return series, stream.head
+    
+    
+    
+# Maximum number of offerings of each GetDataAvailability request, so that 
+# KVP request URLs stay short.
+AVAILABILITY_BATCH = 20
+
+# Time (seconds) during which a failed GetResultTemplate request is not 
+# sent again (see findResultTemplate).
+RESULT_TEMPLATE_FAILURE_TTL = 86400
+
+
+
+def getDataAvailability(sos, offerings, cache=None, ttl=3600, 
+                        timeout=DEFAULT_TIMEOUT, monitor=None):
+    """
+    Retrieve the exact time period, and the number of observations when 
+    the server gives it, of every time series of some offerings, with 
+    GetDataAvailability requests for AVAILABILITY_BATCH offerings at once. 
+    The availability of each offering is read from the cache if it has 
+    been retrieved less than ttl seconds ago.
+    
+    arguments: 
+        >>> sos: 
+            class 'owslib.swe.observation.sos200.SensorObservationService_2_0_0'
+            object, or ServiceDescription object.
+        >>> offerings: 
+            list of offering objects (see OfferingDescription).
+        >>> cache:
+            cache.ObservationCache object, or None.
+        >>> ttl:
+            time (seconds) during which a retrieved availability is used.
+        >>> timeout:
+            (connect timeout, read timeout) tuple or timeout in seconds, or 
+            None.
+        >>> monitor:
+            retrieval.RetrievalMonitor object, checked for cancellation 
+            between requests, or None.
+    
+    return value:
+        >>> availability:
+            dict mapping (offering id, observed property) tuples to 
+            (starting_time, ending_time, count) tuples, with UTC datetime 
+            objects and a number of observations or None. Time series 
+            without any observation are left out.
+    """
+    
+    url = getObservationURL(sos)
+    ids = [off.id for off in offerings]
+    if cache is not None:
+        availability, missing = cache.getAvailability(url, ids, ttl)
+    else:
+        availability, missing = {}, ids
+        
+    by_id = dict((off.id, off) for off in offerings)
+    for i in range(0, len(missing), AVAILABILITY_BATCH):
+        if monitor is not None and monitor.isCancelled():
+            raise RetrievalCancelled()
+        batch = [by_id[offering_id] 
+                 for offering_id in missing[i:i + AVAILABILITY_BATCH]]
+        params = {'service': 'SOS', 
+                  'version': sos.version, 
+                  'request': 'GetDataAvailability',
+                  'offering': ','.join(off.id for off in batch)}
+        operation_url = getOperationURL(sos, 'GetDataAvailability')
+        try:
+            # Version 2.0 responses give observation counts.
+            response = transport.get(operation_url, 
+                                     params=dict(params, 
+                                                 responseFormat=GDA20_NS), 
+                                     timeout=timeout)
+            members = parseDataAvailability(response.content)
+        except ows.ExceptionReport:
+            response = transport.get(operation_url, params=params, 
+                                     timeout=timeout)
+            members = parseDataAvailability(response.content)
+        found = mergeAvailability(batch, members)
+        if cache is not None:
+            cache.storeAvailability(url, [off.id for off in batch], found)
+        availability.update(found)
+        
+    return availability
+    
+    
+    
+def mergeAvailability(offerings, members):
+    """
+    Merge the members of a GetDataAvailability response (see 
+    parsing.parseDataAvailability) into the availability of the time 
+    series of some offerings (see getDataAvailability). Members without 
+    offering are given to the offerings declaring their procedure and 
+    observed property, and the members of a time series (one per feature 
+    of interest) are merged into one.
+    """
+    
+    by_procedure = {}
+    for off in offerings:
+        for procedure in off.procedures:
+            by_procedure.setdefault(procedure, []).append(off)
+            
+    availability = {}
+    for member in members:
+        prop = member['observed_property']
+        if member['offering'] is not None:
+            targets = [off for off in offerings 
+                       if off.id == member['offering']]
+        else:
+            targets = by_procedure.get(member['procedure'], [])
+        for off in targets:
+            if prop not in off.observed_properties:
+                continue
+            key = (off.id, prop)
+            if key not in availability:
+                availability[key] = (member['starting_time'], 
+                                     member['ending_time'], member['count'])
+                continue
+            starting_time, ending_time, count = availability[key]
+            if count is not None and member['count'] is not None:
+                count += member['count']
+            else:
+                count = None
+            availability[key] = (min(starting_time, member['starting_time']), 
+                                 max(ending_time, member['ending_time']), 
+                                 count)
+                                 
+    return availability
+    
+    
+    
+def getResultTemplate(sos, offering, prop, cache=None, 
+                      timeout=DEFAULT_TIMEOUT):
+    """
+    Retrieve the result template of a time series (GetResultTemplate 
+    request), or read it from the cache, where it is stored once retrieved.
+    
+    arguments: 
+        >>> sos: 
+            class 'owslib.swe.observation.sos200.SensorObservationService_2_0_0'
+            object, or ServiceDescription object.
+        >>> offering: 
+            offering id (string).
+        >>> prop: 
+            observed property (string).
+        >>> cache:
+            cache.ObservationCache object, or None.
+        >>> timeout:
+            (connect timeout, read timeout) tuple or timeout in seconds, or 
+            None.
+    
+    return value:
+        >>> template:
+            parsing.ResultTemplate object (see parsing.parseResultTemplate 
+            for raised exceptions).
+    """
+    
+    url = getObservationURL(sos)
+    content = None
+    if cache is not None:
+        content = cache.getResultTemplate(url, offering, prop)
+    if content is None:
+        params = {'service': 'SOS', 
+                  'version': sos.version, 
+                  'request': 'GetResultTemplate',
+                  'offering': offering,
+                  'observedProperty': prop}
+        response = transport.get(getOperationURL(sos, 'GetResultTemplate'), 
+                                 params=params, timeout=timeout)
+        content = response.content
+        template = parseResultTemplate(content, prop)
+        if cache is not None:
+            cache.storeResultTemplate(url, offering, prop, content)
+        return template
+        
+    return parseResultTemplate(content, prop)
+    
+    
+    
+def findResultTemplate(sos, offering, prop, cache=None, 
+                       timeout=DEFAULT_TIMEOUT):
+    """
+    Return the result template of a time series (see getResultTemplate), 
+    or None if it cannot be retrieved, in which case observations are 
+    retrieved with GetObservation requests instead.
+    
+    A GetResultTemplate request which fails for another reason than a 
+    transient one (see retrieval.isTransientError) - e.g. for a 52North 
+    time series inserted without InsertResultTemplate - is recorded in 
+    the cache, and not sent again for RESULT_TEMPLATE_FAILURE_TTL seconds.
+    
+    arguments: 
+        >>> sos, offering, prop, cache, timeout: 
+            see getResultTemplate.
+    """
+    
+    url = getObservationURL(sos)
+    if cache is not None and cache.isResultTemplateUnavailable(
+            url, offering, prop, RESULT_TEMPLATE_FAILURE_TTL):
+        return None
+    try:
+        return getResultTemplate(sos, offering, prop, cache=cache, 
+                                 timeout=timeout)
+    except Exception as e:
+        if (cache is not None and not isTransientError(e) 
+                and not isinstance(e, requests.exceptions.Timeout)):
+            cache.storeResultTemplateFailure(url, offering, prop)
+        return None
+        
+        
+        
+def openResultStream(sos, offering, prop, starting_time, ending_time, 
+                     timeout=DEFAULT_TIMEOUT, monitor=None, **kwargs):
+    """
+    Send a GetResult request for a time series, and return its response 
+    as a stream (see openObservationStream).
+    
+    arguments: 
+        >>> sos, starting_time, ending_time, timeout, monitor, **kwargs: 
+            see openObservationStream.
+        >>> offering: 
+            offering id (string).
+        >>> prop: 
+            observed property (string).
+    
+    return value:
+        >>> stream:
+            transport.ResponseStream object.
+    """
+    
+    params = {'service': 'SOS', 
+              'version': sos.version, 
+              'request': 'GetResult',
+              'offering': offering,
+              'observedProperty': prop,
+              'temporalFilter': ('om:phenomenonTime,' 
+                                 + starting_time.isoformat() + '/' 
+                                 + ending_time.isoformat()),
+              'namespaces': 'xmlns(om,http://www.opengis.net/om/2.0)'}
+    params.update(kwargs)
+    
+    return openStream(getOperationURL(sos, 'GetResult'), params, 
+                      timeout=timeout, monitor=monitor)
+    
+    
+    
+def fetchResults(sos, offering, prop, template, starting_time, ending_time, 
+                 timeout=DEFAULT_TIMEOUT, monitor=None, **kwargs):
+    """
+    Send a GetResult request and parse its compact SWE text response (see 
+    parsing.parseResultValues). Same as fetchObservations, for a single 
+    offering and observed property whose result template is known.
+    
+    arguments: 
+        >>> sos, starting_time, ending_time, timeout, monitor, **kwargs: 
+            see openObservationStream.
+        >>> offering: 
+            offering id (string).
+        >>> prop: 
+            observed property (string).
+        >>> template: 
+            parsing.ResultTemplate object (see getResultTemplate).
+    
+    return values:
+        >>> series:
+            timeseries.TimeSeries object, with offering and observed 
+            property.
+        >>> response:
+            beginning of GetResult response (string).
+    """
+    
+    stream = openResultStream(sos, offering, prop, starting_time, 
+                              ending_time, timeout=timeout, monitor=monitor, 
+                              **kwargs)
+    try:
+        series = parseResultValues(stream, template, monitor=monitor)
+    finally:
+        stream.close()
+    series.offering = offering
+    series.observed_property = prop
+    recordTiming(monitor, offering, stream, len(series), starting_time, 
+                 ending_time)
+    
+    return series, stream.head
+    
+    
+    
+class JsonBindingUnavailable(Exception):
+    """Raised when a SOS server does not answer JSON encoded requests."""
+
+
+
+def getJsonURL(sos):
+    """
+    Return the URL (string) of the JSON binding of a 52North SOS server, 
+    derived from its GetObservation URL (".../sos/kvp" or ".../sos" gives 
+    ".../sos/json").
+    """
+    
+    url = getObservationURL(sos).split('?')[0].rstrip('/')
+    if url.endswith('/kvp'):
+        url = url[:-len('/kvp')]
+        
+    return url + '/json'
+    
+    
+    
+def fetchJsonObservations(sos, offerings, observedProperties, starting_time, 
+                          ending_time, timeout=DEFAULT_TIMEOUT, monitor=None, 
+                          **kwargs):
+    """
+    Same as fetchObservations, through the JSON binding of 52North SOS 
+    servers, whose responses are much cheaper to parse (see 
+    parsing.parseJsonMeasurements). Results, units and server exceptions 
+    are the same as with fetchObservations.
+    
+    arguments: 
+        >>> sos, offerings, observedProperties, starting_time, ending_time, 
+            timeout, monitor: 
+            see openObservationStream.
+        >>> **kwargs: 
+            additional request members.
+    
+    return values:
+        >>> series, response:
+            see fetchObservations. JsonBindingUnavailable is raised if the 
+            server does not answer in JSON.
+    """
+    
+    request = {'request': 'GetObservation', 
+               'service': 'SOS', 
+               'version': sos.version, 
+               'offering': offerings, 
+               'observedProperty': observedProperties, 
+               'temporalFilter': [{'during': {
+                    'ref': 'om:phenomenonTime', 
+                    'value': [starting_time.isoformat(), 
+                              ending_time.isoformat()]}}]}
+    request.update(kwargs)
+    try:
+        stream = openStream(getJsonURL(sos), data=json.dumps(request), 
+                            headers={'Content-Type': 'application/json', 
+                                     'Accept': 'application/json'}, 
+                            timeout=timeout, monitor=monitor)
+    except requests.exceptions.HTTPError as e:
+        raise JsonBindingUnavailable(str(e))
+    try:
+        if 'json' not in stream.response.headers.get('Content-Type', ''):
+            raise JsonBindingUnavailable(
+                stream.response.headers.get('Content-Type', ''))
+        series = parseJsonMeasurements(stream, monitor=monitor)
+    finally:
+        stream.close()
+    series.offering = offerings[0]
+    series.observed_property = observedProperties[0]
+    recordTiming(monitor, offerings[0], stream, len(series), starting_time, 
+                 ending_time)
+    
+    return series, stream.head
+    
+    
+    
+def fetchPropertiesObservations(sos, offering, observedProperties, 
+                                starting_time, ending_time, 
+                                timeout=DEFAULT_TIMEOUT, monitor=None, 
+                                **kwargs):
+    """
+    Send a single GetObservation request for several observed properties 
+    of an offering, and split its response into one time series per 
+    observed property (see parsing.parseMeasurementsByProperty).
+    
+    arguments: 
+        >>> sos, starting_time, ending_time, timeout, monitor, **kwargs: 
+            see openObservationStream.
+        >>> offering: 
+            offering id (string).
+        >>> observedProperties: 
+            list of observed properties (strings).
+    
+    return values:
+        >>> series:
+            list of timeseries.TimeSeries objects, in observedProperties 
+            order. Time series of properties without any observation in 
+            the response are empty.
+        >>> response:
+            beginning of GetObservation response (string).
+    """
+    
+    stream = openObservationStream(sos, [offering], observedProperties, 
+                                   starting_time, ending_time, 
+                                   timeout=timeout, monitor=monitor, **kwargs)
+    try:
+        found = parseMeasurementsByProperty(stream, monitor=monitor)
+    finally:
+        stream.close()
+        
+    series = []
+    for prop in observedProperties:
+        prop_series = found.get(prop) or TimeSeries(observed_property=prop)
+        prop_series.offering = offering
+        series.append(prop_series)
+    # The observation density of a single time series is left unchanged.
+    recordTiming(monitor, offering, stream, 
+                 sum(len(prop_series) for prop_series in series))
+        
+    return series, stream.head
+    
+    
+    
+def getPropertiesSeriesSOS200(sos, station_number, offering_number, 
+                              property_numbers, user_starting_time, 
+                              user_ending_time, stations=None, window=None, 
+                              workers=DEFAULT_WORKERS, monitor=None, 
+                              cache=None, combined=True, 
+                              result_handling=False, json_binding=False, 
+                              **kwargs):
+    """
+    Retrieve the time series of several observed properties of an 
+    offering, with one GetObservation request per time window for all of 
+    them instead of one per observed property.
+    
+    arguments: 
+        >>> sos, station_number, offering_number, user_starting_time, 
+            user_ending_time, stations, window, workers, monitor, cache, 
+            **kwargs: 
+            see getSeriesSOS200 (streaming mode).
+        >>> property_numbers: 
+            list of index numbers of the observed properties in 
+            observed_properties list of selected offering.
+        >>> combined: 
+            if False, e.g. for servers which do not accept several observed 
+            properties, or whose GetResult responses are cheaper, each 
+            observed property is retrieved on its own (see getSeriesSOS200).
+        >>> result_handling, json_binding: 
+            see getSeriesSOS200, when combined is False.
+    
+    return values:
+        >>> series:
+            list of timeseries.TimeSeries objects, in property_numbers 
+            order.
+        >>> response1:
+            beginning of the first GetObservation response (string).
+    """
+    
+    if stations is None:
+        stations = StationIndex(sos)
+        
+    if not combined:
+        results = [getSeriesSOS200(sos, 
+                                   station_number, 
+                                   offering_number, 
+                                   property_number, 
+                                   user_starting_time, 
+                                   user_ending_time, 
+                                   stations=stations, 
+                                   window=window, 
+                                   workers=workers, 
+                                   monitor=monitor, 
+                                   cache=cache, 
+                                   result_handling=result_handling, 
+                                   json_binding=json_binding, 
+                                   **kwargs) 
+                   for property_number in property_numbers]
+        return ([series for series, response in results], 
+                next((response for series, response in results if response), 
+                     ''))
+        
+    off = stations.getOffering(station_number, offering_number)
+    properties = stations.getObservedProperties(off.id)
+    props = [properties[n] for n in property_numbers]
+    url = getObservationURL(sos)
+    
+    def fetch(starting_time, ending_time):
+        series, response = fetchPropertiesObservations(sos, 
+                                                       off.id, 
+                                                       props, 
+                                                       starting_time, 
+                                                       ending_time, 
+                                                       monitor=monitor, 
+                                                       **kwargs)
+        if cache is not None:
+            # Stored window by window, as in getSeriesSOS200.
+            for prop_series in series:
+                cache.store(url, prop_series, starting_time, ending_time)
+        return series, response
+    
+    def retrieve(starting_time, ending_time):
+        recordPath(monitor, 'properties')
+        if window is None:
+            return fetchRetrying(fetch, starting_time, ending_time, 
+                                 monitor=monitor)
+        results = fetchWindows(fetch, starting_time, ending_time, 
+                               window=window, workers=workers, 
+                               monitor=monitor)
+        series = [mergeChunks([r[0][i] for r in results]) 
+                  for i in range(len(props))]
+        return series, results[0][1]
+        
+    if cache is None:
+        return retrieve(user_starting_time, user_ending_time)
+        
+    # Only retrieve the parts of the time period which are not stored in 
+    # the cache yet for every observed property.
+    response1 = ''
+    for gap_starting_time, gap_ending_time in (
+            cache.getCombinedMissingIntervals(url, off.id, props, 
+                                              user_starting_time, 
+                                              user_ending_time)):
+        series, response = retrieve(gap_starting_time, gap_ending_time)
+        response1 = response1 or response
+    series = [cache.read(url, off.id, prop, user_starting_time, 
+                         user_ending_time) for prop in props]
+    
+    return series, response1
+    
+    
+    
+def fetchAreaObservations(sos, prop, area, starting_time, ending_time, 
+                          timeout=DEFAULT_TIMEOUT, monitor=None, **kwargs):
+    """
+    Send a single GetObservation request for an observed property of every 
+    feature of interest of an area, and split its response into one time 
+    series per feature of interest (see parsing.parseMeasurementsByFeature).
+    
+    arguments: 
+        >>> sos, starting_time, ending_time, timeout, monitor, area, 
+            **kwargs: 
+            see openObservationStream.
+        >>> prop: 
+            observed property (string).
+    
+    return values:
+        >>> series:
+            dict mapping each feature of interest (string) to its 
+            timeseries.TimeSeries object.
+        >>> features:
+            dict mapping each feature of interest to its procedure and 
+            position (see parsing.parseMeasurementsByFeature).
+        >>> response:
+            beginning of GetObservation response (string).
+    """
+    
+    stream = openObservationStream(sos, [], [prop], starting_time, 
+                                   ending_time, timeout=timeout, 
+                                   monitor=monitor, area=area, **kwargs)
+    try:
+        series, features = parseMeasurementsByFeature(stream, monitor=monitor)
+    finally:
+        stream.close()
+    for feature_series in series.values():
+        feature_series.observed_property = prop
+        
+    return series, features, stream.head
+    
+    
+    
+def linkFeaturesToStations(stations, prop, features):
+    """
+    Find the station of each feature of interest of a spatially filtered 
+    GetObservation response, among the stations observing prop: the 
+    station with an offering declaring the procedure or the feature of 
+    interest of the observations or, failing that, the station whose 
+    bounding box contains the position of the feature of interest.
+    
+    arguments: 
+        >>> stations: 
+            StationIndex object.
+        >>> prop: 
+            observed property (string).
+        >>> features: 
+            dict mapping features of interest to their procedure and 
+            position (see parsing.parseMeasurementsByFeature).
+    
+    return value:
+        >>> links:
+            dict mapping each feature of interest to its (station number, 
+            offering id) tuple, or to None if no station was found.
+    """
+    
+    by_procedure = {}
+    by_feature = {}
+    boxes = []
+    for station_number, station in enumerate(stations.station_list):
+        for off in stations.getOfferings(station):
+            if prop not in stations.getObservedProperties(off.id):
+                continue
+            link = (station_number, off.id)
+            for procedure in off.procedures:
+                by_procedure.setdefault(procedure, link)
+            for feature in getattr(off, 'features_of_interest', []):
+                by_feature.setdefault(feature, link)
+            if station is not None:
+                boxes.append((station, link))
+                
+    links = {}
+    for feature, description in features.items():
+        link = (by_procedure.get(description['procedure']) 
+                or by_feature.get(feature))
+        position = description['position']
+        if link is None and position is not None:
+            lat, lon = position
+            for (bottom, left, top, right), station_link in boxes:
+                # Station bounding boxes are often single points: allow 
+                # for rounding of coordinates.
+                if (min(bottom, top) - 1e-6 <= lat <= max(bottom, top) + 1e-6 
+                        and min(left, right) - 1e-6 <= lon 
+                        <= max(left, right) + 1e-6):
+                    link = station_link
+                    break
+        links[feature] = link
+        
+    return links
+    
+    
+    
+def getAreaSeriesSOS200(sos, prop, area, user_starting_time, user_ending_time, 
+                        stations=None, window=None, workers=DEFAULT_WORKERS, 
+                        monitor=None, result_handling=False, 
+                        json_binding=False, **kwargs):
+    """
+    Retrieve the time series of an observed property for every feature of 
+    interest of an area, with one spatially filtered GetObservation request 
+    per time window instead of one request per station.
+    
+    arguments: 
+        >>> sos, user_starting_time, user_ending_time, stations, window, 
+            workers, monitor, **kwargs: 
+            see getSeriesSOS200 (streaming mode).
+        >>> prop: 
+            observed property (string).
+        >>> area: 
+            (xmin, ymin, xmax, ymax) WGS84 bounding box (long/lat).
+        >>> result_handling, json_binding:
+            retrieval strategy arguments (see getStrategyArguments), so 
+            that area retrievals are given the same arguments as station 
+            retrievals. They do not change the requests: spatially 
+            filtered requests are always OM 2.0 GetObservation requests, 
+            since only their responses are split by feature of interest.
+    
+    return values:
+        >>> results:
+            list of (timeseries.TimeSeries object, station number) tuples, 
+            one per feature of interest, sorted by station number (see 
+            linkFeaturesToStations). The offering of each time series is 
+            the offering of its station, or the feature of interest itself 
+            when no station was found, in which case station number is 
+            None.
+        >>> response1:
+            beginning of the first GetObservation response (string).
+    """
+    
+    if stations is None:
+        stations = StationIndex(sos)
+        
+    fetch = lambda starting_time, ending_time: fetchAreaObservations(
+                                    sos, 
+                                    prop, 
+                                    area, 
+                                    starting_time, 
+                                    ending_time, 
+                                    monitor=monitor, 
+                                    **kwargs)
+    recordPath(monitor, 'area')
+    
+    if window is None:
+        chunks = [fetchRetrying(fetch, user_starting_time, user_ending_time, 
+                                monitor=monitor)]
+    else:
+        chunks = fetchWindows(fetch, user_starting_time, user_ending_time, 
+                              window=window, workers=workers, monitor=monitor)
+        
+    # Features of interest may differ from one time window to the next.
+    features = {}
+    for chunk_series, chunk_features, response in chunks:
+        for feature, description in chunk_features.items():
+            features.setdefault(feature, description)
+    links = linkFeaturesToStations(stations, prop, features)
+    
+    results = []
+    for feature in features:
+        series = mergeChunks([chunk[0][feature] for chunk in chunks 
+                              if feature in chunk[0]])
+        link = links[feature]
+        # Several features of interest may be linked to the same station.
+        series.feature_of_interest = feature
+        if link is None:
+            series.offering = feature
+            results.append((series, None))
+        else:
+            series.offering = link[1]
+            results.append((series, link[0]))
+    results.sort(key=lambda result: (result[1] is None, result[1], 
+                                     result[0].offering))
+    
+    return results, chunks[0][2]
+    
+    
+    
+def selectSeries(stations, station_number, offering_number, property_number):
+    """
+    Return the (offering id, observed property) strings pair selected by 
+    station, offering and observed property numbers (see StationIndex).
+    """
+    
+    off = stations.getOffering(station_number, offering_number)
+    
+    return off.id, stations.getObservedProperties(off.id)[property_number]
+    
+    
+    
+def findStationSeries(stations, station_number, prop):
+    """
+    Return the (offering number, observed property number) pair of the 
+    first offering of a station which observes prop, or None.
+    """
+    
+    station = stations.getStation(station_number)
+    for offering_number, off in enumerate(stations.getOfferings(station)):
+        properties = stations.getObservedProperties(off.id)
+        if prop in properties:
+            return offering_number, properties.index(prop)
+            
+    return None
+    
+    
+    
+def getStationsSeriesSOS200(sos, station_numbers, prop, user_starting_time, 
+                            user_ending_time, stations=None, 
+                            workers=DEFAULT_WORKERS, monitor=None, plans=None, 
+                            **kwargs):
+    """
+    Retrieve the time series of the same observed property for several 
+    stations, up to 'workers' stations at the same time.
+    
+    For each station, the first offering observing prop is used. Stations 
+    with no such offering are skipped.
+    
+    arguments: 
+        >>> sos, user_starting_time, user_ending_time, stations, monitor, 
+            **kwargs: 
+            see getSeriesSOS200. Time windows of each station are retrieved 
+            one after the other.
+        >>> station_numbers: 
+            list of index numbers (int) of the stations in StationIndex 
+            station_list.
+        >>> prop: 
+            observed property (string).
+        >>> workers: 
+            maximum number (int) of stations retrieved at the same time.
+        >>> plans:
+            dict giving the (window, timeout) arguments of the requests of 
+            each station number, e.g. chosen by retrieval.planRetrieval 
+            from the expected number of observations of the station, or 
+            None. Stations which are not in plans use the window and 
+            timeout arguments.
+    
+    return values:
+        >>> results:
+            list of (timeseries.TimeSeries object, response) tuples, in 
+            station_numbers order (see getSeriesSOS200).
+        >>> failures:
+            list of (offering id, error message) tuples (strings) of the 
+            stations whose retrieval failed.
+    """
+    
+    if stations is None:
+        stations = StationIndex(sos)
+    selections = []
+    for station_number in station_numbers:
+        numbers = findStationSeries(stations, station_number, prop)
+        if numbers is not None:
+            selections.append((station_number,) + numbers)
+            
+    def retrieve(selection):
+        station_number, offering_number, property_number = selection
+        arguments = dict(kwargs)
+        if plans is not None and station_number in plans:
+            arguments['window'], arguments['timeout'] = plans[station_number]
+        try:
+            return getSeriesSOS200(sos, 
+                                   station_number, 
+                                   offering_number, 
+                                   property_number, 
+                                   user_starting_time, 
+                                   user_ending_time, 
+                                   stations=stations, 
+                                   workers=1, 
+                                   monitor=monitor, 
+                                   **arguments), None
+        except RetrievalCancelled:
+            raise
+        except Exception as e:
+            offering = stations.getOffering(station_number, offering_number)
+            return None, (offering.id, str(e) or e.__class__.__name__)
+            
+    if len(selections) <= 1 or workers <= 1:
+        outcomes = [retrieve(selection) for selection in selections]
+    else:
+        pool = ThreadPool(min(workers, len(selections)))
+        try:
+            outcomes = pool.map(retrieve, selections)
+        finally:
+            pool.terminate()
+            
+    results = [result for result, failure in outcomes if failure is None]
+    failures = [failure for result, failure in outcomes 
+                if failure is not None]
+    
+    return results, failures
+    
+    
+    
+def exportSeriesSOS200(sos, station_number, offering_number, property_number, 
+                       user_starting_time, user_ending_time, writer, 
+                       stations=None, window=None, monitor=None, cache=None, 
+                       result_handling=False, json_binding=False, **kwargs):
+    """
+    Retrieve a time series and write it while it is being received, 
+    without keeping it in memory: GetResult and OM 2.0 responses are 
+    parsed by batches (see parsing.iterResultBatches and 
+    parsing.iterMeasurementBatches) and each batch is written as soon as 
+    it has been parsed. JSON responses are not parsed by batches: each 
+    time window is written once it has been parsed, so only one window is 
+    kept in memory.
+    
+    Time windows, if any, are requested one after the other so that rows 
+    are written in time order. A window whose request fails for a 
+    transient reason is requested again (see retrieval.fetchRetrying), and 
+    a window whose request times out is split (see 
+    retrieval.fetchSplitting). Only the observations which have not been 
+    written yet are written.
+    
+    arguments: 
+        >>> sos, station_number, offering_number, property_number, 
+            user_starting_time, user_ending_time, stations, monitor, 
+            result_handling, json_binding, **kwargs: 
+            see getSeriesSOS200.
+        >>> writer: 
+            object whose write method is called with each 
+            timeseries.TimeSeries batch, e.g. features.CsvSeriesWriter.
+        >>> window: 
+            timedelta object, or None to send a single request.
+        >>> cache:
+            cache.ObservationCache object where result templates are read 
+            and stored, or None. Observations are not read from it.
+    
+    return values:
+        >>> rows:
+            number (int) of observations written.
+        >>> response1:
+            beginning of the first GetObservation response (string).
+    """
+    
+    if stations is None:
+        stations = StationIndex(sos)
+    selected_offering, prop = selectSeries(stations, station_number, 
+                                           offering_number, property_number)
+    
+    if window is None:
+        windows = [(user_starting_time, user_ending_time)]
+    else:
+        windows = splitPeriod(user_starting_time, user_ending_time, window)
+    
+    template = None
+    if result_handling:
+        template = findResultTemplate(
+                sos, selected_offering, prop, cache=cache, 
+                timeout=kwargs.get('timeout', DEFAULT_TIMEOUT))
+    # Shared by every time window, as in getSeriesSOS200.
+    binding = {'json': json_binding}
+    
+    # Rows written so far and time of the last one.
+    state = {'rows': 0, 'last_time': None}
+    
+    def exportWindow(starting_time, ending_time):
+        # As consecutive windows share their bounds, only keep the 
+        # observations later than the ones of the previous windows (see 
+        # retrieval.mergeChunks), or than the ones already written by a 
+        # failed attempt.
+        boundary = state['last_time']
+        
+        def write(batch):
+            if boundary is not None:
+                later = batch.times > boundary
+                batch = batch.copy(times=batch.times[later], 
+                                   values=batch.values[later])
+            if batch.isEmpty():
+                return
+            batch.offering = selected_offering
+            batch.observed_property = prop
+            writer.write(batch)
+            state['rows'] += len(batch)
+            batch_last_time = batch.times.max()
+            if (state['last_time'] is None 
+                    or batch_last_time > state['last_time']):
+                state['last_time'] = batch_last_time
+                
+        if template is not None:
+            recordPath(monitor, 'result')
+            stream = openResultStream(sos, 
+                                      selected_offering, 
+                                      prop, 
+                                      starting_time, 
+                                      ending_time, 
+                                      monitor=monitor, 
+                                      **kwargs)
+            try:
+                for batch in iterResultBatches(stream, template, 
+                                               monitor=monitor):
+                    write(batch)
+            finally:
+                stream.close()
+            return stream.head
+        if binding['json']:
+            try:
+                series, response = fetchJsonObservations(sos, 
+                                                         [selected_offering], 
+                                                         [prop], 
+                                                         starting_time, 
+                                                         ending_time, 
+                                                         monitor=monitor, 
+                                                         **kwargs)
+                recordPath(monitor, 'json')
+                write(series)
+                return response
+            except JsonBindingUnavailable:
+                binding['json'] = False
+        recordPath(monitor, 'xml')
+        stream = openObservationStream(sos, 
+                                       [selected_offering], 
+                                       [prop], 
+                                       starting_time, 
+                                       ending_time, 
+                                       monitor=monitor, 
+                                       **kwargs)
+        try:
+            for batch in iterMeasurementBatches(stream, monitor=monitor):
+                write(batch)
+        finally:
+            stream.close()
+        return stream.head
+        
+    # Windows are split sequentially, so that rows stay in time order.
+    response1 = ''
+    for starting_time, ending_time in windows:
+        for response in fetchSplitting(exportWindow, starting_time, 
+                                       ending_time, monitor=monitor):
+            response1 = response1 or response
+        
+    return state['rows'], response1
+    
+    
+    
 def getSeriesSOS200(sos, station_number, offering_number, property_number, 
-                    user_starting_time, user_ending_time, **kwargs):
+                    user_starting_time, user_ending_time, stations=None, 
+                    streaming=True, window=None, workers=DEFAULT_WORKERS, 
+                    monitor=None, cache=None, result_handling=False, 
+                    json_binding=False, **kwargs):
     """
     Launch GetObservation request using OWSLib library,
     and retrieve useful data from the response.
@@ -133,12 +1790,12 @@ def getSeriesSOS200(sos, station_number, offering_number, property_number,
     arguments: 
         >>> sos: 
             class 'owslib.swe.observation.sos200.SensorObservationService_2_0_0'
-            object.
+            object, or ServiceDescription object (streaming mode only).
         >>> station_number: 
-            index (int) number of the station in WGS84bbox_list.
+            index (int) number of the station in StationIndex station_list.
         >>> offering_number: 
-            -- index number of the offering among in offerings_list 
-            of selected station.
+            index number of the offering among the offerings of selected 
+            station.
         >>> property_number: 
             index number of the observed property in observed_properties list 
             of selected offering.
@@ -148,25 +1805,55 @@ def getSeriesSOS200(sos, station_number, offering_number, property_number,
         >>> user_ending_time:
             datetime object indicating desired ending time of time series 
             for GetObservation request.
+        >>> stations:
+            StationIndex object built from sos. If None, it is built here, 
+            which means scanning every offering of the server.
+        >>> streaming:
+            if True, the response is parsed while it is being received, 
+            observation by observation, so that memory use does not depend 
+            on the response size, and OM_Measurement results are read 
+            without building OWSLib objects (dates are then given in UTC). 
+            Otherwise the whole response is loaded and parsed at once by 
+            OWSLib library.
+        >>> window:
+            timedelta object. If not None (streaming mode only), the time 
+            period is split into time windows of this duration, which are 
+            retrieved by separate GetObservation requests.
+        >>> workers:
+            maximum number (int) of GetObservation requests sent at the 
+            same time when window is not None.
+        >>> monitor:
+            retrieval.RetrievalMonitor object following the progress of 
+            the retrieval and allowing its cancellation (streaming mode 
+            only), or None.
+        >>> cache:
+            cache.ObservationCache object (streaming mode only). If not 
+            None, only the parts of the time period which have not been 
+            retrieved before are requested from the server.
+        >>> result_handling:
+            if True (streaming mode only), the time series is retrieved 
+            with GetResult requests, whose compact SWE text responses are 
+            much smaller and faster to parse than OM 2.0 responses, once 
+            its result template has been retrieved (see getResultTemplate). 
+            GetObservation requests are used if the result template cannot 
+            be retrieved or is not supported.
+        >>> json_binding:
+            if True (streaming mode only), GetObservation requests are sent 
+            through the JSON binding of 52North SOS servers (see 
+            fetchJsonObservations), unless GetResult requests are used. 
+            Requests go back to the XML binding as soon as the server does 
+            not answer in JSON.
         >>> **kwargs: 
             additional arguments. For this plugin, only a timeout argument 
             will be added.
     
     return values:
-        >>> dates:
-            list of 'datetime.datetime' objects containing entries of 
-            time series date and time column.
-        >>> values: 
-            list of float objects containing entries of time series value 
-            column.
-        >>> selected_offering:
-            (string).
-        >>> prop: 
-            selected observed property (string).
-        >>> unit: 
-            unit of measured observed property (string).
+        >>> series:
+            timeseries.TimeSeries object, with selected offering, observed 
+            property and its unit.
         >>> response1:
-            GetObservation response (string).      
+            GetObservation response (string). In streaming mode, only the 
+            beginning of the response is kept.      
     
     """
     
@@ -178,19 +1865,13 @@ def getSeriesSOS200(sos, station_number, offering_number, property_number,
     # Defining request parameters.                   
     #
     
-    WGS84bbox_set=set(WGS84conversion(off) for off in sos.offerings)
-    WGS84bbox_list=list(WGS84bbox_set)
+    if stations is None:
+        stations = StationIndex(sos)
                     
-    # Selecting station.
-    station = WGS84bbox_list[station_number]
-    
-    # Selecting offerings.
-    off = GetOfferingsList(sos, station).offering_list[offering_number]
-    offerings = [off.id]
-    selected_offering = off.id
-    
-    # Selecting observed property.
-    prop = off.observed_properties[property_number]
+    # Selecting station, offering and observed property.
+    selected_offering, prop = selectSeries(stations, station_number, 
+                                           offering_number, property_number)
+    offerings = [selected_offering]
     observedProperties = [prop]
     
     # Selecting format.
@@ -210,6 +1891,100 @@ def getSeriesSOS200(sos, station_number, offering_number, property_number,
     #
     
     try:
+        if streaming:
+            template = None
+            if result_handling:
+                template = findResultTemplate(
+                        sos, selected_offering, prop, cache=cache, 
+                        timeout=kwargs.get('timeout', DEFAULT_TIMEOUT))
+            # Shared by every time window, so that the JSON binding is 
+            # only tried once if the server does not have one.
+            binding = {'json': json_binding}
+            
+            def fetchWindow(starting_time, ending_time):
+                if template is not None:
+                    recordPath(monitor, 'result')
+                    return fetchResults(sos, 
+                                        selected_offering, 
+                                        prop, 
+                                        template, 
+                                        starting_time, 
+                                        ending_time, 
+                                        monitor=monitor,
+                                        **kwargs)
+                if binding['json']:
+                    try:
+                        result = fetchJsonObservations(sos, 
+                                                       offerings, 
+                                                       observedProperties, 
+                                                       starting_time, 
+                                                       ending_time, 
+                                                       monitor=monitor,
+                                                       **kwargs)
+                        recordPath(monitor, 'json')
+                        return result
+                    except JsonBindingUnavailable:
+                        binding['json'] = False
+                recordPath(monitor, 'xml')
+                return fetchObservations(sos, 
+                                         offerings, 
+                                         observedProperties, 
+                                         starting_time, 
+                                         ending_time, 
+                                         monitor=monitor,
+                                         **kwargs)
+                                         
+            if cache is None:
+                fetch = fetchWindow
+            else:
+                url = getObservationURL(sos)
+                
+                def fetch(starting_time, ending_time):
+                    # Each time window is stored as soon as it has been 
+                    # retrieved, so that an interrupted retrieval - even 
+                    # by a QGIS restart - resumes from the windows which 
+                    # have not been retrieved yet.
+                    series, response = fetchWindow(starting_time, ending_time)
+                    cache.store(url, series, starting_time, ending_time)
+                    return series, response
+                    
+            if window is not None:
+                # Chunked retrieval: one request per time window, several 
+                # requests at the same time.
+                retrieve = lambda starting_time, ending_time: fetchChunked(
+                                    fetch, 
+                                    starting_time, 
+                                    ending_time, 
+                                    window=window, 
+                                    workers=workers, 
+                                    monitor=monitor)
+            else:
+                retrieve = lambda starting_time, ending_time: fetchRetrying(
+                                    fetch, 
+                                    starting_time, 
+                                    ending_time, 
+                                    monitor=monitor)
+                
+            if cache is None:
+                series, response1 = retrieve(user_starting_time, 
+                                             user_ending_time)
+            else:
+                # Only retrieve the parts of the time period which are not 
+                # stored in the cache yet, and then read the whole period 
+                # from the cache.
+                response1 = ''
+                for gap_starting_time, gap_ending_time in (
+                        cache.getMissingIntervals(url, selected_offering, prop, 
+                                                  user_starting_time, 
+                                                  user_ending_time)):
+                    series, response = retrieve(gap_starting_time, 
+                                                gap_ending_time)
+                    response1 = response1 or response
+                series = cache.read(url, selected_offering, prop, 
+                                    user_starting_time, user_ending_time)
+            
+            return series, response1
+            
         response1 = sos.get_observation(responseFormat=omFormat, 
                                         offerings=offerings, 
                                         observedProperties=observedProperties, 
@@ -225,22 +2000,83 @@ def getSeriesSOS200(sos, station_number, offering_number, property_number,
             
         for i, obs in enumerate(parsed_response.observations):
             if obs.resultTime is not None and obs.get_result().value is not None:
-                dates.append(obs.resultTime)
+                dates.append(obs.resultTime.isoformat())
                 values.append(obs.get_result().value)
             else:
                 pass
+        # Decode dates as the streaming parser does, that is in UTC.
+        series = TimeSeries(decodeIsoTimestamps(dates), values, unit=unit, 
+                            offering=selected_offering, 
+                            observed_property=prop)
     
-        return dates, values, selected_offering, prop, unit, response1
+        return series, response1
         
            
     except:
         raise
+
+    
+    
+    
+def followSeriesSOS200(sos, station_number, offering_number, property_number, 
+                       last_time, stations=None, monitor=None, template=None, 
+                       json_binding=False, **kwargs):
+    """
+    Retrieve the new observations of a time series, for follow mode: the 
+    requested time period starts at the time of the last observation 
+    received and ends now, so that only new observations are transferred 
+    and parsed.
+    
+    arguments:
+        >>> last_time:
+            datetime object (UTC) of the last observation received.
+        >>> template:
+            result template of the time series (see findResultTemplate), 
+            found once before following it rather than at each retrieval, 
+            to retrieve new observations with GetResult requests, or None 
+            to use GetObservation requests.
+        >>> other arguments:
+            see getSeriesSOS200. No time window is used, as new 
+            observations are few, and the observation cache is not used, 
+            since late observations may still be inserted in the 
+            requested time period.
+    
+    return values:
+        >>> series:
+            timeseries.TimeSeries object of the observations later than 
+            last_time.
+        >>> response1:
+            see getSeriesSOS200.
+    
+    """
+    
+    if stations is None:
+        stations = StationIndex(sos)
+    ending_time = max(datetime.datetime.utcnow(), last_time)
+    if template is not None:
+        offering, prop = selectSeries(stations, station_number, 
+                                      offering_number, property_number)
         
+        def fetch(starting_time, ending_time):
+            recordPath(monitor, 'result')
+            return fetchResults(sos, offering, prop, template, starting_time, 
+                                ending_time, monitor=monitor, **kwargs)
+            
+        series, response1 = fetchRetrying(fetch, last_time, ending_time, 
+                                          monitor=monitor)
+    else:
+        series, response1 = getSeriesSOS200(sos, 
+                                            station_number, 
+                                            offering_number, 
+                                            property_number, 
+                                            last_time, 
+                                            ending_time, 
+                                            stations=stations, 
+                                            monitor=monitor, 
+                                            json_binding=json_binding, 
+                                            **kwargs)
+    # The time period includes the last observation received.
+    new = series.times > numpy.datetime64(last_time, 'ms')
     
-
-
-
-
-
-
- 
\ No newline at end of file
+    return series.copy(times=series.times[new], 
+                       values=series.values[new]), response1
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+"""
+Compare GetObservation response parsing paths on a synthetic response
+made of OM_Measurement observations, as sent by 52°North SOS servers.
+
+This script does not need QGIS. Usage:
+
+    python benchmark_getobservation.py [number of observations ...]
+
+"""
+
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from owslib.etree import etree
+from owslib.swe.observation import sos200
+
+from parsing import iterObservations, parseMeasurements
+
+
+HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<sos:GetObservationResponse '
+    'xmlns:sos="http://www.opengis.net/sos/2.0" '
+    'xmlns:om="http://www.opengis.net/om/2.0" '
+    'xmlns:gml="http://www.opengis.net/gml/3.2" '
+    'xmlns:xlink="http://www.w3.org/1999/xlink" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">\n'
+)
+
+OBSERVATION = (
+    '<sos:observationData><om:OM_Observation gml:id="o_{0}">'
+    '<om:type xlink:href="http://www.opengis.net/def/observationType/'
+    'OGC-OM/2.0/OM_Measurement"/>'
+    '<om:phenomenonTime><gml:TimeInstant gml:id="phenomenonTime_{0}">'
+    '<gml:timePosition>{1}</gml:timePosition></gml:TimeInstant>'
+    '</om:phenomenonTime>'
+    '<om:resultTime><gml:TimeInstant gml:id="resultTime_{0}">'
+    '<gml:timePosition>{1}</gml:timePosition></gml:TimeInstant>'
+    '</om:resultTime>'
+    '<om:procedure xlink:href="http://www.52north.org/test/procedure/9"/>'
+    '<om:observedProperty '
+    'xlink:href="http://www.52north.org/test/observableProperty/9_3"/>'
+    '<om:featureOfInterest '
+    'xlink:href="http://www.52north.org/test/featureOfInterest/9"/>'
+    '<om:result xsi:type="gml:MeasureType" uom="W/m2">{2}</om:result>'
+    '</om:OM_Observation></sos:observationData>\n'
+)
+
+
+def writeResponse(path, count):
+    with open(path, 'w') as f:
+        f.write(HEADER)
+        for i in range(count):
+            timestamp = '2016-%02d-%02dT%02d:%02d:00.000+01:00' % (
+                1 + i // 40320 % 12, 1 + i // 1440 % 28, i // 60 % 24, i % 60)
+            f.write(OBSERVATION.format(i, timestamp, i * 0.25))
+        f.write('</sos:GetObservationResponse>\n')
+
+
+def owslibDocument(path):
+    """Former getSeriesSOS200 path: whole document parsed by OWSLib."""
+    with open(path, 'rb') as f:
+        response = f.read()
+    parsed_response = sos200.SOSGetObservationResponse(
+        etree.fromstring(response))
+    dates = []
+    values = []
+    for obs in parsed_response.observations:
+        if obs.resultTime is not None and obs.get_result().value is not None:
+            dates.append(obs.resultTime)
+            values.append(obs.get_result().value)
+    return len(values)
+
+
+def owslibStream(path):
+    """Streaming parser, observations decoded by OWSLib."""
+    with open(path, 'rb') as f:
+        return sum(1 for obs in iterObservations(f))
+
+
+def fastPath(path):
+    """Streaming parser with the OM_Measurement extractor."""
+    with open(path, 'rb') as f:
+        series = parseMeasurements(f)
+    return len(series)
+
+
+if __name__ == '__main__':
+    counts = [int(a) for a in sys.argv[1:]] or [100000, 1000000]
+    for count in counts:
+        fd, path = tempfile.mkstemp(suffix='.xml')
+        os.close(fd)
+        try:
+            writeResponse(path, count)
+            print('%d observations (%.1f MB)' % (
+                count, os.path.getsize(path) / 1e6))
+            for parse in (owslibDocument, owslibStream, fastPath):
+                start = time.time()
+                parsed = parse(path)
+                print('    %-15s %8.2f s  (%d observations)' % (
+                    parse.__name__, time.time() - start, parsed))
+        finally:
+            os.remove(path)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+"""
+Unit tests of the coverage of the observation cache: stored time periods
+and missing intervals, and stored data availability.
+
+These tests do not need QGIS. Usage:
+
+    python -m unittest discover -s test
+
+"""
+
+
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+
+from cache import ObservationCache
+from timeseries import TimeSeries
+
+
+URL = 'http://example.org/sos/kvp'
+START = datetime.datetime(2017, 1, 1)
+DAY = datetime.timedelta(days=1)
+
+
+
+def makeSeries(starting_time, ending_time):
+    """Return an hourly time series of a time period."""
+    times = numpy.arange(numpy.datetime64(starting_time, 'ms'),
+                         numpy.datetime64(ending_time, 'ms'),
+                         numpy.timedelta64(1, 'h'))
+    return TimeSeries(times, numpy.arange(len(times), dtype=float),
+                      unit='m', offering='off', observed_property='p')
+
+
+
+class ObservationCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = ObservationCache(os.path.join(self.folder,
+                                                   'observations.sqlite'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def store(self, starting_time, ending_time):
+        self.cache.store(URL, makeSeries(starting_time, ending_time),
+                         starting_time, ending_time)
+
+    def getMissingIntervals(self, starting_time, ending_time):
+        return self.cache.getMissingIntervals(URL, 'off', 'p',
+                                              starting_time, ending_time)
+
+    def testUnknownSeriesIsMissing(self):
+        self.assertEqual(self.getMissingIntervals(START, START + DAY),
+                         [(START, START + DAY)])
+
+    def testStoredPeriodIsNotMissing(self):
+        self.store(START, START + 2 * DAY)
+        self.assertEqual(self.getMissingIntervals(START, START + 2 * DAY), [])
+        self.assertEqual(self.getMissingIntervals(START + DAY,
+                                                  START + 2 * DAY), [])
+
+    def testGapsAroundAndBetweenStoredPeriods(self):
+        self.store(START + DAY, START + 2 * DAY)
+        self.store(START + 3 * DAY, START + 4 * DAY)
+        self.assertEqual(self.getMissingIntervals(START, START + 5 * DAY),
+                         [(START, START + DAY),
+                          (START + 2 * DAY, START + 3 * DAY),
+                          (START + 4 * DAY, START + 5 * DAY)])
+
+    def testOverlappingPeriodsAreMerged(self):
+        self.store(START, START + 2 * DAY)
+        self.store(START + DAY, START + 3 * DAY)
+        self.store(START + 3 * DAY, START + 4 * DAY)
+        self.assertEqual(self.cache.getCoverage(URL, 'off', 'p'),
+                         [(1483228800000, 1483574400000)])
+
+    def testFutureIsNeverCovered(self):
+        now = datetime.datetime.utcnow()
+        self.store(now - DAY, now + DAY)
+        gaps = self.getMissingIntervals(now - DAY, now + DAY)
+        self.assertEqual(len(gaps), 1)
+        self.assertTrue(gaps[0][0] <= now + datetime.timedelta(seconds=1))
+        self.assertEqual(gaps[0][1],
+                         numpy.datetime64(now + DAY, 'ms').astype(object))
+
+    def testReadStoredObservations(self):
+        self.store(START, START + 2 * DAY)
+        series = self.cache.read(URL, 'off', 'p', START + DAY,
+                                 START + 2 * DAY)
+        self.assertEqual(len(series), 24)
+        self.assertEqual(series.unit, 'm')
+        self.assertEqual(series.times[0], numpy.datetime64(START + DAY, 'ms'))
+
+    def testInterruptedRetrieval(self):
+        self.cache.storeInterruptedRetrieval(URL, 'off', ['p', 'q'], START,
+                                             START + DAY)
+        self.assertEqual(self.cache.getInterruptedRetrieval(URL, 'off', 'p'),
+                         (START, START + DAY))
+        self.cache.clearInterruptedRetrieval(URL, 'off', ['p'])
+        self.assertIsNone(self.cache.getInterruptedRetrieval(URL, 'off', 'p'))
+        self.assertIsNotNone(self.cache.getInterruptedRetrieval(URL, 'off',
+                                                                'q'))
+
+    def testResultTemplateFailure(self):
+        self.assertFalse(self.cache.isResultTemplateUnavailable(URL, 'off',
+                                                                'p'))
+        self.cache.storeResultTemplateFailure(URL, 'off', 'p')
+        self.assertTrue(self.cache.isResultTemplateUnavailable(URL, 'off',
+                                                               'p'))
+        self.assertFalse(self.cache.isResultTemplateUnavailable(URL, 'off',
+                                                                'p', ttl=0))
+        self.cache.storeResultTemplate(URL, 'off', 'p', b'<template/>')
+        self.assertFalse(self.cache.isResultTemplateUnavailable(URL, 'off',
+                                                                'p'))
+
+
+
+class AvailabilityCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.cache = ObservationCache(os.path.join(self.folder,
+                                                   'observations.sqlite'))
+        self.availability = {
+            ('off1', 'p'): (START, START + DAY, 24),
+            ('off1', 'q'): (START + DAY, START + 2 * DAY, None)}
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def testUnknownOfferingsAreMissing(self):
+        self.assertEqual(self.cache.getAvailability(URL, ['off1', 'off2']),
+                         ({}, ['off1', 'off2']))
+
+    def testStoredAvailabilityIsRead(self):
+        # off2 has no observation: it is not missing any more.
+        self.cache.storeAvailability(URL, ['off1', 'off2'], self.availability)
+        self.assertEqual(
+            self.cache.getAvailability(URL, ['off1', 'off2', 'off3']),
+            (self.availability, ['off3']))
+
+    def testExpiredAvailabilityIsMissing(self):
+        self.cache.storeAvailability(URL, ['off1'], self.availability)
+        self.assertEqual(self.cache.getAvailability(URL, ['off1'], ttl=-1),
+                         ({}, ['off1']))
+
+    def testStoredAvailabilityIsReplaced(self):
+        self.cache.storeAvailability(URL, ['off1'], self.availability)
+        availability = {('off1', 'p'): (START, START + 3 * DAY, 72)}
+        self.cache.storeAvailability(URL, ['off1'], availability)
+        self.assertEqual(self.cache.getAvailability(URL, ['off1']),
+                         (availability, []))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
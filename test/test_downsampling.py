@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+"""
+Unit tests of min/max downsampling of plotted curves.
+
+These tests do not need QGIS. Usage:
+
+    python -m unittest discover -s test
+
+"""
+
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+
+from downsampling import getVisibleRange, minMaxDownsample
+
+
+
+class DownsamplingTest(unittest.TestCase):
+
+    def testVisibleRangeKeepsClosestOutsidePoints(self):
+        x = numpy.arange(10.)
+        self.assertEqual(getVisibleRange(x, 3.5, 6.5), (3, 8))
+        self.assertEqual(getVisibleRange(x, -5., 50.), (0, 10))
+
+    def testSparseCurveIsKept(self):
+        x = numpy.arange(100.)
+        y = numpy.sin(x)
+        x_drawn, y_drawn = minMaxDownsample(x, y, 0., 99., 100)
+        self.assertTrue(numpy.array_equal(x_drawn, x))
+        self.assertTrue(numpy.array_equal(y_drawn, y))
+
+    def testDenseCurveKeepsPeaks(self):
+        x = numpy.arange(100000.)
+        y = numpy.zeros(100000)
+        y[12345] = 10.
+        y[54321] = -10.
+        x_drawn, y_drawn = minMaxDownsample(x, y, 0., 99999., 100)
+        self.assertTrue(len(x_drawn) <= 200)
+        self.assertEqual(y_drawn.max(), 10.)
+        self.assertEqual(y_drawn.min(), -10.)
+        self.assertTrue((numpy.diff(x_drawn) >= 0).all())
+
+    def testExtremaAreDrawnInTimeOrder(self):
+        # Falling edge: each bucket has its maximum before its minimum.
+        x = numpy.arange(1000.)
+        y = numpy.tile(numpy.linspace(10., -10., 100), 10)
+        x_drawn, y_drawn = minMaxDownsample(x, y, 0., 999., 10)
+        self.assertEqual(len(x_drawn), 20)
+        self.assertEqual(x_drawn[:2].tolist(), [0., 99.])
+        self.assertEqual(y_drawn[:2].tolist(), [10., -10.])
+        self.assertTrue((numpy.diff(x_drawn) >= 0).all())
+        # Drawn points are points of the curve.
+        self.assertTrue(numpy.array_equal(y_drawn,
+                                          y[x_drawn.astype(int)]))
+
+    def testNaNValuesAreIgnored(self):
+        x = numpy.arange(1000.)
+        y = numpy.ones(1000)
+        y[::2] = numpy.nan
+        _, y_drawn = minMaxDownsample(x, y, 0., 999., 10)
+        self.assertTrue((y_drawn == 1.).all())
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+"""
+Unit tests of ISO 8601 timestamp decoding and of GetObservation and
+GetResult response parsing (OM 2.0 XML, JSON and SWE text).
+
+These tests do not need QGIS. Usage:
+
+    python -m unittest discover -s test
+
+"""
+
+
+import datetime
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+from owslib import ows
+
+from parsing import decodeIsoTimestamps, parseJsonMeasurements
+from parsing import parseDataAvailability
+from parsing import parseMeasurements, parseResultTemplate
+from parsing import parseResultValues, iterResultBatches
+from benchmark_getobservation import HEADER, OBSERVATION
+
+
+
+RESULT_TEMPLATE = (
+    '<sos:GetResultTemplateResponse '
+    'xmlns:sos="http://www.opengis.net/sos/2.0" '
+    'xmlns:swe="http://www.opengis.net/swe/2.0">'
+    '<sos:resultStructure><swe:DataRecord>'
+    '<swe:field name="phenomenonTime"><swe:Time '
+    'definition="http://www.opengis.net/def/property/OGC/0/PhenomenonTime">'
+    '<swe:uom xlink:href="http://www.opengis.net/def/uom/ISO-8601/0/'
+    'Gregorian" xmlns:xlink="http://www.w3.org/1999/xlink"/></swe:Time>'
+    '</swe:field>'
+    '<swe:field name="level"><swe:Quantity definition="level">'
+    '<swe:uom code="m"/></swe:Quantity></swe:field>'
+    '</swe:DataRecord></sos:resultStructure>'
+    '<sos:resultEncoding><swe:TextEncoding tokenSeparator=";" '
+    'blockSeparator="|" decimalSeparator=","/></sos:resultEncoding>'
+    '</sos:GetResultTemplateResponse>')
+
+RESULT = (
+    '<sos:GetResultResponse xmlns:sos="http://www.opengis.net/sos/2.0">'
+    '<sos:resultValues>{0}</sos:resultValues></sos:GetResultResponse>')
+
+
+# GetDataAvailability 1.0 response of a 52North SOS server: no offering and
+# no observation count, members of the same time period refer to the first
+# one.
+GDA10 = (
+    '<gda:GetDataAvailabilityResponse '
+    'xmlns:gda="http://www.opengis.net/sosgda/1.0" '
+    'xmlns:gml="http://www.opengis.net/gml/3.2" '
+    'xmlns:xlink="http://www.w3.org/1999/xlink">'
+    '<gda:dataAvailabilityMember gml:id="dam_1">'
+    '<gda:procedure xlink:href="procedure1" xlink:title="Station 1"/>'
+    '<gda:observedProperty xlink:href="temperature"/>'
+    '<gda:featureOfInterest xlink:href="feature1"/>'
+    '<gda:phenomenonTime><gml:TimePeriod gml:id="tp_1">'
+    '<gml:beginPosition>2017-01-01T00:00:00.000Z</gml:beginPosition>'
+    '<gml:endPosition>2017-06-30T23:00:00.000+02:00</gml:endPosition>'
+    '</gml:TimePeriod></gda:phenomenonTime>'
+    '</gda:dataAvailabilityMember>'
+    '<gda:dataAvailabilityMember gml:id="dam_2">'
+    '<gda:procedure xlink:href="procedure1"/>'
+    '<gda:observedProperty xlink:href="humidity"/>'
+    '<gda:featureOfInterest xlink:href="feature1"/>'
+    '<gda:phenomenonTime xlink:href="#tp_1"/>'
+    '</gda:dataAvailabilityMember>'
+    '<gda:dataAvailabilityMember gml:id="dam_3">'
+    '<gda:procedure xlink:href="procedure2"/>'
+    '<gda:observedProperty xlink:href="temperature"/>'
+    '<gda:featureOfInterest xlink:href="feature2"/>'
+    '<gda:phenomenonTime xlink:href="#unknown"/>'
+    '</gda:dataAvailabilityMember>'
+    '</gda:GetDataAvailabilityResponse>')
+
+# GetDataAvailability 2.0 response, with offerings and observation counts.
+GDA20 = (
+    '<gda:GetDataAvailabilityResponse '
+    'xmlns:gda="http://www.opengis.net/sosgda/2.0" '
+    'xmlns:gml="http://www.opengis.net/gml/3.2" '
+    'xmlns:xlink="http://www.w3.org/1999/xlink">'
+    '<gda:dataAvailabilityMember gml:id="dam_1">'
+    '<gda:offering xlink:href="offering1"/>'
+    '<gda:procedure xlink:href="procedure1"/>'
+    '<gda:observedProperty xlink:href="temperature"/>'
+    '<gda:featureOfInterest xlink:href="feature1"/>'
+    '<gda:phenomenonTime><gml:TimePeriod gml:id="tp_1">'
+    '<gml:beginPosition>2017-01-01T00:00:00Z</gml:beginPosition>'
+    '<gml:endPosition>2017-01-31T00:00:00Z</gml:endPosition>'
+    '</gml:TimePeriod></gda:phenomenonTime>'
+    '<gda:count>721</gda:count>'
+    '</gda:dataAvailabilityMember>'
+    '</gda:GetDataAvailabilityResponse>')
+
+EXCEPTION_REPORT = (
+    '<ows:ExceptionReport xmlns:ows="http://www.opengis.net/ows/1.1" '
+    'version="2.0.0"><ows:Exception exceptionCode="InvalidParameterValue" '
+    'locator="responseFormat"><ows:ExceptionText>unsupported response '
+    'format</ows:ExceptionText></ows:Exception></ows:ExceptionReport>')
+
+
+
+def ms(string):
+    return numpy.datetime64(string, 'ms')
+
+
+
+class Monitor:
+    """Retrieval monitor counting parsed observations."""
+
+    def __init__(self):
+        self.observations = 0
+
+    def update(self, observations=0, **kwargs):
+        self.observations += observations
+
+
+
+class SlowStream:
+    """File-like object giving a few bytes at a time."""
+
+    def __init__(self, content, size=5):
+        self.stream = io.BytesIO(content.encode('utf-8'))
+        self.size = size
+
+    def read(self, size=-1):
+        return self.stream.read(self.size)
+
+
+
+class DecodeIsoTimestampsTest(unittest.TestCase):
+
+    def testEmpty(self):
+        self.assertEqual(len(decodeIsoTimestamps([])), 0)
+
+    def testUtc(self):
+        times = decodeIsoTimestamps(['2017-01-01T00:00:00Z',
+                                     '2017-12-31T23:59:59Z'])
+        self.assertEqual(times.tolist(), [ms('2017-01-01T00:00:00').item(),
+                                          ms('2017-12-31T23:59:59').item()])
+
+    def testOffsetsAreConvertedToUtc(self):
+        times = decodeIsoTimestamps(['2017-01-01T01:00:00+01:00',
+                                     '2017-01-01T00:00:00-02:30'])
+        self.assertEqual(times[0], ms('2017-01-01T00:00:00'))
+        self.assertEqual(times[1], ms('2017-01-01T02:30:00'))
+
+    def testFractionsOfSecond(self):
+        times = decodeIsoTimestamps(['2017-01-01T00:00:00.5Z',
+                                     '2017-01-01T00:00:00.123456Z'])
+        self.assertEqual(times[0], ms('2017-01-01T00:00:00.500'))
+        self.assertEqual(times[1], ms('2017-01-01T00:00:00.123'))
+
+    def testWithoutTimeZone(self):
+        times = decodeIsoTimestamps(['2017-03-01T12:00:00'])
+        self.assertEqual(times[0], ms('2017-03-01T12:00:00'))
+
+    def testMixedLayouts(self):
+        times = decodeIsoTimestamps(['2017-01-01T00:00:00Z',
+                                     '2017-01-01T01:00:00.000+00:00',
+                                     '2017-01-01T02:00:00Z'])
+        self.assertEqual(times.tolist(), [
+            ms('2017-01-01T00:00:00').item(),
+            ms('2017-01-01T01:00:00').item(),
+            ms('2017-01-01T02:00:00').item()])
+
+    def testLeapDay(self):
+        times = decodeIsoTimestamps(['2016-02-29T00:00:00Z'])
+        self.assertEqual(times[0], ms('2016-02-29T00:00:00'))
+
+    def testUnreadableTimestampIsNaT(self):
+        times = decodeIsoTimestamps(['2017-01-01T00:00:00Z', 'not a time'])
+        self.assertEqual(times[0], ms('2017-01-01T00:00:00'))
+        self.assertEqual(str(times[1]), 'NaT')
+
+
+
+class ParseMeasurementsTest(unittest.TestCase):
+
+    def parse(self, values):
+        content = HEADER + ''.join(
+            OBSERVATION.format(i, '2017-01-01T%02d:00:00Z' % i, value)
+            for i, value in enumerate(values)) \
+            + '</sos:GetObservationResponse>\n'
+        return parseMeasurements(io.BytesIO(content.encode('utf-8')))
+
+    def testMeasurements(self):
+        series = self.parse(['1.5', '2'])
+        self.assertEqual(series.unit, 'W/m2')
+        self.assertEqual(series.values.tolist(), [1.5, 2.])
+        self.assertEqual(series.times[1], ms('2017-01-01T01:00:00'))
+
+    def testNonNumericValuesAreNan(self):
+        series = self.parse(['high', '3', ''])
+        self.assertEqual(len(series), 2)
+        self.assertTrue(numpy.isnan(series.values[0]))
+        self.assertEqual(series.values[1], 3.)
+
+
+
+class ParseResultValuesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.template = parseResultTemplate(RESULT_TEMPLATE, 'level')
+
+    def testTemplate(self):
+        self.assertEqual(self.template.token_separator, ';')
+        self.assertEqual(self.template.block_separator, '|')
+        self.assertEqual(self.template.decimal_separator, ',')
+        self.assertEqual(self.template.unit, 'm')
+
+    def testSeparatorsAreHonoured(self):
+        content = RESULT.format('3|2017-01-01T00:00:00Z;1,5|'
+                                '2017-01-01T01:00:00Z;2|'
+                                '2017-01-01T02:00:00Z;-0,25|')
+        series = parseResultValues(SlowStream(content), self.template)
+        self.assertEqual(series.values.tolist(), [1.5, 2., -0.25])
+        self.assertEqual(series.times[2], ms('2017-01-01T02:00:00'))
+        self.assertEqual(series.unit, 'm')
+
+    def testBatches(self):
+        blocks = ['2017-01-01T%02d:00:00Z;%d' % (i, i) for i in range(10)]
+        content = RESULT.format('|'.join(blocks))
+        batches = list(iterResultBatches(SlowStream(content, 7),
+                                         self.template, batch_size=4))
+        self.assertEqual([len(b) for b in batches], [4, 4, 2])
+        self.assertEqual(numpy.concatenate([b.values for b in batches])
+                         .tolist(), [float(i) for i in range(10)])
+
+    def testMalformedBlocksAreDropped(self):
+        content = RESULT.format('2017-01-01T00:00:00Z;1|oops|'
+                                '2017-01-01T01:00:00Z;n/a')
+        series = parseResultValues(SlowStream(content), self.template)
+        self.assertEqual(len(series), 2)
+        self.assertTrue(numpy.isnan(series.values[1]))
+
+    def testExceptionReport(self):
+        content = ('<ows:ExceptionReport '
+                   'xmlns:ows="http://www.opengis.net/ows/1.1" '
+                   'version="2.0.0"><ows:Exception '
+                   'exceptionCode="InvalidParameterValue"/>'
+                   '</ows:ExceptionReport>')
+        self.assertRaises(ows.ExceptionReport, parseResultValues,
+                          SlowStream(content), self.template)
+
+
+
+class ParseJsonMeasurementsTest(unittest.TestCase):
+
+    def parse(self, content):
+        return parseJsonMeasurements(io.BytesIO(content.encode('utf-8')))
+
+    def testMeasurements(self):
+        series = self.parse(
+            '{"observations": ['
+            '{"resultTime": "2017-01-01T00:00:00Z", '
+            '"result": {"uom": "m", "value": 1.5}}, '
+            '{"phenomenonTime": ["2017-01-01T00:00:00Z", '
+            '"2017-01-01T01:00:00Z"], "result": {"uom": "m", "value": 2}}, '
+            '{"resultTime": "2017-01-01T02:00:00Z", '
+            '"result": {"uom": "m", "value": null}}]}')
+        self.assertEqual(series.unit, 'm')
+        self.assertEqual(series.values.tolist(), [1.5, 2.0])
+        self.assertEqual(series.times[1], ms('2017-01-01T01:00:00'))
+
+    def testNonNumericValuesAreNan(self):
+        series = self.parse(
+            '{"observations": ['
+            '{"resultTime": "2017-01-01T00:00:00Z", "result": "high"}, '
+            '{"resultTime": "2017-01-01T01:00:00Z", "result": "3"}]}')
+        self.assertTrue(numpy.isnan(series.values[0]))
+        self.assertEqual(series.values[1], 3.0)
+
+    def testIncrementalDecoding(self):
+        observations = ', '.join(
+            '{"resultTime": "2017-01-01T%02d:00:00Z", '
+            '"result": {"uom": "\u00b5g/m\u00b3", "value": %d}}' % (i, i)
+            for i in range(24))
+        content = (u'{"request": "GetObservation", "observations" : [ %s ],'
+                   u' "version": "2.0.0"}' % observations)
+        monitor = Monitor()
+        series = parseJsonMeasurements(SlowStream(content, 7), monitor)
+        self.assertEqual(series.values.tolist(), [float(i) for i in range(24)])
+        self.assertEqual(series.unit, u'\u00b5g/m\u00b3')
+        self.assertEqual(monitor.observations, 24)
+
+    def testEmptyObservations(self):
+        self.assertEqual(len(self.parse('{"observations": []}')), 0)
+
+    def testExceptionReport(self):
+        self.assertRaises(ows.ExceptionReport, self.parse,
+                          '{"version": "2.0.0", "exceptions": [{'
+                          '"code": "InvalidParameterValue", '
+                          '"text": "unknown offering"}]}')
+
+    def testTruncatedResponse(self):
+        self.assertRaises(ValueError, self.parse,
+                          '{"observations": [{"resultTime": "2017-01-01T0')
+
+
+
+class ParseDataAvailabilityTest(unittest.TestCase):
+
+    def testVersion10(self):
+        members = parseDataAvailability(GDA10)
+        # The member whose time period cannot be found is dropped.
+        self.assertEqual(len(members), 2)
+        self.assertEqual(members[0], {
+            'offering': None,
+            'procedure': 'procedure1',
+            'observed_property': 'temperature',
+            'feature': 'feature1',
+            'starting_time': datetime.datetime(2017, 1, 1),
+            'ending_time': datetime.datetime(2017, 6, 30, 21),
+            'count': None})
+
+    def testSharedTimePeriod(self):
+        members = parseDataAvailability(GDA10)
+        self.assertEqual(members[1]['observed_property'], 'humidity')
+        self.assertEqual(members[1]['starting_time'],
+                         members[0]['starting_time'])
+        self.assertEqual(members[1]['ending_time'],
+                         members[0]['ending_time'])
+
+    def testVersion20(self):
+        self.assertEqual(parseDataAvailability(GDA20), [{
+            'offering': 'offering1',
+            'procedure': 'procedure1',
+            'observed_property': 'temperature',
+            'feature': 'feature1',
+            'starting_time': datetime.datetime(2017, 1, 1),
+            'ending_time': datetime.datetime(2017, 1, 31),
+            'count': 721}])
+
+    def testExceptionReport(self):
+        self.assertRaises(ows.ExceptionReport, parseDataAvailability,
+                          EXCEPTION_REPORT)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
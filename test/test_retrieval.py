@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+"""
+Unit tests of time window splitting, chunk merging and retrieval planning.
+
+These tests do not need QGIS. Usage:
+
+    python -m unittest discover -s test
+
+"""
+
+
+import datetime
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+
+from retrieval import splitPeriod, mergeChunks, planRetrieval
+from retrieval import estimateObservations, Throughput
+from retrieval import MINIMUM_WINDOW, MINIMUM_READ_TIMEOUT
+from timeseries import TimeSeries
+
+
+START = datetime.datetime(2017, 1, 1)
+DAY = datetime.timedelta(days=1)
+
+
+
+def makeSeries(times, values, **metadata):
+    return TimeSeries(numpy.array(times, dtype='datetime64[ms]'), values,
+                      **metadata)
+
+
+
+class SplitPeriodTest(unittest.TestCase):
+
+    def testWindowsAreConsecutive(self):
+        windows = splitPeriod(START, START + 3 * DAY, DAY)
+        self.assertEqual(windows, [(START, START + DAY),
+                                   (START + DAY, START + 2 * DAY),
+                                   (START + 2 * DAY, START + 3 * DAY)])
+
+    def testLastWindowIsShorter(self):
+        windows = splitPeriod(START, START + 2 * DAY + datetime.timedelta(
+            hours=6), DAY)
+        self.assertEqual(len(windows), 3)
+        self.assertEqual(windows[-1], (START + 2 * DAY,
+                                       START + 2 * DAY
+                                       + datetime.timedelta(hours=6)))
+
+    def testPeriodShorterThanWindow(self):
+        self.assertEqual(splitPeriod(START, START + DAY, 7 * DAY),
+                         [(START, START + DAY)])
+
+    def testEmptyPeriod(self):
+        self.assertEqual(splitPeriod(START, START, DAY), [(START, START)])
+
+
+
+class MergeChunksTest(unittest.TestCase):
+
+    def testObservationAtWindowBoundIsKeptOnce(self):
+        first = makeSeries(['2017-01-01T00:00', '2017-01-02T00:00'],
+                           [1., 2.], offering='off', observed_property='p')
+        second = makeSeries(['2017-01-02T00:00', '2017-01-03T00:00'],
+                            [2., 3.], unit='m')
+        series = mergeChunks([first, second])
+        self.assertEqual(series.values.tolist(), [1., 2., 3.])
+        self.assertEqual(series.offering, 'off')
+        self.assertEqual(series.observed_property, 'p')
+        self.assertEqual(series.unit, 'm')
+
+    def testEmptyChunksAreSkipped(self):
+        empty = makeSeries([], [])
+        chunk = makeSeries(['2017-01-01T00:00'], [1.])
+        series = mergeChunks([empty, chunk, empty])
+        self.assertEqual(series.values.tolist(), [1.])
+
+    def testOnlyEmptyChunks(self):
+        series = mergeChunks([makeSeries([], [], unit='m')])
+        self.assertTrue(series.isEmpty())
+        self.assertEqual(series.unit, 'm')
+
+
+
+class EstimateObservationsTest(unittest.TestCase):
+
+    def testUnknownAvailability(self):
+        self.assertIsNone(estimateObservations(None, START, START + DAY))
+        self.assertIsNone(estimateObservations(
+            (START, START + DAY, None), START, START + DAY))
+
+    def testObservationsAreEvenlySpread(self):
+        availability = (START, START + 10 * DAY, 1000)
+        self.assertEqual(estimateObservations(availability, START,
+                                              START + 5 * DAY), 500)
+        self.assertEqual(estimateObservations(availability, START - DAY,
+                                              START + 20 * DAY), 1000)
+        self.assertEqual(estimateObservations(availability, START - 2 * DAY,
+                                              START - DAY), 0)
+
+
+
+class PlanRetrievalTest(unittest.TestCase):
+
+    def testUnknownObservationsKeepDefaults(self):
+        self.assertEqual(planRetrieval(None, START, START + 10 * DAY, 300,
+                                       default_window=DAY), (DAY, 300))
+
+    def testSmallRetrievalIsOneWindow(self):
+        window, read_timeout = planRetrieval(100, START, START + 2 * DAY, 300)
+        self.assertEqual(window, 2 * DAY)
+        self.assertEqual(read_timeout, 300)
+
+    def testLargeRetrievalIsSplit(self):
+        throughput = Throughput(latency=1., rate=1000., samples=5)
+        window, read_timeout = planRetrieval(10 ** 6, START,
+                                             START + 100 * DAY, 300,
+                                             throughput=throughput)
+        # 59000 observations per request at most.
+        self.assertTrue(window < 100 * DAY)
+        self.assertTrue(10 ** 6 * window.total_seconds()
+                        / (100 * DAY).total_seconds() <= 59000)
+        # Measured servers get a timeout matching the expected duration.
+        self.assertTrue(MINIMUM_READ_TIMEOUT <= read_timeout < 300)
+
+    def testWindowIsNeverShorterThanMinimum(self):
+        throughput = Throughput(latency=1., rate=1., samples=5)
+        window, _ = planRetrieval(10 ** 9, START, START + DAY, 300,
+                                  throughput=throughput)
+        self.assertEqual(window, MINIMUM_WINDOW)
+
+    def testUnmeasuredServerKeepsLongerDefaultTimeout(self):
+        window, read_timeout = planRetrieval(10 ** 6, START,
+                                             START + 100 * DAY, 300)
+        self.assertEqual(read_timeout, 300)
+
+    def testNoTimeoutIsKept(self):
+        _, read_timeout = planRetrieval(10 ** 6, START, START + 100 * DAY, 0)
+        self.assertEqual(read_timeout, 0)
+
+    def testDensityIsUsedWhenObservationsAreUnknown(self):
+        throughput = Throughput(latency=1., rate=1000., density=1.,
+                                samples=5)
+        window, _ = planRetrieval(None, START, START + 100 * DAY, 300,
+                                  default_window=DAY, throughput=throughput)
+        self.assertNotEqual(window, DAY)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
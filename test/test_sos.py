@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+"""
+Unit tests of SOS server feature probing and of time series retrieval.
+Requests are answered by a fake transport, or retrieval functions are
+replaced by fakes, without any server.
+
+These tests need the QGIS Python environment (sos module imports qgis.core
+and PyQt4), and are skipped otherwise. Usage:
+
+    python -m unittest discover -s test
+
+"""
+
+
+import csv
+import datetime
+import functools
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+import requests
+from dateutil import tz
+
+import retrieval
+from cache import ObservationCache
+from timeseries import TimeSeries
+from writers import CsvSeriesWriter
+from test_parsing import GDA10, GDA20, EXCEPTION_REPORT, RESULT_TEMPLATE
+
+try:
+    import sos
+except ImportError:
+    sos = None
+
+
+URL = 'http://example.org/52n-sos/service'
+START = datetime.datetime(2017, 1, 1)
+HOUR = datetime.timedelta(hours=1)
+DAY = datetime.timedelta(days=1)
+
+
+
+class FakeService:
+    """SOS service description without any advertised operation."""
+
+    version = '2.0.0'
+    url = URL
+
+    def getOperationByName(self, name):
+        raise KeyError(name)
+
+
+
+class FakeResponse:
+
+    def __init__(self, content, content_type):
+        self.content = content
+        self.headers = {'Content-Type': content_type}
+
+
+
+@unittest.skipIf(sos is None, 'QGIS is not available')
+class ProbeJsonBindingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.answer = None
+
+    def tearDown(self):
+        # Back to the Transport.post method.
+        del sos.transport.post
+
+    def post(self, url, data, headers=None, timeout=None):
+        self.requests.append((url, timeout))
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
+
+    def probe(self, answer):
+        self.answer = answer
+        sos.transport.post = self.post
+        return sos.probeJsonBinding(FakeService())
+
+    def testJsonAnswer(self):
+        self.assertTrue(self.probe(FakeResponse(
+            b'{"version": "2.0.0"}', 'application/json;charset=UTF-8')))
+        self.assertEqual(self.requests,
+                         [(URL + '/json', sos.JSON_PROBE_TIMEOUT)])
+
+    def testXmlAnswer(self):
+        self.assertFalse(self.probe(FakeResponse(
+            b'<ows:ExceptionReport/>', 'application/xml')))
+
+    def testHtmlErrorPage(self):
+        self.assertFalse(self.probe(FakeResponse(
+            b'<html>Not found</html>', 'text/html')))
+
+    def testTimeout(self):
+        self.assertFalse(self.probe(requests.exceptions.ReadTimeout()))
+
+
+
+class FakeStations:
+    """StationIndex of two stations, observing 'temperature' or not."""
+
+    def getStation(self, station_number):
+        return station_number
+
+    def getOfferings(self, station):
+        return [FakeOffering('offering%d' % station)]
+
+    def getOffering(self, station_number, offering_number):
+        return FakeOffering('offering%d' % station_number)
+
+    def getObservedProperties(self, offering_id):
+        if offering_id == 'offering2':
+            return ['humidity']
+        return ['temperature']
+
+
+
+class FakeOffering:
+
+    def __init__(self, offering_id, procedures=(), observed_properties=()):
+        self.id = offering_id
+        self.procedures = list(procedures)
+        self.observed_properties = list(observed_properties)
+
+
+
+@unittest.skipIf(sos is None, 'QGIS is not available')
+class GetStationsSeriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    def tearDown(self):
+        sos.getSeriesSOS200 = self.getSeriesSOS200
+
+    def retrieve(self, station_number, offering_number, property_number,
+                 *args, **kwargs):
+        self.calls.append((station_number, kwargs.get('window'),
+                           kwargs.get('timeout')))
+        return 'series', 'response'
+
+    def testPlans(self):
+        self.getSeriesSOS200 = sos.getSeriesSOS200
+        sos.getSeriesSOS200 = lambda sos_, *args, **kwargs: self.retrieve(
+            *args, **kwargs)
+        plans = {0: ('window0', (5, 10)), 1: ('window1', (5, 60))}
+        results, failures = sos.getStationsSeriesSOS200(
+            FakeService(), [0, 1, 2, 3], 'temperature', None, None,
+            stations=FakeStations(), workers=1, window='default',
+            timeout=(5, 30), plans=plans)
+        # Station 2 does not observe temperature, station 3 has no plan.
+        self.assertEqual(self.calls, [(0, 'window0', (5, 10)),
+                                      (1, 'window1', (5, 60)),
+                                      (3, 'default', (5, 30))])
+        self.assertEqual(len(results), 3)
+        self.assertEqual(failures, [])
+
+
+
+@unittest.skipIf(sos is None, 'QGIS is not available')
+class GetDataAvailabilityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        # Whether the server gives GetDataAvailability 2.0 responses.
+        self.version20 = True
+
+    def tearDown(self):
+        del sos.transport.get
+
+    def get(self, url, params=None, timeout=None):
+        self.requests.append(params)
+        if 'responseFormat' not in params:
+            return FakeResponse(GDA10, 'application/xml')
+        if self.version20:
+            return FakeResponse(GDA20, 'application/xml')
+        return FakeResponse(EXCEPTION_REPORT, 'application/xml')
+
+    def getDataAvailability(self, offerings, cache=None):
+        sos.transport.get = self.get
+        return sos.getDataAvailability(FakeService(), offerings, cache=cache)
+
+    def testBatches(self):
+        offerings = [FakeOffering('offering%d' % i, ['procedure%d' % i],
+                                  ['temperature'])
+                     for i in range(1, 46)]
+        availability = self.getDataAvailability(offerings)
+        self.assertEqual(availability, {('offering1', 'temperature'): (
+            datetime.datetime(2017, 1, 1), datetime.datetime(2017, 1, 31),
+            721)})
+        self.assertEqual([len(params['offering'].split(','))
+                          for params in self.requests], [20, 20, 5])
+        self.assertEqual(self.requests[2]['offering'],
+                         ','.join('offering%d' % i for i in range(41, 46)))
+        for params in self.requests:
+            self.assertEqual(params['responseFormat'], sos.GDA20_NS)
+
+    def testVersion10Fallback(self):
+        self.version20 = False
+        offerings = [FakeOffering('offering1', ['procedure1'],
+                                  ['temperature', 'humidity'])]
+        availability = self.getDataAvailability(offerings)
+        period = (datetime.datetime(2017, 1, 1),
+                  datetime.datetime(2017, 6, 30, 21), None)
+        self.assertEqual(availability,
+                         {('offering1', 'temperature'): period,
+                          ('offering1', 'humidity'): period})
+        self.assertEqual(len(self.requests), 2)
+        self.assertIn('responseFormat', self.requests[0])
+        self.assertNotIn('responseFormat', self.requests[1])
+
+    def testCachedAvailability(self):
+        folder = tempfile.mkdtemp()
+        try:
+            cache = ObservationCache(os.path.join(folder,
+                                                  'observations.sqlite'))
+            offerings = [FakeOffering('offering1', ['procedure1'],
+                                      ['temperature'])]
+            availability = self.getDataAvailability(offerings, cache)
+            self.assertEqual(len(self.requests), 1)
+            self.assertEqual(self.getDataAvailability(offerings, cache),
+                             availability)
+            self.assertEqual(len(self.requests), 1)
+        finally:
+            shutil.rmtree(folder)
+
+
+
+class FakeStream:
+
+    head = '<sos:GetObservationResponse>'
+
+    def close(self):
+        pass
+
+
+
+@unittest.skipIf(sos is None, 'QGIS is not available')
+class ExportSeriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'series.csv')
+        self.windows = []
+        self.failed = False
+        self.functions = (sos.openObservationStream,
+                          sos.iterMeasurementBatches)
+        sos.openObservationStream = self.openObservationStream
+        sos.iterMeasurementBatches = self.iterMeasurementBatches
+        # Retry failed windows at once.
+        self.backoff_base = retrieval.BACKOFF_BASE
+        retrieval.BACKOFF_BASE = 0.
+
+    def tearDown(self):
+        sos.openObservationStream, sos.iterMeasurementBatches = self.functions
+        retrieval.BACKOFF_BASE = self.backoff_base
+        shutil.rmtree(self.folder)
+
+    def openObservationStream(self, sos_, offerings, observedProperties,
+                              starting_time, ending_time, **kwargs):
+        self.windows.append((starting_time, ending_time))
+        return FakeStream()
+
+    def iterMeasurementBatches(self, stream, monitor=None):
+        # Hourly observations of the window, bounds included as servers
+        # do, in two batches.
+        starting_time, ending_time = self.windows[-1]
+        times = numpy.arange(numpy.datetime64(starting_time, 'ms'),
+                             numpy.datetime64(ending_time, 'ms')
+                             + numpy.timedelta64(1, 'h'),
+                             numpy.timedelta64(1, 'h'))
+        values = (times - numpy.datetime64(START, 'ms')).astype(float) / 1000
+        middle = len(times) // 2
+        yield TimeSeries(times[:middle], values[:middle], unit='m')
+        if len(self.windows) == 2 and not self.failed:
+            # The response of the second window is interrupted once,
+            # after its first batch has been written.
+            self.failed = True
+            raise requests.exceptions.ConnectionError()
+        yield TimeSeries(times[middle:], values[middle:], unit='m')
+
+    def readRows(self):
+        with open(self.path) as f:
+            return list(csv.reader(f))
+
+    def testOverlappingWindows(self):
+        writer = CsvSeriesWriter(self.path)
+        try:
+            rows, response = sos.exportSeriesSOS200(
+                FakeService(), 0, 0, 0, START, START + 3 * DAY, writer,
+                stations=FakeStations(), window=DAY)
+        finally:
+            writer.close()
+        self.assertEqual(self.windows,
+                         [(START, START + DAY),
+                          (START + DAY, START + 2 * DAY),
+                          (START + DAY, START + 2 * DAY),
+                          (START + 2 * DAY, START + 3 * DAY)])
+        # Each observation is written once, although windows share their
+        # bounds and the second window has been written partly twice.
+        self.assertEqual(rows, 3 * 24 + 1)
+        self.assertEqual(response, FakeStream.head)
+
+        # Same file as the one written from the whole time series by the
+        # original CSV export of the plugin, from UTC datetime objects.
+        baseline = [['Date', 'temperature(m)']]
+        for hour in range(3 * 24 + 1):
+            date = START.replace(tzinfo=tz.tzutc()) + hour * HOUR
+            baseline.append([str(date), repr(hour * 3600.)])
+        self.assertEqual(self.readRows(), baseline)
+
+
+
+@unittest.skipIf(sos is None, 'QGIS is not available')
+class FollowSeriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.polls = []
+        self.fetchResults = sos.fetchResults
+        sos.transport.get = self.get
+        sos.fetchResults = self.fetch
+
+    def tearDown(self):
+        sos.fetchResults = self.fetchResults
+        del sos.transport.get
+
+    def get(self, url, params=None, timeout=None):
+        self.requests.append(params['request'])
+        return FakeResponse(RESULT_TEMPLATE, 'application/xml')
+
+    def fetch(self, sos_, offering, prop, template, starting_time,
+              ending_time, **kwargs):
+        self.polls.append((offering, prop, template, starting_time))
+        times = [numpy.datetime64(starting_time, 'ms'),
+                 numpy.datetime64(starting_time + HOUR, 'ms')]
+        return TimeSeries(times, [1., 2.], unit='m'), ''
+
+    def testTemplateIsRequestedOnce(self):
+        # As in MainWindowDialog.followTimeSeries, without any cache.
+        service = FakeService()
+        template = sos.findResultTemplate(service, 'offering0',
+                                          'temperature')
+        retrieve = functools.partial(sos.followSeriesSOS200, service, 0, 0,
+                                     0, stations=FakeStations(),
+                                     template=template)
+        last_time = START
+        for poll in range(3):
+            series, response = retrieve(last_time)
+            # Only the observation later than the last one received.
+            self.assertEqual(len(series), 1)
+            last_time = series.getDates()[-1]
+        self.assertEqual(self.requests, ['GetResultTemplate'])
+        self.assertEqual([(offering, prop, polled_template)
+                          for offering, prop, polled_template, _
+                          in self.polls],
+                         3 * [('offering0', 'temperature', template)])
+        self.assertEqual([starting_time for _, _, _, starting_time
+                          in self.polls],
+                         [START, START + HOUR, START + 2 * HOUR])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
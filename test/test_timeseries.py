@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+"""
+Unit tests of the TimeSeries object.
+
+These tests do not need QGIS. Usage:
+
+    python -m unittest discover -s test
+
+"""
+
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+
+from timeseries import TimeSeries
+
+
+
+class TimeSeriesTest(unittest.TestCase):
+
+    def testFormatTimesAreMarkedUtc(self):
+        series = TimeSeries(['2017-01-01T00:00:00', '2017-01-01T01:30:00'],
+                            [1., 2.])
+        self.assertEqual(series.formatTimes().tolist(),
+                         ['2017-01-01 00:00:00+00:00',
+                          '2017-01-01 01:30:00+00:00'])
+
+    def testFormatTimesWithMilliseconds(self):
+        series = TimeSeries(['2017-01-01T00:00:00.250'], [1.])
+        self.assertEqual(series.formatTimes().tolist(),
+                         ['2017-01-01 00:00:00.250+00:00'])
+
+    def testExtend(self):
+        series = TimeSeries(['2017-01-01'], [1.], offering='off')
+        for day in range(2, 30):
+            series.extend(TimeSeries(['2017-01-%02d' % day], [float(day)],
+                                     unit='m'))
+        self.assertEqual(len(series), 29)
+        self.assertEqual(series.values[-1], 29.)
+        self.assertEqual(series.unit, 'm')
+        self.assertEqual(series.offering, 'off')
+
+    def testCopyIsNotChangedByExtend(self):
+        series = TimeSeries(['2017-01-01'], [1.])
+        series.extend(TimeSeries(['2017-01-02'], [2.]))
+        copy = series.copy()
+        series.extend(TimeSeries(['2017-01-03'], [3.]))
+        copy.extend(TimeSeries(['2017-01-04'], [4.]))
+        self.assertEqual(series.values.tolist(), [1., 2., 3.])
+        self.assertEqual(copy.values.tolist(), [1., 2., 4.])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+"""
+Round trip tests of the time series file writers: time series written batch
+by batch are read back with the library of their format. Tests of formats
+whose library is not installed are skipped.
+
+These tests do not need QGIS. Usage:
+
+    python -m unittest discover -s test
+
+"""
+
+
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+
+from timeseries import TimeSeries
+from writers import CsvSeriesWriter, ParquetSeriesWriter, ArrowSeriesWriter
+from writers import NetCDFSeriesWriter, getSeriesWriter, pyarrow, netCDF4
+
+
+METADATA = {'unit': 'm', 'offering': 'offering1',
+            'observed_property': 'level'}
+
+
+
+def makeSeries(start, stop):
+    """Return the observations of a series, every 90 minutes, by index."""
+    times = (numpy.datetime64('2017-01-01T00:00:00', 'ms')
+             + numpy.arange(start, stop) * numpy.timedelta64(90, 'm'))
+    values = numpy.arange(start, stop) / 4.
+    return TimeSeries(times, values, **METADATA)
+
+
+
+class SeriesWriterTest(object):
+    """
+    Tests shared by every writer, which read(path) returns the (times,
+    values, metadata) written to a file.
+    """
+
+    writer_class = None
+    extension = None
+    # Metadata of makeSeries time series, as written to a file.
+    metadata = METADATA
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'series' + self.extension)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, batches, template=None, compression=True):
+        writer = self.writer_class(self.path, template, compression)
+        try:
+            for batch in batches:
+                writer.write(batch)
+        finally:
+            writer.close()
+        return writer
+
+    def checkRoundTrip(self, compression):
+        # An empty batch does not end the time series.
+        writer = self.write([makeSeries(0, 10), makeSeries(10, 10),
+                             makeSeries(10, 25)], compression=compression)
+        self.assertEqual(writer.rows, 25)
+        times, values, metadata = self.read(self.path)
+        expected = makeSeries(0, 25)
+        numpy.testing.assert_array_equal(times, expected.times)
+        numpy.testing.assert_array_equal(values, expected.values)
+        self.assertEqual(metadata, self.metadata)
+
+    def testRoundTrip(self):
+        self.checkRoundTrip(True)
+
+    def testUncompressedRoundTrip(self):
+        self.checkRoundTrip(False)
+
+    def testTemplate(self):
+        # Without any batch, the file is written with the template metadata.
+        self.write([], template=makeSeries(0, 0))
+        times, values, metadata = self.read(self.path)
+        self.assertEqual(len(times), 0)
+        self.assertEqual(len(values), 0)
+        self.assertEqual(metadata, self.metadata)
+
+    def testGetSeriesWriter(self):
+        self.assertIsInstance(getSeriesWriter(self.path), self.writer_class)
+
+
+
+class CsvSeriesWriterTest(SeriesWriterTest, unittest.TestCase):
+
+    writer_class = CsvSeriesWriter
+    extension = '.csv'
+    # CSV files only keep the observed property and its unit, in the
+    # header of the value column.
+    metadata = {'Date': 'level(m)'}
+
+    def read(self, path):
+        with open(path) as f:
+            rows = list(csv.reader(f))
+        metadata = {rows[0][0]: rows[0][1]}
+        times = numpy.array([row[0][:-len('+00:00')] for row in rows[1:]],
+                            dtype='datetime64[ms]')
+        values = numpy.array([float(row[1]) for row in rows[1:]])
+        return times, values, metadata
+
+    def testUnknownExtension(self):
+        self.assertIsInstance(
+            getSeriesWriter(os.path.join(self.folder, 'series.txt')),
+            CsvSeriesWriter)
+
+
+
+def readArrowTable(table):
+    """Return the (times, values, metadata) of an Arrow table."""
+    times = numpy.array(
+        table.column('time').cast(pyarrow.int64()).to_pylist(),
+        dtype=numpy.int64).astype('datetime64[ms]')
+    values = numpy.array(table.column('value').to_pylist(), dtype=float)
+    metadata = dict((key.decode('utf-8'), value.decode('utf-8'))
+                    for key, value in table.schema.metadata.items())
+    return times, values, metadata
+
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class ParquetSeriesWriterTest(SeriesWriterTest, unittest.TestCase):
+
+    writer_class = ParquetSeriesWriter
+    extension = '.parquet'
+
+    def read(self, path):
+        return readArrowTable(pyarrow.parquet.read_table(path))
+
+    def testBatchesAreRowGroups(self):
+        self.write([makeSeries(0, 10), makeSeries(10, 25)])
+        self.assertEqual(pyarrow.parquet.ParquetFile(self.path)
+                         .metadata.num_row_groups, 2)
+
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class ArrowSeriesWriterTest(SeriesWriterTest, unittest.TestCase):
+
+    writer_class = ArrowSeriesWriter
+    extension = '.arrow'
+
+    def read(self, path):
+        return readArrowTable(pyarrow.ipc.open_file(path).read_all())
+
+
+
+@unittest.skipIf(netCDF4 is None, 'netCDF4 is not installed')
+class NetCDFSeriesWriterTest(SeriesWriterTest, unittest.TestCase):
+
+    writer_class = NetCDFSeriesWriter
+    extension = '.nc'
+
+    def read(self, path):
+        dataset = netCDF4.Dataset(path)
+        try:
+            time = dataset.variables['time']
+            value = dataset.variables['value']
+            times = numpy.asarray(time[:], dtype=numpy.int64)
+            values = numpy.asarray(value[:], dtype=float)
+            metadata = {'unit': value.units,
+                        'offering': dataset.getncattr('offering'),
+                        'observed_property':
+                            dataset.getncattr('observed_property')}
+        finally:
+            dataset.close()
+        return times.astype('datetime64[ms]'), values, metadata
+
+
+
+if __name__ == '__main__':
+    unittest.main()
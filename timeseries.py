@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+import numpy
+
+
+
+def extendArray(array, values, buffer=None):
+    """
+    Append values to a numpy array without copying it each time.
+
+    The returned array is a leading view of a larger buffer array, whose
+    spare room is filled by next calls. The buffer is reallocated with
+    twice the needed size when it is too small, so that appending n items
+    costs O(n) amortized.
+
+    arguments:
+        >>> array:
+            numpy array.
+        >>> values:
+            sequence of values appended to array.
+        >>> buffer:
+            buffer returned by the previous call for this array, or None.
+
+    return values:
+        >>> array:
+            numpy array of the items of array followed by values.
+        >>> buffer:
+            buffer array of which array is a view, to be given to the next
+            call.
+    """
+
+    count = len(array)
+    total = count + len(values)
+    if buffer is None or array.base is not buffer or len(buffer) < total:
+        grown = numpy.empty(max(2 * total, 16), dtype=array.dtype)
+        grown[:count] = array
+        buffer = grown
+    buffer[count:total] = values
+
+    return buffer[:total], buffer
+
+
+
+class TimeSeries:
+    """
+    Time series of one observed property of one offering, stored as two
+    numpy arrays instead of lists of Python objects: a 'datetime64[ms]'
+    array of (UTC) times and a float64 array of values, that is 16 bytes per
+    observation.
+
+    arguments:
+        >>> times:
+            sequence of times, converted to a 'datetime64[ms]' numpy array.
+        >>> values:
+            sequence of values, converted to a float64 numpy array.
+        >>> unit:
+            unit of measured observed property (string).
+        >>> offering:
+            offering id (string).
+        >>> observed_property:
+            observed property (string).
+        >>> feature_of_interest:
+            feature of interest (string), when several features of interest
+            share the offering (see sos.getAreaSeriesSOS200), or ''.
+
+    """
+
+    def __init__(self, times=(), values=(), unit='', offering='',
+                 observed_property='', feature_of_interest=''):
+        self.times = numpy.asarray(times, dtype='datetime64[ms]')
+        self.values = numpy.asarray(values, dtype=numpy.float64)
+        if self.times.shape != self.values.shape:
+            raise ValueError('times and values must have the same length')
+        self.unit = unit or ''
+        self.offering = offering or ''
+        self.observed_property = observed_property or ''
+        self.feature_of_interest = feature_of_interest or ''
+        # Arrays of which times and values are views, once observations
+        # have been appended (see extend).
+        self.times_buffer = None
+        self.values_buffer = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def isEmpty(self):
+        return len(self.times) == 0
+
+    def copy(self, times=None, values=None, **metadata):
+        """
+        Return a time series with the same metadata, and optionally other
+        times and values or other metadata.
+        """
+
+        attributes = {'unit': self.unit, 'offering': self.offering,
+                      'observed_property': self.observed_property,
+                      'feature_of_interest': self.feature_of_interest}
+        attributes.update(metadata)
+        return TimeSeries(self.times if times is None else times,
+                          self.values if values is None else values,
+                          **attributes)
+
+    def extend(self, series):
+        """
+        Append the observations of another time series, later than the
+        last one, in place. Only the appended observations are copied (see
+        extendArray), e.g. when new observations are received in follow
+        mode.
+        """
+
+        self.times, self.times_buffer = extendArray(
+            self.times, series.times.astype(self.times.dtype),
+            self.times_buffer)
+        self.values, self.values_buffer = extendArray(
+            self.values, series.values, self.values_buffer)
+        if not self.unit:
+            self.unit = series.unit
+
+    def getLabel(self):
+        """Return the "observed property(unit)" label of the values."""
+        return self.observed_property + "(" + self.unit + ")"
+
+    def getDates(self):
+        """Return the times as a list of 'datetime.datetime' objects."""
+        return self.times.astype(object).tolist()
+
+    def formatTimes(self, start=0, stop=None):
+        """
+        Return the times from index start to index stop as an array of
+        'YYYY-MM-DD hh:mm:ss+00:00' strings, with milliseconds if needed,
+        as str() writes UTC 'datetime.datetime' objects: times are UTC,
+        whatever the time zone of the server.
+        """
+
+        times = self.times[start:stop]
+        if len(times) and (times.astype(numpy.int64) % 1000).any():
+            unit = 'ms'
+        else:
+            unit = 's'
+        return numpy.char.add(numpy.char.replace(
+            numpy.datetime_as_string(times, unit=unit), 'T', ' '), '+00:00')
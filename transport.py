@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import ReadTimeoutError
+from requests.packages.urllib3.exceptions import ProtocolError
+
+try:
+    from urlparse import urlsplit
+except ImportError:
+    from urllib.parse import urlsplit
+
+
+# Maximum number of connections kept alive with each SOS server. It should 
+# not be lower than the number of requests sent at the same time in 
+# chunked retrieval mode (see retrieval.DEFAULT_WORKERS).
+POOL_SIZE = 10
+
+# Default connect and read timeouts (seconds) of every request.
+DEFAULT_TIMEOUT = (10, 300)
+
+
+
+class TransferStatistics:
+    """
+    Count the bytes received by the plugin since QGIS has been started, 
+    both as sent on the wire (compressed, if the server supports it) and 
+    once decoded, so that the effect of HTTP compression can be checked.
+    
+    """
+    
+    def __init__(self):
+        self.requests = 0
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self._lock = threading.Lock()
+        
+    def add(self, count=0, wire_bytes=0, decoded_bytes=0):
+        """Add a number of requests, and of received bytes."""
+        with self._lock:
+            self.requests += count
+            self.wire_bytes += wire_bytes
+            self.decoded_bytes += decoded_bytes
+            
+    def compressionRatio(self):
+        """Return the decoded bytes / wire bytes ratio, or None."""
+        with self._lock:
+            if not self.wire_bytes:
+                return None
+            return float(self.decoded_bytes) / self.wire_bytes
+
+
+
+class Transport:
+    """
+    HTTP transport shared by every SOS request of the plugin.
+    
+    One requests session is kept per server (scheme and host), so that 
+    connections are kept alive and reused between requests, including 
+    requests sent at the same time by several threads. Every request asks 
+    for a gzip or deflate compressed response.
+    
+    argument: 
+        >>> pool_size: 
+            maximum number (int) of connections kept alive with each server.
+    
+    """
+    
+    def __init__(self, pool_size=POOL_SIZE):
+        self.pool_size = pool_size
+        self.statistics = TransferStatistics()
+        self._sessions = {}
+        self._lock = threading.Lock()
+        
+    def getSession(self, url):
+        """Return the session used to send requests to url server."""
+        
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, 
+                                      pool_maxsize=self.pool_size)
+                session.mount(parts.scheme + '://', adapter)
+                session.headers['Accept-Encoding'] = 'gzip, deflate'
+                session.headers['Connection'] = 'keep-alive'
+                self._sessions[key] = session
+        return session
+        
+    def get(self, url, params=None, headers=None, timeout=DEFAULT_TIMEOUT, 
+            stream=False):
+        """
+        Send a HTTP "Get" request.
+        
+        arguments: 
+            >>> url: 
+                request base URL (string).
+            >>> params: 
+                dict of KVP request parameters.
+            >>> headers: 
+                dict of additional request headers.
+            >>> timeout: 
+                (connect timeout, read timeout) tuple or timeout in seconds, 
+                as requests library takes it. None means no timeout.
+            >>> stream: 
+                if False, the whole response body is read here. Otherwise 
+                it is read through a ResponseStream object.
+        
+        return value:
+            >>> response:
+                class 'requests.models.Response' object.
+        """
+        
+        response = self.getSession(url).get(url, params=params, 
+                                            headers=headers, 
+                                            timeout=timeout, stream=stream)
+        return self._record(response, stream)
+        
+    def post(self, url, data, headers=None, timeout=DEFAULT_TIMEOUT, 
+             stream=False):
+        """
+        Send a HTTP "Post" request, e.g. a JSON encoded SOS request.
+        
+        arguments: 
+            >>> data: 
+                request body (string).
+            >>> url, headers, timeout, stream: 
+                see get.
+        
+        return value:
+            >>> response:
+                class 'requests.models.Response' object.
+        """
+        
+        response = self.getSession(url).post(url, data=data, 
+                                             headers=headers, 
+                                             timeout=timeout, stream=stream)
+        return self._record(response, stream)
+        
+    def _record(self, response, stream):
+        if stream:
+            self.statistics.add(count=1)
+        else:
+            decoded_bytes = len(response.content)
+            self.statistics.add(count=1, wire_bytes=response.raw.tell(), 
+                                decoded_bytes=decoded_bytes)
+        return response
+        
+    def close(self):
+        """Close every kept alive connection."""
+        
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions = {}
+
+
+
+# Transport used by every request of the plugin.
+transport = Transport()
+
+
+
+class ResponseStream:
+    """
+    File-like object giving incremental read access to the body of a
+    streamed HTTP response, so that it can be parsed while it is being
+    received instead of being loaded in memory first.
+
+    Only the first bytes of the body are kept (see head attribute), for
+    diagnostic purposes. The latency of the response (time until its
+    headers have been received) and the total duration of the request are
+    kept as well (see getDuration), to measure server throughput.
+
+    arguments:
+        >>> response:
+            class 'requests.models.Response' object, sent with stream=True.
+        >>> head_size:
+            number of bytes (int) of the beginning of the body to keep.
+        >>> monitor:
+            retrieval.RetrievalMonitor object informed of every received
+            bytes, or None.
+
+    """
+
+    def __init__(self, response, head_size=65536, monitor=None):
+        self.response = response
+        self.monitor = monitor
+        self.head_size = head_size
+        self.head = b''
+        self.bytes_received = 0     # Number of decoded bytes read so far.
+        self.wire_bytes = 0         # Number of bytes received so far, as 
+                                    # sent by the server.
+        self.latency = response.elapsed.total_seconds()
+        self.started = time.time() - self.latency
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = None
+        try:
+            data = self.response.raw.read(size, decode_content=True)
+        # Raise the same exceptions as requests does when the whole body is
+        # read at once, so that callers (and timeouts) behave as usual.
+        except ReadTimeoutError as e:
+            raise requests.exceptions.ReadTimeout(e, response=self.response)
+        except ProtocolError as e:
+            raise requests.exceptions.ChunkedEncodingError(
+                e, response=self.response)
+
+        if len(self.head) < self.head_size:
+            self.head += data[:self.head_size - len(self.head)]
+        self.bytes_received += len(data)
+        wire_bytes = self.response.raw.tell() - self.wire_bytes
+        self.wire_bytes += wire_bytes
+        transport.statistics.add(wire_bytes=wire_bytes, 
+                                 decoded_bytes=len(data))
+        if self.monitor is not None:
+            self.monitor.update(bytes_received=wire_bytes, 
+                                decoded_bytes=len(data))
+        return data
+
+    def getDuration(self):
+        """Return the time (seconds) elapsed since the request was sent."""
+        return time.time() - self.started
+
+    def close(self):
+        self.response.close()
+
+
+
+def openStream(url, params=None, timeout=DEFAULT_TIMEOUT, monitor=None, 
+               data=None, headers=None):
+    """
+    Send a HTTP "Get" request - or a "Post" request if data is given - 
+    through the shared transport and return its body as a stream.
+
+    arguments:
+        >>> url:
+            request base URL (string).
+        >>> params:
+            dict of KVP request parameters.
+        >>> timeout:
+            (connect timeout, read timeout) tuple or timeout in seconds, or 
+            None.
+        >>> monitor:
+            retrieval.RetrievalMonitor object, or None.
+        >>> data:
+            "Post" request body (string), or None.
+        >>> headers:
+            dict of additional request headers, or None.
+
+    return value:
+        >>> stream:
+            ResponseStream object.
+    """
+
+    if data is None:
+        response = transport.get(url, params=params, headers=headers, 
+                                 timeout=timeout, stream=True)
+    else:
+        response = transport.post(url, data, headers=headers, 
+                                  timeout=timeout, stream=True)
+    # SOS servers send their exception reports as XML (or JSON, for JSON
+    # requests) along with an error status code: let the parser read them.
+    content_type = response.headers.get('Content-Type', '')
+    if (response.status_code >= 400 and 'xml' not in content_type 
+            and 'json' not in content_type):
+        response.close()
+        response.raise_for_status()
+
+    return ResponseStream(response, monitor=monitor)
@@ -11,7 +11,8 @@
 
 
 import os
-from PyQt4 import QtGui, uic
+import numpy
+from PyQt4 import QtGui, QtCore, uic
 from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as FigureCanvas
 try:
     from matplotlib.backends.backend_qt4agg import NavigationToolbar2QTAgg as NavigationToolbar
@@ -20,6 +21,10 @@ except ImportError:
 from matplotlib.figure import Figure
 
 from qgis.core import *
+from qgis.gui import QgsMapTool, QgsRubberBand
+
+from ..downsampling import minMaxDownsample
+from ..timeseries import extendArray
 
 
 
@@ -41,17 +46,505 @@ class PlotSeriesWindow(QtGui.QDialog):
         # it takes the Canvas widget and a parent
         self.toolbar = NavigationToolbar(self.canvas, self)
 
+        # Button used to follow the plotted time series (see 
+        # ui.workers.SeriesFollower), only shown when it can be followed.
+        self.follow_pushButton = QtGui.QPushButton('Follow')
+        self.follow_pushButton.setCheckable(True)
+        self.follow_pushButton.setToolTip(
+            'Retrieve new observations at a regular interval and add them '
+            'to the plot')
+        self.follow_pushButton.hide()
+
         # set the layout
         layout = QtGui.QVBoxLayout()
         layout.addWidget(self.canvas)
         layout.addWidget(self.toolbar)
+        layout.addWidget(self.follow_pushButton)
         self.setLayout(layout)
         self.setWindowTitle('Time series plot')
         
+        self.curves = []
+        # Curves drawn on top of the rest of the figure (see followCurve), 
+        # and the rest of the figure as last drawn.
+        self.blitted_curves = []
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self.onDraw)
+        
+    def plotCurve(self, ax, x, y, downsampling=True, **kwargs):
+        """
+        Plot a curve, downsampled to the plot width if needed (see 
+        DownsampledCurve).
+        
+        arguments: 
+            >>> ax: 
+                matplotlib axes of self.figure.
+            >>> x, y: 
+                float64 numpy arrays.
+            >>> downsampling: 
+                if False, every point is drawn.
+            >>> **kwargs: 
+                matplotlib line properties.
+        """
+        
+        if downsampling:
+            curve = DownsampledCurve(ax, x, y, **kwargs)
+        else:
+            curve = Curve(ax, x, y, **kwargs)
+        self.curves.append(curve)
+        return curve.line
+        
+    def followCurve(self, index, following=True):
+        """
+        Set whether a curve is drawn on its own, on top of the rest of the 
+        figure saved as a background image ("blitting"), so that appending 
+        points to it (see appendToCurve) does not draw the whole figure 
+        again.
+        
+        arguments: 
+            >>> index: 
+                curve number, in plotting order.
+            >>> following: 
+                if False, the curve is drawn with the rest of the figure 
+                again.
+        """
+        
+        curve = self.curves[index]
+        curve.line.set_animated(following)
+        if following and curve not in self.blitted_curves:
+            self.blitted_curves.append(curve)
+        elif not following and curve in self.blitted_curves:
+            self.blitted_curves.remove(curve)
+        self.background = None
+        self.canvas.draw_idle()
+        
+    def onDraw(self, event):
+        # Animated lines are not drawn with the figure: the figure is 
+        # saved as background, and they are drawn on top of it.
+        if not self.blitted_curves:
+            return
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        for curve in self.blitted_curves:
+            curve.ax.draw_artist(curve.line)
+            
+    def appendToCurve(self, index, x, y):
+        """
+        Append points, later than the last one, to a curve and draw it 
+        again. Followed curves (see followCurve) are drawn again on their 
+        own as long as they fit in their axes limits. Otherwise, the x 
+        range is moved forward if it showed the end of the curve, the y 
+        range is extended, and the whole figure is drawn again.
+        
+        arguments: 
+            >>> index: 
+                curve number, in plotting order.
+            >>> x, y: 
+                float64 numpy arrays.
+        """
+        
+        if not len(x):
+            return
+        curve = self.curves[index]
+        ax = curve.ax
+        x_min, x_max = ax.get_xlim()
+        y_min, y_max = ax.get_ylim()
+        showing_end = not len(curve.x) or curve.x[-1] <= x_max
+        curve.extend(x, y)
+        
+        redraw = False
+        if showing_end and x[-1] > x_max:
+            # Keep the same x span, with a quarter of it left after the 
+            # last point, so that next points are drawn on their own.
+            shift = x[-1] - x_max + (x_max - x_min) / 4.
+            ax.set_xlim(x_min + shift, x_max + shift)
+            redraw = True
+        visible = (x >= x_min) & (x <= x_max)
+        if visible.any():
+            y_visible = y[visible]
+            if (numpy.nanmin(y_visible) < y_min 
+                    or numpy.nanmax(y_visible) > y_max):
+                ax.relim()
+                ax.autoscale_view(scalex=False)
+                redraw = True
+        
+        if (redraw or curve not in self.blitted_curves 
+                or self.background is None):
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        for blitted_curve in self.blitted_curves:
+            blitted_curve.ax.draw_artist(blitted_curve.line)
+        self.canvas.blit(self.figure.bbox)
+        
+        
+        
+class Curve:
+    """
+    Curve drawing every point of its arrays, to which points can be 
+    appended (see extend).
+    
+    arguments: 
+        >>> ax: 
+            matplotlib axes.
+        >>> x, y: 
+            float64 numpy arrays.
+        >>> **kwargs: 
+            matplotlib line properties.
+    
+    """
+    
+    def __init__(self, ax, x, y, **kwargs):
+        x = numpy.asarray(x, dtype=numpy.float64)
+        y = numpy.asarray(y, dtype=numpy.float64)
+        if len(x) > 1 and (numpy.diff(x) < 0).any():
+            order = numpy.argsort(x, kind='mergesort')
+            x = x[order]
+            y = y[order]
+        self.ax = ax
+        self.x = x
+        self.y = y
+        # Arrays of which x and y are views, once points have been 
+        # appended.
+        self.x_buffer = None
+        self.y_buffer = None
+        
+        self.plot(**kwargs)
+        
+    def plot(self, **kwargs):
+        self.line, = self.ax.plot(self.x, self.y, **kwargs)
+        
+    def update(self):
+        """Set the points drawn by the line."""
+        self.line.set_data(self.x, self.y)
+        
+    def extend(self, x, y):
+        """
+        Append points, later than the last one, to the curve: only the 
+        appended points are copied (see timeseries.extendArray).
+        """
+        
+        self.x, self.x_buffer = extendArray(self.x, x, self.x_buffer)
+        self.y, self.y_buffer = extendArray(self.y, y, self.y_buffer)
+        self.update()
+        
+        
+        
+class DownsampledCurve(Curve):
+    """
+    Curve drawing no more points than its axes width can show.
+    
+    Only the visible part of the curve is drawn, downsampled to a min/max 
+    pair per pixel when it is dense (see downsampling.minMaxDownsample). 
+    It is resampled from the full resolution arrays whenever the x range 
+    changes - through the navigation toolbar zoom and pan tools for 
+    instance - or the canvas is resized, so that zoomed in views show 
+    every point.
+    
+    arguments: 
+        >>> ax: 
+            matplotlib axes.
+        >>> x, y: 
+            float64 numpy arrays.
+        >>> **kwargs: 
+            matplotlib line properties.
+    
+    """
+    
+    def plot(self, **kwargs):
+        ax = self.ax
+        x = self.x
+        y = self.y
+        
+        self.line, = ax.plot(x[:0], y[:0], **kwargs)
+        if len(x) > 1 and x[-1] > x[0]:
+            ax.set_xlim(x[0], x[-1])
+        self.update()
+        ax.relim()
+        ax.autoscale_view(scalex=False)
+        
+        ax.callbacks.connect('xlim_changed', self.onLimitsChanged)
+        ax.figure.canvas.mpl_connect('resize_event', self.onResize)
+        
+    def update(self):
+        """Resample the curve for the current x range and axes width."""
+        
+        if not len(self.x):
+            return
+        x_min, x_max = self.ax.get_xlim()
+        x, y = minMaxDownsample(self.x, self.y, x_min, x_max, 
+                                self.ax.bbox.width)
+        self.line.set_data(x, y)
+        
+    def onLimitsChanged(self, ax):
+        self.update()
+        ax.figure.canvas.draw_idle()
+        
+    def onResize(self, event):
+        self.update()
+        
+        
+        
         
 
 
 
+class TimeSeriesTableModel(QtCore.QAbstractTableModel):
+    """
+    Table model giving direct access to the arrays of a time series, 
+    without creating any item: cells are formatted only when the view 
+    displays them, so that the table opens at once whatever the length of 
+    the time series.
+    
+    Rows can be sorted by column and filtered by range of dates or of 
+    values. Both are done on an array of row numbers, with numpy.
+    
+    argument: 
+        >>> series: 
+            timeseries.TimeSeries object.
+    
+    """
+    
+    def __init__(self, series, parent=None):
+        super(TimeSeriesTableModel, self).__init__(parent)
+        self.series = series
+        self.rows = None            # Displayed row numbers, in display 
+                                    # order, or None for every row in time 
+                                    # order.
+        self.filter_mask = None     # Boolean array of rows kept by the 
+                                    # current filter, or None.
+        self.sort_column = 0
+        self.sort_order = QtCore.Qt.AscendingOrder
+        
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.series) if self.rows is None else len(self.rows)
+        
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return 2
+        
+    def getSeriesRow(self, row):
+        """Return the time series row number of a displayed row."""
+        return row if self.rows is None else int(self.rows[row])
+        
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+        row = self.getSeriesRow(index.row())
+        if index.column() == 0:
+            return str(self.series.formatTimes(row, row + 1)[0])
+        return str(self.series.values[row].item())
+        
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal:
+            return "Date" if section == 0 else self.series.getLabel()
+        return str(self.getSeriesRow(section) + 1)
+        
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        self.sort_column = column
+        self.sort_order = order
+        self.beginResetModel()
+        self.rows = self._getRows()
+        self.endResetModel()
+        
+    def filterRange(self, column, minimum=None, maximum=None):
+        """
+        Only display the rows whose date (column 0) or value (column 1) 
+        lies between minimum and maximum, both included.
+        
+        arguments: 
+            >>> column: 
+                column number (int).
+            >>> minimum, maximum: 
+                'datetime64' objects (column 0) or numbers (column 1), or 
+                None for no bound.
+        """
+        
+        keys = self.series.times if column == 0 else self.series.values
+        mask = numpy.ones(len(keys), dtype=bool)
+        if minimum is not None:
+            mask &= keys >= minimum
+        if maximum is not None:
+            mask &= keys <= maximum
+        self.filter_mask = mask
+        self.beginResetModel()
+        self.rows = self._getRows()
+        self.endResetModel()
+        
+    def clearFilter(self):
+        self.filter_mask = None
+        self.beginResetModel()
+        self.rows = self._getRows()
+        self.endResetModel()
+        
+    def _getRows(self):
+        ascending = self.sort_order == QtCore.Qt.AscendingOrder
+        if self.filter_mask is None:
+            if self.sort_column == 0 and ascending:
+                # Time series rows are already in time order.
+                return None
+            rows = numpy.arange(len(self.series))
+        else:
+            rows = numpy.flatnonzero(self.filter_mask)
+        if self.sort_column == 0 and ascending:
+            return rows
+            
+        keys = self.series.times if self.sort_column == 0 else (
+            self.series.values)
+        # Stable sort, so that rows with equal values stay in time order.
+        rows = rows[numpy.argsort(keys[rows], kind='mergesort')]
+        if not ascending:
+            rows = rows[::-1]
+        return rows
+        
+        
+        
+class TimeSeriesTableWindow(QtGui.QWidget):
+    """ 
+    Create the window which will display the time series in tabular 
+    format, along with range filter widgets.
+    
+    """
+    
+    def __init__(self, series, parent=None):
+        super(TimeSeriesTableWindow, self).__init__(parent)
+        
+        self.model = TimeSeriesTableModel(series, self)
+        
+        # Filter widgets.
+        self.column_comboBox = QtGui.QComboBox()
+        self.column_comboBox.addItems(["Date", series.getLabel()])
+        self.minimum_lineEdit = QtGui.QLineEdit()
+        self.minimum_lineEdit.setPlaceholderText("From")
+        self.maximum_lineEdit = QtGui.QLineEdit()
+        self.maximum_lineEdit.setPlaceholderText("To")
+        self.filter_pushButton = QtGui.QPushButton("Filter")
+        self.filter_pushButton.clicked.connect(self.applyFilter)
+        self.reset_pushButton = QtGui.QPushButton("Reset")
+        self.reset_pushButton.clicked.connect(self.resetFilter)
+        self.count_label = QtGui.QLabel()
+        
+        filter_layout = QtGui.QHBoxLayout()
+        filter_layout.addWidget(self.column_comboBox)
+        filter_layout.addWidget(self.minimum_lineEdit)
+        filter_layout.addWidget(self.maximum_lineEdit)
+        filter_layout.addWidget(self.filter_pushButton)
+        filter_layout.addWidget(self.reset_pushButton)
+        filter_layout.addWidget(self.count_label)
+        
+        # Table view. Sort indicator is set before sorting is enabled, as 
+        # enabling it sorts the model at once.
+        self.view = QtGui.QTableView()
+        self.view.setModel(self.model)
+        self.view.horizontalHeader().setSortIndicator(
+            0, QtCore.Qt.AscendingOrder)
+        self.view.setSortingEnabled(True)
+        self.view.horizontalHeader().setStretchLastSection(True)
+        
+        layout = QtGui.QVBoxLayout()
+        layout.addLayout(filter_layout)
+        layout.addWidget(self.view)
+        self.setLayout(layout)
+        self.setWindowTitle('Time series table view')
+        self.resize(500, 600)
+        self.updateCount()
+        
+    def applyFilter(self):
+        
+        column = self.column_comboBox.currentIndex()
+        try:
+            bounds = [self._parseBound(column, line_edit.text()) 
+                      for line_edit in (self.minimum_lineEdit, 
+                                        self.maximum_lineEdit)]
+        except ValueError:
+            QtGui.QMessageBox.warning(
+                    self, "Invalid filter", 
+                    'Dates must be written as "YYYY-MM-DD hh:mm:ss" (time '
+                    'is optional) and values as numbers.'
+                )
+            return
+        self.model.filterRange(column, *bounds)
+        self.updateCount()
+        
+    def resetFilter(self):
+        
+        self.minimum_lineEdit.clear()
+        self.maximum_lineEdit.clear()
+        self.model.clearFilter()
+        self.updateCount()
+        
+    def updateCount(self):
+        
+        self.count_label.setText('%d / %d rows' % (self.model.rowCount(), 
+                                                   len(self.model.series)))
+        
+    def _parseBound(self, column, text):
+        
+        text = str(text).strip()
+        if not text:
+            return None
+        if column == 0:
+            return numpy.datetime64(text, 'ms')
+        return float(text)
+        
+        
+        
+        
+class AreaMapTool(QgsMapTool):
+    """
+    Map tool used to draw a rectangular area on the QGIS map canvas, e.g. 
+    to select the stations whose observations are retrieved with a 
+    spatially filtered GetObservation request.
+    
+    The drawn rectangle stays on the map until the tool is deactivated, and 
+    is emitted, in map canvas CRS, through the areaDrawn signal.
+    
+    argument:
+        >>> canvas:
+            QgsMapCanvas object.
+    
+    """
+    
+    areaDrawn = QtCore.pyqtSignal(object)
+    
+    def __init__(self, canvas):
+        super(AreaMapTool, self).__init__(canvas)
+        self.canvas = canvas
+        self.rubber_band = QgsRubberBand(canvas, QGis.Polygon)
+        self.rubber_band.setColor(QtGui.QColor(255, 0, 0, 60))
+        self.rubber_band.setWidth(1)
+        self.start_point = None
+        
+    def canvasPressEvent(self, e):
+        self.start_point = self.toMapCoordinates(e.pos())
+        self.showRectangle(self.start_point, self.start_point)
+        
+    def canvasMoveEvent(self, e):
+        if self.start_point is not None:
+            self.showRectangle(self.start_point, self.toMapCoordinates(e.pos()))
+            
+    def canvasReleaseEvent(self, e):
+        if self.start_point is None:
+            return
+        rectangle = QgsRectangle(self.start_point, 
+                                 self.toMapCoordinates(e.pos()))
+        self.start_point = None
+        if rectangle.width() > 0 and rectangle.height() > 0:
+            self.areaDrawn.emit(rectangle)
+            
+    def showRectangle(self, start_point, end_point):
+        self.rubber_band.setToGeometry(QgsGeometry.fromRect(
+            QgsRectangle(start_point, end_point)), None)
+        
+    def deactivate(self):
+        self.rubber_band.reset(QGis.Polygon)
+        super(AreaMapTool, self).deactivate()
+        
+        
+        
 # import form from UI file
 GetCapabilityForm, _ = uic.loadUiType(os.path.join(
     os.path.dirname(__file__), 'getcapibilities.ui'))
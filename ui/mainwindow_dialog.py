@@ -9,21 +9,36 @@
 # =============================================================================
 
 
-import traceback
 import os
 from PyQt4 import QtGui, QtCore, uic
 import requests
 
 import datetime
+import functools
+import time
+import traceback
+import numpy
 
 from qgis.core import *
 import qgis.utils
 
-from owslib.sos import SensorObservationService
-from gui import CalendarWindow
-from ..sos import WGS84conversion, getCapabilitiesSOS200, getSeriesSOS200
-from ..sos import GetOfferingsList
+from gui import CalendarWindow, AreaMapTool
+from ..sos import getCapabilitiesSOS200, getSeriesSOS200, exportSeriesSOS200
+from ..sos import getStationsSeriesSOS200
+from ..sos import getPropertiesSeriesSOS200, getAreaSeriesSOS200
+from ..sos import loadCapabilities, findStationsInArea, findStationSeries
+from ..sos import chooseStrategy, getStrategyArguments, RETRIEVAL_PATHS
+from ..sos import getDataAvailability, getObservationURL, updateThroughput
+from ..sos import followSeriesSOS200, findResultTemplate
 from ..features import plotSeries, arraySeries, exportSeries
+from ..features import plotMultipleSeries, exportMultipleSeries
+from ..writers import getSeriesWriter, getExportFormats
+from ..timeseries import TimeSeries
+from ..retrieval import DEFAULT_WINDOW
+from ..retrieval import estimateObservations, planRetrieval
+from ..cache import ObservationCache, CapabilitiesCache
+from ..settings import readSetting, requestTimeout
+from workers import RetrievalWorker, SeriesFollower
 
 # Logs 
 import logging
@@ -54,6 +69,12 @@ def resolve(name, basepath=None):
     
     
 
+# Expected number of observations from which the user is told that a time 
+# series retrieval may take some time.
+LARGE_RETRIEVAL_OBSERVATIONS = 500000
+
+
+
 MainWindowForm, _ = uic.loadUiType(os.path.join(
     os.path.dirname(__file__), 'mainwindow.ui'))
 
@@ -77,23 +98,29 @@ class MainWindowDialog(QtGui.QMainWindow, MainWindowForm):
         
         self.initUI()
         # Time series attributes.
-        self.dates = []
-        self.values = []
+        self.series = TimeSeries()      # Retrieved time series, with its 
+                                        # offering, observed property and 
+                                        # unit.
         
         # SOS related attributes.
         self.sos_service_url = ''
-        self.getcap_response = ''       # GetCapabilities response.
+        self.getcap_response = ''       # GetCapabilities response (string).
         
-        self.WGS84bbox_set = set()      # Set which will contain the 
+        self.stations = None            # StationIndex object, built once 
+                                        # per GetCapabilities response, which
+                                        # maps each station to its offerings
+                                        # and their observed properties.
+        self.WGS84bbox_list = []        # List which will contain the 
                                         # bounding box of each station and thus 
                                         # the identifier of each station as the 
                                         # spatial information is used to select
                                         # the station here.
-        self.WGS84bbox_list = []
         self.selected_station_index = 0
-        self.offering = ''
-        self.observedproperty = ''
-        self.unit = ''
+        self.availability = {}          # Data availability of the time 
+                                        # series of the stations selected so
+                                        # far (see sos.getDataAvailability).
+        self.availability_worker = None # Background GetDataAvailability 
+                                        # requests (see loadAvailability).
         self.getobs_response = ''       # GetObservation response.
         
         
@@ -133,6 +160,42 @@ class MainWindowDialog(QtGui.QMainWindow, MainWindowForm):
         # plotted it.
         self.getseries_boolean = False
         
+        # Initialize background time series retrieval attributes: the 
+        # running worker, if any, and the function to call once the time 
+        # series has been retrieved.
+        self.retrieval_worker = None
+        self.retrieval_action = None
+        self.retrieval_started = 0      # time.time() value.
+        # Initialize background retrieval of the selected time series, 
+        # started as soon as it is selected (see prefetchSeries): the 
+        # running worker, if any, and its result once it has finished.
+        self.prefetch_worker = None
+        self.prefetched = None          # (request, result, monitor) tuple.
+        self.export_path = ''
+        self.export_extension = '.csv'  # Export format in batch mode.
+        self.stations_series = []       # Time series retrieved in batch 
+                                        # mode, one per selected station.
+        self.properties_series = []     # Time series retrieved in 
+                                        # multi-property mode, one per 
+                                        # observed property.
+        self.area_map_tool = None       # Map tool used to draw the area of 
+                                        # area mode.
+        self.drawn_area = None          # Drawn area (QgsRectangle object in
+                                        # map canvas CRS), or None to use 
+                                        # the map extent.
+        
+        # Initialize local store of retrieved observations, so that only 
+        # the parts of a time series which have not been retrieved yet are 
+        # requested from the server.
+        self.observation_cache = ObservationCache(os.path.join(
+                QgsApplication.qgisSettingsDirPath(), 'sos_2_0_client', 
+                'observations.sqlite'))
+        # Initialize on-disk store of GetCapabilities responses and of the 
+        # station index built from them.
+        self.capabilities_cache = CapabilitiesCache(os.path.join(
+                QgsApplication.qgisSettingsDirPath(), 'sos_2_0_client', 
+                'capabilities'))
+        
         
     def resetGetSeriesBoolean(self):
         self.getseries_boolean = False
@@ -142,6 +205,14 @@ class MainWindowDialog(QtGui.QMainWindow, MainWindowForm):
         self.setWindowTitle('SOS Client')
         self.statusBar = QtGui.QStatusBar()
         self.setStatusBar(self.statusBar)
+        # Button used to cancel a time series retrieval in progress.
+        self.cancel_pushButton = QtGui.QPushButton('Cancel')
+        self.cancel_pushButton.clicked.connect(self.cancelRetrieval)
+        self.statusBar.addPermanentWidget(self.cancel_pushButton)
+        self.cancel_pushButton.hide()
+        # Record of the way the last time series were retrieved.
+        self.retrieval_path_label = QtGui.QLabel()
+        self.statusBar.addPermanentWidget(self.retrieval_path_label)
         
         # Initialize first block of main window (SOS 2.0 server selection and 
         # general server information retrieval) related attributes and signals 
@@ -158,6 +229,8 @@ class MainWindowDialog(QtGui.QMainWindow, MainWindowForm):
                                             self.fillObservedPropertiesComboBox)
         self.select_offering_comboBox.currentIndexChanged.connect(
                                             self.resetGetSeriesBoolean)
+        self.select_prop_comboBox.currentIndexChanged.connect(
+                                            self.setCalendarLimits)
         self.starting_time_pushButton.clicked.connect(self.showStartCalendar)
         self.ending_time_pushButton.clicked.connect(self.showEndingCalendar)
         
@@ -167,8 +240,23 @@ class MainWindowDialog(QtGui.QMainWindow, MainWindowForm):
         self.plot_pushButton.clicked.connect(self.plotTimeSeries)
         self.table_view_pushButton.clicked.connect(self.arrayTimeSeries)
         self.export_as_csv_pushButton.clicked.connect(self.exportTimeSeries)
+        # Batch, multi-property and area modes are mutually exclusive.
+        self.series_mode_checkBoxes = [self.selected_stations_checkBox, 
+                                       self.all_properties_checkBox, 
+                                       self.area_stations_checkBox]
+        for checkbox in self.series_mode_checkBoxes:
+            checkbox.toggled.connect(self.uncheckOtherSeriesModes)
+        self.draw_area_toolButton.toggled.connect(self.toggleAreaMapTool)
         
 
+    def uncheckOtherSeriesModes(self, checked):
+        
+        if checked:
+            for checkbox in self.series_mode_checkBoxes:
+                if checkbox is not self.sender():
+                    checkbox.setChecked(False)
+                    
+                    
     ##########################################################################
     ####### First block of main window related functions. 
     ####### SOS 2.0 server selection and general server information retrieval
@@ -199,20 +287,32 @@ class MainWindowDialog(QtGui.QMainWindow, MainWindowForm):
             # Other attributes.
             self.getobs_response = ''
             self.getseries_boolean = False
+            self.availability = {}
+            self.cancelAvailability()
+            self.cancelPrefetch()
             
             
             # Set attributes using retrieved SOS server information.
             #
             self.sos_service_url = str(text)
-            self.getcap_response = requests.get(
-                self.sos_service_url + '?REQUEST=GetCapabilities'
-                '&SERVICE=SOS&ACCEPTVERSIONS=2.0.0', stream=True)
-            self.sos = SensorObservationService(
-                None,xml=self.getcap_response.content, version="2.0.0")
-            self.WGS84bbox_set=set(WGS84conversion(off) for off in self.sos.offerings)
-            self.WGS84bbox_list=list(self.WGS84bbox_set)
+            # Index stations once, so that selecting a station or an 
+            # offering does not scan every offering of the server again. 
+            # Both the response and the index are cached on disk, and only 
+            # retrieved again once the server response has changed.
+            self.sos, self.stations, self.getcap_response = loadCapabilities(
+                self.sos_service_url, cache=self.capabilities_cache, 
+                ttl=readSetting('capabilities_ttl'), timeout=requestTimeout())
+            self.WGS84bbox_list = self.stations.station_list
             # Set UI attributes
             self.selected_sos_server_lineEdit.setText(self.sos_service_url)
+            # Report the retrieval features found by the probe step.
+            supported = self.sos.capabilities.getSupported()
+            capabilities_text = ('Server supports: ' 
+                                 + (', '.join(supported) or 'GetObservation'))
+            self.statusBar.showMessage(capabilities_text)
+            QgsMessageLog.logMessage(
+                    self.sos_service_url + ' - ' + capabilities_text, 
+                    'SOS Client')
             
             
             if self.WGS84bbox_list == []:
@@ -295,7 +395,7 @@ class MainWindowDialog(QtGui.QMainWindow, MainWindowForm):
                 # which have None bbox.
                 self.selected_station_index = 0
                 station = self.WGS84bbox_list[self.selected_station_index]
-                for o in GetOfferingsList(self.sos, station).offering_list:
+                for o in self.stations.getOfferings(station):
                     self.select_offering_comboBox.addItem(o.id)
                     
                     
@@ -401,7 +501,9 @@ class MainWindowDialog(QtGui.QMainWindow, MainWindowForm):
                                                         # feature of 'Features 
                                                         # of interest' layer
             station = self.WGS84bbox_list[self.selected_station_index]
-            for o in GetOfferingsList(self.sos, station).offering_list:
+            offerings = self.stations.getOfferings(station)
+            self.loadAvailability(offerings)
+            for o in offerings:
                 self.select_offering_comboBox.addItem(o.id)
                 
         except IndexError:
@@ -416,47 +518,161 @@ class MainWindowDialog(QtGui.QMainWindow, MainWindowForm):
         self.statusBar.clearMessage()
         self.select_prop_comboBox.clear()
         
-        # Fill observed properties combo box.
-        station = self.WGS84bbox_list[self.selected_station_index]
-        off = (
-                GetOfferingsList(self.sos, station)
-                .offering_list[self.select_offering_comboBox.currentIndex()]
+        # Fill observed properties combo box. Calendars are set once it 
+        # is filled.
+        off = self.stations.getOffering(
+                self.selected_station_index, 
+                self.select_offering_comboBox.currentIndex()
             )
-        for p in off.observed_properties:
+        self.select_prop_comboBox.blockSignals(True)
+        for p in self.stations.getObservedProperties(off.id):
             self.select_prop_comboBox.addItem(p)
+        self.select_prop_comboBox.blockSignals(False)
+        self.setCalendarLimits()
+        
+        
+    def loadAvailability(self, offerings):
+        """
+        Retrieve the data availability of the time series of some 
+        offerings in a background thread, with GetDataAvailability requests 
+        for many offerings at once, unless the server does not support it 
+        or it is cached. Offering time periods are used until it has been 
+        retrieved, and calendars are then set again (see 
+        availabilityLoaded).
+        """
+        
+        self.cancelAvailability()
+        if not getattr(self.sos.capabilities, 'data_availability', False):
+            return
+        worker = RetrievalWorker(getDataAvailability, 
+                                 self.sos, 
+                                 offerings, 
+                                 cache=self.observation_cache, 
+                                 ttl=readSetting('capabilities_ttl'), 
+                                 timeout=requestTimeout())
+        worker.finished.connect(self.availabilityLoaded)
+        worker.failed.connect(self.availabilityFailed)
+        self.availability_worker = worker
+        worker.start()
+        
+        
+    def cancelAvailability(self):
+        """
+        Cancel the background GetDataAvailability requests, if any.
+        """
+        
+        if self.availability_worker is not None:
+            self.availability_worker.cancel()
+            self.availability_worker = None
+            
+            
+    def availabilityLoaded(self, availability):
+        
+        if self.sender() is not self.availability_worker:
+            return
+        self.availability_worker = None
+        self.availability.update(availability)
+        # Calendars of the selected time series are set again, unless its 
+        # availability is unknown.
+        if self.getSeriesAvailability() is not None:
+            self.setCalendarLimits()
             
-        # Set UI attributes related to selected offering, as it has changed.
+            
+    def availabilityFailed(self, error, trace):
+        
+        if self.sender() is not self.availability_worker:
+            return
+        self.availability_worker = None
+        # Offering time periods are used instead.
+        QgsMessageLog.logMessage(
+                'GetDataAvailability request failed\n' + trace, 'SOS Client')
+                
+                
+                    
+    def getSeriesAvailability(self, prop=None, offering=None):
+        """
+        Return the (starting_time, ending_time, count) data availability of 
+        the selected time series, or of another observed property or 
+        offering, or None if unknown.
+        """
+        
+        if prop is None:
+            prop = self.select_prop_comboBox.currentText()
+        if offering is None:
+            offering = self.select_offering_comboBox.currentText()
+        return self.availability.get((offering, prop))
+                
+                
+    def getSeriesPeriod(self):
+        """
+        Return the (starting_time, ending_time) time period of the selected 
+        time series, given by its data availability if known, or else by 
+        the time period of its offering.
+        """
+        
+        availability = self.getSeriesAvailability()
+        if availability is not None:
+            return availability[0], availability[1]
+        off = self.stations.getOffering(
+                self.selected_station_index, 
+                self.select_offering_comboBox.currentIndex()
+            )
+        return off.begin_position, off.end_position
+        
+        
+    def setCalendarLimits(self):
+        
+        if self.select_prop_comboBox.currentIndex() < 0:
+            return
+        self.getseries_boolean = False
+        begin_position, end_position = self.getSeriesPeriod()
+            
+        # Set UI attributes related to selected time series, as it has 
+        # changed.
         #
         # Set a minimum and a maximum date so that the calendar used to select 
         # time series starting time prevents user from selecting a date earlier
-        # than the begin position of the selected offering or later than its
-        # end position.
+        # than the begin position of the selected time series or later than 
+        # its end position.
         self.start_calendar.cal.setMinimumDate(
-                QtCore.QDateTime(off.begin_position).date()
+                QtCore.QDateTime(begin_position).date()
             )
         self.start_calendar.cal.setMaximumDate(
-                QtCore.QDateTime(off.end_position).date()
+                QtCore.QDateTime(end_position).date()
             )
         # Set a maximum date so that the calendar used to select time series 
         # ending time preventts user from selecting a date later than the 
-        # end position of the selected offering. 
+        # end position of the selected time series. 
         # 
         # Later, a minimum date will be set according to the starting date 
         # selected by the user. 
         self.ending_calendar.cal.setMaximumDate(
-                QtCore.QDateTime(off.end_position).date()
+                QtCore.QDateTime(end_position).date()
             )
         # Default time period is set to 2 days to prevent user from waiting
         # a very long time for the GetObservation response retrieval.
         self.start_calendar.cal.setSelectedDate(
-                QtCore.QDateTime(off.end_position - datetime.timedelta(days=2))
+                QtCore.QDateTime(end_position - datetime.timedelta(days=2))
                 .date()
             )
         # Default ending time is set according to end position of selected 
-        # offering.
+        # time series.
         self.ending_calendar.cal.setSelectedDate(
-                QtCore.QDateTime(off.end_position).date()
+                QtCore.QDateTime(end_position).date()
             )
+        # If the retrieval of the selected time series has been interrupted, 
+        # its time period is selected instead, so that retrieving it again 
+        # resumes where it stopped: completed time windows are in the 
+        # observation cache.
+        interrupted = self.getInterruptedRetrieval()
+        if interrupted is not None:
+            self.start_calendar.cal.setSelectedDate(
+                    QtCore.QDateTime(interrupted[0]).date())
+            self.ending_calendar.cal.setSelectedDate(
+                    QtCore.QDateTime(interrupted[1]).date())
+            self.statusBar.showMessage(
+                    'The last retrieval of this time series has been '
+                    'interrupted: retrieve it again to resume it')
         #  Update UI attributes text to inform user of every change.
         self.starting_time_pushButton.setText(
                 self.start_calendar.cal.selectedDate().toString()
@@ -465,11 +681,31 @@ class MainWindowDialog(QtGui.QMainWindow, MainWindowForm):
                 self.ending_calendar.cal.selectedDate().toString()
             )
         self.time_series_starting_time_value.setText(
-                QtCore.QDateTime(off.begin_position).date().toString()
+                QtCore.QDateTime(begin_position).date().toString()
             )
         self.time_series_ending_time_value.setText(
-                QtCore.QDateTime(off.end_position).date().toString()
+                QtCore.QDateTime(end_position).date().toString()
             )
+        self.prefetchSeries()
+        
+        
+    def getInterruptedRetrieval(self):
+        """
+        Return the (starting_time, ending_time) time period of the last 
+        interrupted retrieval of the selected time series, or None.
+        """
+        
+        try:
+            return self.observation_cache.getInterruptedRetrieval(
+                    getObservationURL(self.sos), 
+                    self.select_offering_comboBox.currentText(), 
+                    self.select_prop_comboBox.currentText())
+        except Exception:
+            QgsMessageLog.logMessage(
+                    'Failed to read interrupted retrievals\n' 
+                    + traceback.format_exc(), 'SOS Client')
+            return None
+        
         
     # Create several functions to get a dynamic time management in both 
     # starting time and ending time selection calendars.
@@ -512,62 +748,913 @@ class MainWindowDialog(QtGui.QMainWindow, MainWindowForm):
     ########################################################################## 
         
         
-    def getObservation(self, *args):
+    def getObservation(self, action):
+        """
+        Launch GetObservation request in a background thread, so that QGIS 
+        is not frozen while the response is retrieved. Retrieved time 
+        series is delivered to getObservationFinished, which then calls 
+        action.
+        """
         
         starting_time = QtCore.QDateTime(
             self.start_calendar.cal.selectedDate()).toPyDateTime()
         ending_time = QtCore.QDateTime(
             self.ending_calendar.cal.selectedDate()).toPyDateTime()
         
-        try:
-            self.statusBar.showMessage('Request in progress')
+        request = (self.select_offering_comboBox.currentText(), 
+                   [self.select_prop_comboBox.currentText()], 
+                   starting_time, ending_time)
+        
+        self.retrieval_action = action
+        if self.usePrefetch(request, self.getObservationFinished, 
+                            self.showTimeSeries):
+            return
+        
+        # Choose the time window and the read timeout of each request from 
+        # the expected number of observations and the measured throughput 
+        # of the server.
+        window, read_timeout = self.planRetrieval(starting_time, ending_time)
+        kwargs = {'timeout': requestTimeout(read_timeout)}
+        kwargs.update(self.getRetrievalArguments())
             
-            if len(args)==1:        # Check if user has asked for a timeout.
-                (self.dates, 
-                 self.values, 
-                 self.offering, 
-                 self.observedproperty, 
-                 self.unit, 
-                 self.getobs_response) = getSeriesSOS200(
+        self.startRetrieval(RetrievalWorker(
+                                 getSeriesSOS200,
                                  self.sos,
                                  self.selected_station_index,
                                  self.select_offering_comboBox.currentIndex(),
                                  self.select_prop_comboBox.currentIndex(),
                                  starting_time,
-                                 ending_time, 
-                                 timeout=args[0])
-            else:
-                (self.dates, 
-                 self.values, 
-                 self.offering, 
-                 self.observedproperty, 
-                 self.unit, 
-                 self.getobs_response) = getSeriesSOS200(
+                                 ending_time,
+                                 stations=self.stations,
+                                 window=window,
+                                 cache=self.observation_cache,
+                                 **kwargs), 
+                            self.getObservationFinished,
+                            request=request)
+        
+        
+    def exportObservations(self, path):
+        """
+        Launch GetObservation requests in a background thread, and write 
+        the time series to a file while it is being received, without 
+        keeping it in memory (see exportSeriesSOS200). File format depends 
+        on path extension (see writers.getSeriesWriter).
+        """
+        
+        starting_time = QtCore.QDateTime(
+            self.start_calendar.cal.selectedDate()).toPyDateTime()
+        ending_time = QtCore.QDateTime(
+            self.ending_calendar.cal.selectedDate()).toPyDateTime()
+        template = TimeSeries(
+            offering=self.select_offering_comboBox.currentText(), 
+            observed_property=self.select_prop_comboBox.currentText())
+        compression = readSetting('export_compression')
+        window, read_timeout = self.planRetrieval(starting_time, ending_time)
+        
+        def export(*args, **kwargs):
+            writer = getSeriesWriter(path, template, compression)
+            try:
+                return exportSeriesSOS200(*args, writer=writer, **kwargs)
+            finally:
+                writer.close()
+        
+        self.export_path = path
+        self.startRetrieval(RetrievalWorker(
+                                 export,
                                  self.sos,
                                  self.selected_station_index,
                                  self.select_offering_comboBox.currentIndex(),
                                  self.select_prop_comboBox.currentIndex(),
                                  starting_time,
-                                 ending_time)
-                                 
-            self.getseries_boolean = True   # From now on a time series has 
-                                            # already been successfully 
-                                            # retrieved.
+                                 ending_time,
+                                 stations=self.stations,
+                                 window=window,
+                                 cache=self.observation_cache,
+                                 timeout=requestTimeout(read_timeout),
+                                 **self.getRetrievalArguments()), 
+                            self.exportObservationsFinished)
+        
+        
+    def getStationsObservation(self, action):
+        """
+        Launch GetObservation requests for the selected observed property 
+        of every station selected on the 'Features of interest' layer, in 
+        a background thread (see getStationsSeriesSOS200). Retrieved time 
+        series are delivered to getStationsObservationFinished, which then 
+        calls action.
+        """
+        
+        station_numbers = sorted(set(
+                feat['myint'] for feat in self.stations_layer.selectedFeatures()))
+        prop = self.select_prop_comboBox.currentText()
+        if station_numbers == [] or not prop:
+            QtGui.QMessageBox.warning(
+                    self, "Warning", 
+                    "Please select stations on the 'Features of interest' "
+                    "layer, and then an observed property."
+                )
+            return
+            
+        starting_time = QtCore.QDateTime(
+            self.start_calendar.cal.selectedDate()).toPyDateTime()
+        ending_time = QtCore.QDateTime(
+            self.ending_calendar.cal.selectedDate()).toPyDateTime()
+            
+        self.retrieval_action = action
+        # Choose the time window and the read timeout of the requests of 
+        # each station from its expected number of observations.
+        self.startRetrieval(RetrievalWorker(
+                                 getStationsSeriesSOS200,
+                                 self.sos,
+                                 station_numbers,
+                                 prop,
+                                 starting_time,
+                                 ending_time,
+                                 stations=self.stations,
+                                 cache=self.observation_cache,
+                                 plans=self.planStationsRetrieval(
+                                        station_numbers, prop, 
+                                        starting_time, ending_time),
+                                 **self.getRetrievalArguments()), 
+                            self.getStationsObservationFinished)
+        
+        
+    def getStationsObservationFinished(self, result):
+        
+        if self.sender() is not self.retrieval_worker:
+            return
+        self.showRetrievalPath(self.retrieval_worker.monitor)
+        self.retrieval_worker = None
+        self.cancel_pushButton.hide()
+        
+        results, failures = result
+        self.stations_series = [series for series, response in results]
+        self.statusBar.showMessage(
+                '%d time series retrieved, %d failed' 
+                % (len(self.stations_series), len(failures))
+            )
+        if failures:
+            failures_msgbox = QtGui.QMessageBox()
+            failures_msgbox.setWindowTitle("Warning")
+            failures_msgbox.setText(
+                    "Time series retrieval failed for %d station(s)." 
+                    % len(failures)
+                )
+            failures_msgbox.setDetailedText('\n'.join(
+                    '%s: %s' % failure for failure in failures))
+            failures_msgbox.setIcon(QtGui.QMessageBox.Warning)
+            failures_msgbox.exec_()
+        if self.stations_series == []:
+            QtGui.QMessageBox.warning(
+                    self, "Warning", 
+                    "No time series was retrieved for the selected stations "
+                    "and observed property."
+                )
+            return
+        self.retrieval_action()
+        
+        
+    def getPropertiesObservation(self, action):
+        """
+        Launch a GetObservation request for every observed property of the 
+        selected offering at once, in a background thread (see 
+        getPropertiesSeriesSOS200). Retrieved time series are delivered to 
+        getPropertiesObservationFinished, which then calls action.
+        """
+        
+        if self.select_prop_comboBox.count() == 0:
+            QtGui.QMessageBox.warning(
+                    self, "Warning", 
+                    "Please select a station and an offering first."
+                )
+            return
+            
+        starting_time = QtCore.QDateTime(
+            self.start_calendar.cal.selectedDate()).toPyDateTime()
+        ending_time = QtCore.QDateTime(
+            self.ending_calendar.cal.selectedDate()).toPyDateTime()
+            
+        props = [self.select_prop_comboBox.itemText(i) 
+                 for i in range(self.select_prop_comboBox.count())]
+        request = (self.select_offering_comboBox.currentText(), props, 
+                   starting_time, ending_time)
+        
+        self.retrieval_action = action
+        if self.usePrefetch(request, self.getPropertiesObservationFinished, 
+                            self.showPropertiesSeries):
+            return
+        
+        window, read_timeout = self.planRetrieval(starting_time, ending_time, 
+                                                  props)
+            
+        self.startRetrieval(RetrievalWorker(
+                                 getPropertiesSeriesSOS200,
+                                 self.sos,
+                                 self.selected_station_index,
+                                 self.select_offering_comboBox.currentIndex(),
+                                 range(self.select_prop_comboBox.count()),
+                                 starting_time,
+                                 ending_time,
+                                 stations=self.stations,
+                                 window=window,
+                                 cache=self.observation_cache,
+                                 timeout=requestTimeout(read_timeout), 
+                                 **self.getRetrievalArguments(
+                                                        properties=True)), 
+                            self.getPropertiesObservationFinished,
+                            request=request)
+        
+        
+    def getPropertiesObservationFinished(self, result):
+        
+        if self.sender() is not self.retrieval_worker:
+            return
+        monitor = self.retrieval_worker.monitor
+        self.retrieval_worker = None
+        self.cancel_pushButton.hide()
+        self.showPropertiesSeries(result, monitor)
+        
+        
+    def showPropertiesSeries(self, result, monitor):
+        """
+        Keep the time series retrieved for every observed property of the 
+        selected offering, and call retrieval action.
+        """
+        
+        self.showRetrievalPath(monitor)
+        series_list, self.getobs_response = result
+        self.properties_series = [series for series in series_list 
+                                  if not series.isEmpty()]
+        self.statusBar.showMessage(
+                '%d observed properties retrieved with one request per '
+                'time window, %d without observations' 
+                % (len(self.properties_series), 
+                   len(series_list) - len(self.properties_series))
+            )
+        if self.properties_series == []:
+            QtGui.QMessageBox.warning(
+                    self, "Warning", 
+                    "No time series was retrieved for the observed "
+                    "properties of the selected offering."
+                )
+            return
+        self.retrieval_action()
+        
+        
+    def plotPropertiesSeries(self):
+        
+        # Observed properties usually have different units.
+        plotMultipleSeries(self.properties_series, shared_axes=False)
+        
+        
+    def exportPropertiesSeries(self):
+        
+        paths = exportMultipleSeries(self.properties_series, 
+                                     self.export_path, self.export_extension)
+        self.statusBar.showMessage(
+                '%d time series exported to %s' % (len(paths), 
+                                                   self.export_path))
+        
+        
+    def toggleAreaMapTool(self, checked):
+        """
+        Activate the map tool used to draw the area of area mode, or go 
+        back to the map extent.
+        """
+        
+        canvas = qgis.utils.iface.mapCanvas()
+        if checked:
+            if self.area_map_tool is None:
+                self.area_map_tool = AreaMapTool(canvas)
+                self.area_map_tool.areaDrawn.connect(self.setDrawnArea)
+                self.area_map_tool.deactivated.connect(self.clearDrawnArea)
+            canvas.setMapTool(self.area_map_tool)
+            self.area_stations_checkBox.setChecked(True)
+        elif self.area_map_tool is not None:
+            canvas.unsetMapTool(self.area_map_tool)
             
-        except requests.exceptions.Timeout: 
+            
+    def setDrawnArea(self, rectangle):
+        
+        self.drawn_area = rectangle
+        self.statusBar.showMessage('Area drawn: observations of the stations '
+                                   'of this area will be retrieved')
+        
+        
+    def clearDrawnArea(self):
+        
+        # The drawn area is no longer shown once the map tool has been 
+        # deactivated, e.g. by choosing another QGIS map tool.
+        self.drawn_area = None
+        self.draw_area_toolButton.setChecked(False)
+        
+        
+    def getArea(self):
+        """
+        Return the area of area mode, that is the drawn area or else the map 
+        extent, as a WGS84 (xmin, ymin, xmax, ymax) tuple.
+        """
+        
+        canvas = qgis.utils.iface.mapCanvas()
+        rectangle = self.drawn_area
+        if rectangle is None:
+            rectangle = canvas.extent()
+        transform = QgsCoordinateTransform(
+                canvas.mapSettings().destinationCrs(), 
+                QgsCoordinateReferenceSystem(4326))
+        rectangle = transform.transformBoundingBox(rectangle)
+        
+        return (max(rectangle.xMinimum(), -180.0), 
+                max(rectangle.yMinimum(), -90.0), 
+                min(rectangle.xMaximum(), 180.0), 
+                min(rectangle.yMaximum(), 90.0))
+        
+        
+    def getAreaObservation(self, action):
+        """
+        Launch a spatially filtered GetObservation request for the selected 
+        observed property of every station of the drawn area or of the map 
+        extent, in a background thread (see getAreaSeriesSOS200). Retrieved 
+        time series are delivered to getAreaObservationFinished, which then 
+        calls action.
+        """
+        
+        prop = self.select_prop_comboBox.currentText()
+        if not prop:
+            QtGui.QMessageBox.warning(
+                    self, "Warning", 
+                    "Please select an observed property first."
+                )
+            return
+            
+        starting_time = QtCore.QDateTime(
+            self.start_calendar.cal.selectedDate()).toPyDateTime()
+        ending_time = QtCore.QDateTime(
+            self.ending_calendar.cal.selectedDate()).toPyDateTime()
+            
+        self.retrieval_action = action
+        if not self.sos.capabilities.spatial_filter:
+            # Retrieve the stations of the area one by one instead.
+            station_numbers = findStationsInArea(self.stations, 
+                                                 self.getArea())
+            if station_numbers == []:
+                QtGui.QMessageBox.warning(
+                        self, "Warning", "There is no station in this area."
+                    )
+                return
+            self.startRetrieval(RetrievalWorker(
+                                 getStationsSeriesSOS200,
+                                 self.sos,
+                                 station_numbers,
+                                 prop,
+                                 starting_time,
+                                 ending_time,
+                                 stations=self.stations,
+                                 cache=self.observation_cache,
+                                 plans=self.planStationsRetrieval(
+                                        station_numbers, prop, 
+                                        starting_time, ending_time),
+                                 **self.getRetrievalArguments()), 
+                            self.getStationsObservationFinished)
+            return
+        area = self.getArea()
+        # Each request returns the observations of every station of the 
+        # area.
+        window, read_timeout = self.planAreaRetrieval(
+                findStationsInArea(self.stations, area), prop, 
+                starting_time, ending_time)
+        self.startRetrieval(RetrievalWorker(
+                                 getAreaSeriesSOS200,
+                                 self.sos,
+                                 prop,
+                                 area,
+                                 starting_time,
+                                 ending_time,
+                                 stations=self.stations,
+                                 window=window,
+                                 timeout=requestTimeout(read_timeout), 
+                                 **self.getRetrievalArguments()), 
+                            self.getAreaObservationFinished)
+        
+        
+    def getAreaObservationFinished(self, result):
+        
+        if self.sender() is not self.retrieval_worker:
+            return
+        self.showRetrievalPath(self.retrieval_worker.monitor)
+        self.retrieval_worker = None
+        self.cancel_pushButton.hide()
+        
+        results, self.getobs_response = result
+        results = [(series, station_number) 
+                   for series, station_number in results 
+                   if not series.isEmpty()]
+        self.stations_series = [series for series, station_number in results]
+        station_numbers = set(station_number 
+                              for series, station_number in results 
+                              if station_number is not None)
+        
+        # Select the stations of retrieved time series on the 'Features of 
+        # interest' layer, without changing the selected offering and 
+        # observed property.
+        self.stations_layer.blockSignals(True)
+        try:
+            self.stations_layer.setSelectedFeatures(
+                    [feat.id() for feat in self.stations_layer.getFeatures() 
+                     if feat['myint'] in station_numbers])
+        finally:
+            self.stations_layer.blockSignals(False)
+        self.stations_layer.triggerRepaint()
+        
+        self.statusBar.showMessage(
+                '%d time series retrieved with one request per time window, '
+                '%d of them linked to stations' 
+                % (len(self.stations_series), len(station_numbers))
+            )
+        if self.stations_series == []:
+            QtGui.QMessageBox.warning(
+                    self, "Warning", 
+                    "No time series was retrieved for the selected observed "
+                    "property in this area."
+                )
+            return
+        self.retrieval_action()
+        
+        
+    def plotStationsSeries(self):
+        
+        plotMultipleSeries(self.stations_series)
+        
+        
+    def exportStationsSeries(self):
+        
+        paths = exportMultipleSeries(self.stations_series, self.export_path, 
+                                     self.export_extension)
+        self.statusBar.showMessage(
+                '%d time series exported to %s' % (len(paths), 
+                                                   self.export_path))
+        
+        
+    def estimateObservations(self, starting_time, ending_time, props=None, 
+                             offering=None):
+        """
+        Return the expected number of observations of the selected time 
+        series, or of several observed properties of the selected offering 
+        (or of another offering) retrieved together, in a time period, or 
+        None if unknown. Time series without data availability are assumed 
+        to be as dense as the time series of the offering retrieved so far.
+        """
+        
+        if props is None:
+            props = [self.select_prop_comboBox.currentText()]
+        throughput = self.getThroughput(offering)
+        observations = 0
+        for prop in props:
+            count = estimateObservations(
+                    self.getSeriesAvailability(prop, offering), 
+                    starting_time, ending_time)
+            if count is None:
+                if throughput is None or throughput.density is None:
+                    return None
+                count = int(throughput.density 
+                            * (ending_time - starting_time).total_seconds())
+            observations += count
+        return observations
+        
+        
+    def getThroughput(self, offering=None):
+        """
+        Return the measured throughput of the selected server for the 
+        selected offering, or for another offering (retrieval.Throughput 
+        object), or None.
+        """
+        
+        if offering is None:
+            offering = self.select_offering_comboBox.currentText()
+        return self.observation_cache.getThroughput(
+                getObservationURL(self.sos), offering)
+        
+        
+    def planRetrieval(self, starting_time, ending_time, props=None, 
+                      offering=None):
+        """
+        Return the (time window, read timeout) of the requests retrieving 
+        the selected time series, or the time series of another offering 
+        (see retrieval.planRetrieval).
+        """
+        
+        return planRetrieval(
+                self.estimateObservations(starting_time, ending_time, props, 
+                                          offering), 
+                starting_time, ending_time, readSetting('read_timeout'), 
+                default_window=DEFAULT_WINDOW, 
+                throughput=self.getThroughput(offering))
+        
+        
+    def planStationsRetrieval(self, station_numbers, prop, starting_time, 
+                              ending_time):
+        """
+        Return the (time window, timeout) arguments of the requests 
+        retrieving prop for each station (dict keyed by station number, see 
+        getStationsSeriesSOS200), planned from the expected number of 
+        observations of the offering observing prop at each station.
+        """
+        
+        plans = {}
+        for station_number in station_numbers:
+            numbers = findStationSeries(self.stations, station_number, prop)
+            if numbers is None:
+                continue
+            offering = self.stations.getOffering(station_number, numbers[0])
+            window, read_timeout = self.planRetrieval(
+                    starting_time, ending_time, [prop], offering.id)
+            plans[station_number] = window, requestTimeout(read_timeout)
+        return plans
+        
+        
+    def planAreaRetrieval(self, station_numbers, prop, starting_time, 
+                          ending_time):
+        """
+        Return the (time window, read timeout) of the spatially filtered 
+        requests retrieving prop for every station of an area, planned from 
+        the expected number of observations of all these stations (see 
+        retrieval.planRetrieval). No throughput is measured for areas.
+        """
+        
+        observations = 0
+        for station_number in station_numbers:
+            numbers = findStationSeries(self.stations, station_number, prop)
+            if numbers is None:
+                continue
+            offering = self.stations.getOffering(station_number, numbers[0])
+            count = self.estimateObservations(starting_time, ending_time, 
+                                              [prop], offering.id)
+            if count is None:
+                observations = None
+                break
+            observations += count
+        return planRetrieval(observations, starting_time, ending_time, 
+                             readSetting('read_timeout'), 
+                             default_window=DEFAULT_WINDOW)
+                
+                
+    def getRetrievalArguments(self, properties=False):
+        """
+        Return the arguments (dict) selecting the cheapest way of 
+        retrieving time series from the selected server, unless the 
+        retrieval_strategy setting forces one (see sos.chooseStrategy).
+        
+        argument:
+            >>> properties:
+                if True, arguments of getPropertiesSeriesSOS200.
+        """
+        
+        strategy = chooseStrategy(self.sos, readSetting('retrieval_strategy'))
+        arguments = getStrategyArguments(self.sos, strategy)
+        if properties:
+            # GetResult responses of each observed property are cheaper 
+            # than a single OM 2.0 response for all of them.
+            arguments['combined'] = strategy != 'result'
+        return arguments
+        
+        
+    def showRetrievalPath(self, monitor):
+        """
+        Show and log the way the last time series were retrieved, as 
+        recorded by the retrieval monitor.
+        """
+        
+        if monitor.paths:
+            text = 'Retrieved with ' + ', '.join(
+                    RETRIEVAL_PATHS[path] for path in monitor.paths)
+        else:
+            text = 'Read from the observation cache'
+        self.retrieval_path_label.setText(text)
+        QgsMessageLog.logMessage(text, 'SOS Client')
+        
+        
+    def startRetrieval(self, worker, finished_slot, request=None):
+        """
+        Start a retrieval worker and connect its signals.
+        
+        arguments:
+            >>> worker:
+                RetrievalWorker object.
+            >>> finished_slot:
+                method called with the result of the worker.
+            >>> request:
+                (offering, observed properties, starting_time, ending_time) 
+                tuple of a time series retrieval, recorded as interrupted 
+                if the retrieval fails or is cancelled so that it can be 
+                resumed (see setCalendarLimits), or None.
+        """
+        
+        # A background retrieval would compete with this one.
+        self.cancelPrefetch()
+        self.connectRetrieval(worker, finished_slot, request)
+        worker.start()
+        
+        
+    def connectRetrieval(self, worker, finished_slot, request=None):
+        """
+        Make a retrieval worker the running one, and connect its signals 
+        (see startRetrieval).
+        """
+        
+        self.statusBar.showMessage('Request in progress')
+        
+        self.retrieval_worker = worker
+        worker.request = request
+        worker.finished.connect(self.forgetInterruption)
+        worker.failed.connect(self.recordInterruption)
+        worker.cancelled.connect(self.recordInterruption)
+        self.retrieval_started = time.time()
+        worker.progress.connect(self.showRetrievalProgress)
+        # Requests completed before a failure or a cancellation are 
+        # measured as well.
+        for signal in (worker.finished, worker.failed, worker.cancelled):
+            signal.connect(self.storeThroughput)
+        worker.finished.connect(finished_slot)
+        worker.failed.connect(self.getObservationFailed)
+        worker.cancelled.connect(self.getObservationCancelled)
+        self.cancel_pushButton.show()
+        
+        
+    def prefetchSeries(self):
+        """
+        Retrieve the selected time series, or every observed property of 
+        the selected offering, for the selected time period in a 
+        background thread of lowest priority, according to prefetch 
+        setting, so that it is usually already retrieved when user asks 
+        for it. Retrieved time windows are stored in the observation cache 
+        as well. Large retrievals are not prefetched.
+        """
+        
+        self.cancelPrefetch()
+        mode = readSetting('prefetch')
+        if (mode not in ('series', 'offering') 
+                or self.retrieval_worker is not None 
+                or self.select_prop_comboBox.currentIndex() < 0):
+            return
+        
+        starting_time = QtCore.QDateTime(
+            self.start_calendar.cal.selectedDate()).toPyDateTime()
+        ending_time = QtCore.QDateTime(
+            self.ending_calendar.cal.selectedDate()).toPyDateTime()
+        if mode == 'series':
+            function = getSeriesSOS200
+            properties = self.select_prop_comboBox.currentIndex()
+            props = [self.select_prop_comboBox.currentText()]
+        else:
+            function = getPropertiesSeriesSOS200
+            properties = range(self.select_prop_comboBox.count())
+            props = [self.select_prop_comboBox.itemText(i) 
+                     for i in range(self.select_prop_comboBox.count())]
+        if self.isLargeRetrieval(starting_time, ending_time, props):
+            return
+        
+        window, read_timeout = self.planRetrieval(starting_time, ending_time, 
+                                                  props)
+        worker = RetrievalWorker(
+                function,
+                self.sos,
+                self.selected_station_index,
+                self.select_offering_comboBox.currentIndex(),
+                properties,
+                starting_time,
+                ending_time,
+                stations=self.stations,
+                window=window,
+                workers=1,
+                cache=self.observation_cache,
+                timeout=requestTimeout(read_timeout),
+                **self.getRetrievalArguments(properties=mode == 'offering'))
+        worker.request = (self.select_offering_comboBox.currentText(), 
+                          props, starting_time, ending_time)
+        worker.finished.connect(self.prefetchFinished)
+        worker.failed.connect(self.prefetchEnded)
+        worker.cancelled.connect(self.prefetchEnded)
+        self.prefetch_worker = worker
+        worker.start(QtCore.QThread.LowestPriority)
+        
+        
+    def cancelPrefetch(self):
+        """
+        Cancel the background retrieval of the selected time series, if 
+        any, and forget its result.
+        """
+        
+        if self.prefetch_worker is not None:
+            self.prefetch_worker.cancel()
+            self.prefetch_worker = None
+        self.prefetched = None
+        
+        
+    def prefetchFinished(self, result):
+        
+        if self.sender() is not self.prefetch_worker:
+            return
+        self.prefetch_worker = None
+        self.prefetched = (self.sender().request, result, 
+                           self.sender().monitor)
+        self.storeThroughput()
+        self.forgetInterruption()
+        
+        
+    def prefetchEnded(self, *args):
+        
+        if self.sender() is not self.prefetch_worker:
+            return
+        self.prefetch_worker = None
+        self.storeThroughput()
+        
+        
+    def usePrefetch(self, request, finished_slot, show_slot):
+        """
+        Serve a time series retrieval from the background retrieval of 
+        the same time series, if any (see prefetchSeries): its result is 
+        shown at once if it has finished, or it becomes the running 
+        retrieval otherwise. Return True if the retrieval is served.
+        
+        arguments:
+            >>> request:
+                (offering, observed properties, starting_time, ending_time) 
+                tuple of the retrieval.
+            >>> finished_slot:
+                method called with the result of a running retrieval 
+                worker, such as getObservationFinished.
+            >>> show_slot:
+                method called with a retrieval result and its monitor, 
+                such as showTimeSeries.
+        """
+        
+        if self.prefetched is not None and self.prefetched[0] == request:
+            _, result, monitor = self.prefetched
+            show_slot(result, monitor)
+            return True
+        
+        worker = self.prefetch_worker
+        if worker is None or worker.request != request:
+            return False
+        self.prefetch_worker = None
+        worker.thread.setPriority(QtCore.QThread.NormalPriority)
+        self.connectRetrieval(worker, finished_slot, request)
+        return True
+        
+        
+    def storeThroughput(self, *args):
+        """
+        Store the throughput of the server measured during the retrieval 
+        which has just ended (see sos.updateThroughput).
+        """
+        
+        try:
+            updateThroughput(self.sos, self.observation_cache, 
+                             self.sender().monitor)
+        except Exception:
+            QgsMessageLog.logMessage(
+                    'Failed to store server throughput\n' 
+                    + traceback.format_exc(), 'SOS Client')
+                    
+                    
+    def recordInterruption(self, *args):
+        """
+        Record the time series retrieval which has just failed or been 
+        cancelled, whose completed time windows are already in the 
+        observation cache.
+        """
+        
+        request = self.sender().request
+        if request is None:
+            return
+        offering, props, starting_time, ending_time = request
+        try:
+            self.observation_cache.storeInterruptedRetrieval(
+                    getObservationURL(self.sos), offering, props, 
+                    starting_time, ending_time)
+        except Exception:
+            QgsMessageLog.logMessage(
+                    'Failed to record interrupted retrieval\n' 
+                    + traceback.format_exc(), 'SOS Client')
+                    
+                    
+    def forgetInterruption(self, *args):
+        
+        request = self.sender().request
+        if request is None:
+            return
+        offering, props = request[:2]
+        try:
+            self.observation_cache.clearInterruptedRetrieval(
+                    getObservationURL(self.sos), offering, props)
+        except Exception:
+            QgsMessageLog.logMessage(
+                    'Failed to clear interrupted retrieval\n' 
+                    + traceback.format_exc(), 'SOS Client')
+                    
+                    
+    def showRetrievalProgress(self, bytes_received, observations, 
+                              decoded_bytes):
+        
+        if self.sender() is not self.retrieval_worker:
+            return
+        elapsed = max(time.time() - self.retrieval_started, 1e-3)
+        self.statusBar.showMessage(
+                'Request in progress: %.1f MB received (%.1f MB decoded), '
+                '%d observations parsed - %d observations/s, %.2f MB/s' 
+                % (bytes_received / 1e6, decoded_bytes / 1e6, observations, 
+                   observations / elapsed, bytes_received / 1e6 / elapsed)
+            )
+            
+            
+    def cancelRetrieval(self):
+        
+        if self.retrieval_worker is not None:
+            # The worker stops as soon as new data are received. Its 
+            # results, if any, are ignored from now on.
+            self.retrieval_worker.cancel()
+            self.statusBar.showMessage(
+                    'Time series retrieval has been cancelled' 
+                    + self.getResumptionNote(self.retrieval_worker))
+            self.retrieval_worker = None
+            self.cancel_pushButton.hide()
+            
+            
+    def getObservationCancelled(self):
+        
+        if self.sender() is not self.retrieval_worker:
+            return
+        self.retrieval_worker = None
+        self.cancel_pushButton.hide()
+        self.statusBar.showMessage('Time series retrieval has been cancelled' 
+                                   + self.getResumptionNote(self.sender()))
+        
+        
+    def getResumptionNote(self, worker):
+        """
+        Return the end of the status message of a time series retrieval 
+        which has failed or been cancelled, telling user that it can be 
+        resumed.
+        """
+        
+        if worker.request is None:
+            return ''
+        return (': retrieved time windows are kept, retrieving the time '
+                'series again resumes where it stopped')
+        
+        
+    def getObservationFinished(self, result):
+        
+        if self.sender() is not self.retrieval_worker:
+            return
+        monitor = self.retrieval_worker.monitor
+        self.retrieval_worker = None
+        self.cancel_pushButton.hide()
+        self.showTimeSeries(result, monitor)
+        
+        
+    def showTimeSeries(self, result, monitor):
+        """
+        Keep the retrieved time series, and call retrieval action.
+        """
+        
+        self.showRetrievalPath(monitor)
+        self.series, self.getobs_response = result
+        self.getseries_boolean = True   # From now on a time series has 
+                                        # already been successfully 
+                                        # retrieved.
+        self.reportTimeSeries()
+        if monitor.decoded_bytes:
+            self.statusBar.showMessage(
+                    'Time series retrieval process is over: %.1f MB received '
+                    'for %.1f MB of decoded response' 
+                    % (monitor.bytes_received / 1e6, 
+                       monitor.decoded_bytes / 1e6)
+                )
+        self.retrieval_action()
+        
+        
+    def getObservationFailed(self, error, error_traceback):
+        
+        worker = self.sender()
+        if worker is not self.retrieval_worker:
+            return
+        self.retrieval_worker = None
+        self.cancel_pushButton.hide()
+        
+        if isinstance(error, requests.exceptions.Timeout): 
             # Inform user timeout has elapsed.
-            self.getobs_response = ''
             QtGui.QMessageBox.critical(
                     self, "Timeout error", 
-                    "The timeout has expired. Please change it and try again."
+                    "The server did not answer in time, even to smaller "
+                    "requests. Please try again later."
                 )
             self.statusBar.showMessage(
-                    'Failed to retrieve time series as timeout has expired') 
+                    'Failed to retrieve time series as timeout has expired' 
+                    + self.getResumptionNote(worker)) 
             
-        except:
+        else:
             # Inform user that an error occured and print traceback.
-            error_traceback = traceback.format_exc()
-            
             getobs_error_msg = QtGui.QMessageBox()
             getobs_error_msg.setWindowTitle("Error")
             getobs_error_msg.setTextFormat(QtCore.Qt.RichText)
@@ -590,18 +1677,16 @@ class MainWindowDialog(QtGui.QMainWindow, MainWindowForm):
             getobs_error_msg.exec_()
             
             self.statusBar.showMessage(
-                    'Failed to retrieve time series for unexpected error')  
+                    'Failed to retrieve time series for unexpected error' 
+                    + self.getResumptionNote(worker))  
         
         
-    def getTimeSeries(self):
+    def getTimeSeries(self, action):
         
         # Prepare for GetObservation response retrieval step.
         self.statusBar.clearMessage()
         # Reset attributes.
-        self.dates = []
-        self.values = []
-        self.offering = ''
-        self.observedproperty = ''  
+        self.series = TimeSeries()
         self.getobs_response = ''
         ending_time = QtCore.QDateTime(
                     self.ending_calendar.cal.selectedDate()).toPyDateTime()
@@ -609,52 +1694,49 @@ class MainWindowDialog(QtGui.QMainWindow, MainWindowForm):
                     self.start_calendar.cal.selectedDate()).toPyDateTime()
         
         
-        # GetObservation response retrieval step.
-        #
-        # Ask user if he/she wants to set a timeout value, as getting a 
-        # response to a GetObservation request can take a long time.
-        timeout_value = None
-        timeout_option = QtGui.QMessageBox.question(
-                self, "Timeout option", 
-                "Parsing the response from a SOS GetObservation request can "
-                "be very long. Would you like to set a request timeout?", 
-                QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.Yes
-            )
-        
-        if timeout_option == QtGui.QMessageBox.Yes:
-            # If user says "Yes", create a dialog window and retrieve input 
-            # timeout value.
-            timeout_value, ok = QtGui.QInputDialog.getInt(
-                    self, "Timeout value selection", 
-                    "Please enter a timeout value in seconds (integer):", 
-                    value=60, min=0, max=7200
-                )
-            timeout_value = abs(timeout_value)
-            
-            if ok:
-                # Launch GetObservation request with timeout_value as 
-                # additional argument.
-                self.getObservation(timeout_value)
-        
-        elif (ending_time - starting_time > datetime.timedelta(days=3)):
-            # If time period is longer than 3 days, inform user time series 
-            # retrieval may take some time.
+        # GetObservation response retrieval step. Request timeouts are 
+        # chosen from the measured throughput of the server (see 
+        # planRetrieval).
+        if self.isLargeRetrieval(starting_time, ending_time):
+            # Inform user time series retrieval may take some time.
+            observations = self.estimateObservations(starting_time, 
+                                                     ending_time)
             QtGui.QMessageBox.information(
                     self, "Information", 
-                    "Time series retrieval may take some time"
+                    "Time series retrieval may take some time" 
+                    + ("" if observations is None else 
+                       " (about %d observations)" % observations)
                 )
             # Launch GetObservation request with no additional arguments.
-            self.getObservation()
+            self.getObservation(action)
                 
         else:
-            self.getObservation()
+            self.getObservation(action)
         
         
+    def isLargeRetrieval(self, starting_time, ending_time, props=None):
+        """
+        Return True if the selected time series, or several observed 
+        properties of the selected offering, are expected to have more 
+        than LARGE_RETRIEVAL_OBSERVATIONS observations in a time period, 
+        or, if their number of observations is unknown, if the time period 
+        is longer than 3 days.
+        """
+        
+        observations = self.estimateObservations(starting_time, ending_time, 
+                                                 props)
+        if observations is None:
+            return ending_time - starting_time > datetime.timedelta(days=3)
+        return observations > LARGE_RETRIEVAL_OBSERVATIONS
+        
+        
+    def reportTimeSeries(self):
+        
         # GetObservation response retrieval step is over.
         # Inform user about it, and about recognized errors if needed.
         #
         # Recognized errors.
-        if self.dates == []:
+        if self.series.isEmpty():
             
             # Inform user that date and time column of retrieved time series
             # is empty.
@@ -677,7 +1759,7 @@ class MainWindowDialog(QtGui.QMainWindow, MainWindowForm):
             empty_dates_msgbox.setIcon(QtGui.QMessageBox.Warning)
             empty_dates_msgbox.exec_()
             
-        elif self.values == []:
+        elif numpy.isnan(self.series.values).all():
             
             empty_values_msgbox = QtGui.QMessageBox()
             empty_values_msgbox.setWindowTitle(
@@ -692,10 +1774,10 @@ class MainWindowDialog(QtGui.QMainWindow, MainWindowForm):
                     "reponse below!"
                 )
             if not self.getobs_response:
-                empty_dates_msgbox.setDetailedText(
+                empty_values_msgbox.setDetailedText(
                     "Empty GetObservation response")
             else:
-                empty_dates_msgbox.setDetailedText(self.getobs_response)
+                empty_values_msgbox.setDetailedText(self.getobs_response)
             empty_values_msgbox.setIcon(QtGui.QMessageBox.Warning)
             empty_values_msgbox.exec_()
         
@@ -709,38 +1791,270 @@ class MainWindowDialog(QtGui.QMainWindow, MainWindowForm):
         self.statusBar.showMessage('Time series retrieval process is over')
         
         
+    def retrievalInProgress(self):
+        
+        if self.retrieval_worker is not None:
+            self.statusBar.showMessage(
+                    'A time series retrieval is already in progress')
+            return True
+        return False
+        
+        
     def arrayTimeSeries(self):
         
+        if self.retrievalInProgress():
+            return
+        if self.selected_stations_checkBox.isChecked():
+            QtGui.QMessageBox.information(
+                    self, "Information", 
+                    'Table view shows one time series at a time. Please '
+                    'uncheck "All selected stations", or use the plot or '
+                    'export buttons.'
+                )
+            return
+        if self.all_properties_checkBox.isChecked():
+            QtGui.QMessageBox.information(
+                    self, "Information", 
+                    'Table view shows one time series at a time. Please '
+                    'uncheck "All observed properties", or use the plot or '
+                    'export buttons.'
+                )
+            return
+        if self.area_stations_checkBox.isChecked():
+            QtGui.QMessageBox.information(
+                    self, "Information", 
+                    'Table view shows one time series at a time. Please '
+                    'uncheck "All stations in area", or use the plot or '
+                    'export buttons.'
+                )
+            return
         if not self.getseries_boolean:
             # Time series has not been retrieved yet.
             # Reset GetObservation response attribute.
             self.getobs_response = ''
-            self.getTimeSeries()
-        arraySeries(self.dates, self.values, self.observedproperty, self.unit)
+            # Display it once it has been retrieved.
+            self.getTimeSeries(self.arrayTimeSeries)
+            return
+        arraySeries(self.series)
         
         
     def plotTimeSeries(self):
         
+        if self.retrievalInProgress():
+            return
+        if self.selected_stations_checkBox.isChecked():
+            # Batch mode: plot every selected station.
+            self.getStationsObservation(self.plotStationsSeries)
+            return
+        if self.all_properties_checkBox.isChecked():
+            # Multi-property mode: plot every observed property.
+            self.getPropertiesObservation(self.plotPropertiesSeries)
+            return
+        if self.area_stations_checkBox.isChecked():
+            # Area mode: plot every station of the area.
+            self.getAreaObservation(self.plotStationsSeries)
+            return
         if not self.getseries_boolean:
             # Time series has not been retrieved yet.
             # Reset GetObservation response attribute.
             self.getobs_response = ''
-            self.getTimeSeries()
-        plotSeries(self.dates, self.values, self.observedproperty, self.unit)
+            # Plot it once it has been retrieved.
+            self.getTimeSeries(self.plotTimeSeries)
+            return
+        plot_window = plotSeries(self.series)
+        if plot_window is not None:
+            self.followTimeSeries(plot_window)
+            
+            
+    def followTimeSeries(self, plot_window):
+        """
+        Let user follow the plotted time series from its plot window: new 
+        observations are then retrieved every follow_interval setting 
+        seconds and added to the time series and to its plot (see 
+        SeriesFollower).
+        """
+        
+        arguments = self.getRetrievalArguments()
+        # The result template is only requested once, or read from the 
+        # cache, instead of at each retrieval.
+        template = None
+        if arguments.pop('result_handling'):
+            template = findResultTemplate(
+                    self.sos, 
+                    self.select_offering_comboBox.currentText(), 
+                    self.select_prop_comboBox.currentText(), 
+                    cache=self.observation_cache, 
+                    timeout=requestTimeout())
+        retrieve = functools.partial(
+                followSeriesSOS200, 
+                self.sos, 
+                self.selected_station_index, 
+                self.select_offering_comboBox.currentIndex(), 
+                self.select_prop_comboBox.currentIndex(), 
+                stations=self.stations, 
+                template=template, 
+                timeout=requestTimeout(), 
+                **arguments)
+        SeriesFollower(plot_window, self.series, retrieve, 
+                       readSetting('follow_interval'))
         
         
     def exportTimeSeries(self):
         
+        if self.retrievalInProgress():
+            return
+        if self.selected_stations_checkBox.isChecked():
+            # Batch mode: export every selected station, one file each.
+            if self.getExportFolder():
+                self.getStationsObservation(self.exportStationsSeries)
+            return
+        if self.all_properties_checkBox.isChecked():
+            # Multi-property mode: export every observed property, one file 
+            # each.
+            if self.getExportFolder():
+                self.getPropertiesObservation(self.exportPropertiesSeries)
+            return
+        if self.area_stations_checkBox.isChecked():
+            # Area mode: export every station of the area, one file each.
+            if self.getExportFolder():
+                self.getAreaObservation(self.exportStationsSeries)
+            return
         if not self.getseries_boolean:
             # Time series has not been retrieved yet.
+            path = self.getExportPath(
+                    self.select_offering_comboBox.currentText())
+            if not path:
+                return
+            # It may have been retrieved, or be being retrieved, in the 
+            # background (see prefetchSeries): it is then exported once in 
+            # memory instead of being downloaded again.
+            starting_time = QtCore.QDateTime(
+                self.start_calendar.cal.selectedDate()).toPyDateTime()
+            ending_time = QtCore.QDateTime(
+                self.ending_calendar.cal.selectedDate()).toPyDateTime()
+            request = (self.select_offering_comboBox.currentText(), 
+                       [self.select_prop_comboBox.currentText()], 
+                       starting_time, ending_time)
+            self.export_path = path
+            self.retrieval_started = time.time()
+            if self.usePrefetch(request, self.exportPrefetchFinished, 
+                                self.exportPrefetchedSeries):
+                return
             # Reset GetObservation response attribute.
             self.getobs_response = ''
-            self.getTimeSeries()
+            # Write it to the export file while it is being retrieved.
+            self.exportObservations(path)
+            return
         
         # Get path for export from QFileDialog.
-        path = QtGui.QFileDialog.getSaveFileName(
-                self, 'Export Time Series', self.offering + ".csv", '*.csv')
-        exportSeries(
-                self.dates, self.values, self.observedproperty, self.unit, path)
+        path = self.getExportPath(self.series.offering)
+        if path:
+            exportSeries(self.series, path)
+        
+        
+    def getExportFolder(self):
+        """
+        Ask the user for an export folder and format, for batch mode. 
+        Return False if the user has cancelled.
+        """
+        
+        formats = getExportFormats()
+        if len(formats) > 1:
+            name, ok = QtGui.QInputDialog.getItem(
+                    self, 'Export Time Series', 'Export format:', 
+                    [f for _, f in formats], 0, False)
+            if not ok:
+                return False
+            self.export_extension = [e for e, f in formats if f == name][0]
+        else:
+            self.export_extension = formats[0][0]
+        folder = QtGui.QFileDialog.getExistingDirectory(
+                self, 'Export Time Series')
+        if not folder:
+            return False
+        self.export_path = folder
+        return True
+        
+        
+    def getExportPath(self, name):
+        """
+        Ask the user for an export file path, among the available export 
+        formats (see writers.getExportFormats).
+        """
+        
+        formats = getExportFormats()
+        path, selected_filter = QtGui.QFileDialog.getSaveFileNameAndFilter(
+                self, 'Export Time Series', name + ".csv", 
+                ';;'.join(f for _, f in formats))
+        if path and not os.path.splitext(path)[1]:
+            # Add the extension of the selected format.
+            for extension, f in formats:
+                if f == selected_filter:
+                    path += extension
+        return path
+        
+        
+    def exportObservationsFinished(self, result):
+        
+        if self.sender() is not self.retrieval_worker:
+            return
+        monitor = self.retrieval_worker.monitor
+        self.showRetrievalPath(monitor)
+        self.retrieval_worker = None
+        self.cancel_pushButton.hide()
+        
+        rows, self.getobs_response = result
+        self.reportExport(rows, monitor.bytes_received)
+        
+        
+    def exportPrefetchFinished(self, result):
+        
+        if self.sender() is not self.retrieval_worker:
+            return
+        monitor = self.retrieval_worker.monitor
+        self.retrieval_worker = None
+        self.cancel_pushButton.hide()
+        self.exportPrefetchedSeries(result, monitor)
+        
+        
+    def exportPrefetchedSeries(self, result, monitor):
+        """
+        Write the time series retrieved in the background (see 
+        prefetchSeries) to the export file, as exportObservations would 
+        have done. The time series is not kept as the retrieved one.
+        """
+        
+        self.showRetrievalPath(monitor)
+        series, self.getobs_response = result
+        writer = getSeriesWriter(self.export_path, series, 
+                                 readSetting('export_compression'))
+        try:
+            writer.write(series)
+        finally:
+            writer.close()
+        # The response has been received before: the throughput is the 
+        # one of the written file.
+        self.reportExport(writer.rows, os.path.getsize(self.export_path))
+        
+        
+    def reportExport(self, rows, size):
+        """
+        Show the number of rows exported to export_path and the export 
+        throughput, given the size (bytes) of the data transferred since 
+        retrieval_started, and warn user if no row was exported.
+        """
+        
+        elapsed = max(time.time() - self.retrieval_started, 1e-3)
+        self.statusBar.showMessage(
+                '%d rows exported to %s in %.1f s (%d rows/s, %.2f MB/s)' 
+                % (rows, self.export_path, elapsed, rows / elapsed, 
+                   size / 1e6 / elapsed)
+            )
+        if rows == 0:
+            QtGui.QMessageBox.warning(
+                    self, "Empty time series warning", 
+                    "No observation was retrieved for this time period. "
+                    "Only the header row has been exported."
+                )
         
- 
\ No newline at end of file
+ 
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+import traceback
+from PyQt4 import QtCore
+
+from qgis.core import QgsMessageLog
+
+from ..features import toPlotDates
+from ..retrieval import RetrievalCancelled, RetrievalMonitor
+
+
+
+class RetrievalWorker(QtCore.QObject):
+    """
+    Run a time series retrieval function - such as sos.getSeriesSOS200 -
+    in a background thread, so that QGIS is not frozen while the
+    GetObservation response is downloaded and parsed.
+
+    The function is given a retrieval.RetrievalMonitor object as 'monitor'
+    keyword argument, which is used to report progress and to cancel the
+    retrieval. Results are delivered through signals, in the GUI thread.
+
+    arguments:
+        >>> function:
+            time series retrieval function.
+        >>> *args, **kwargs:
+            function arguments.
+
+    """
+
+    # Number of bytes received, number of observations parsed and number 
+    # of decoded bytes so far.
+    progress = QtCore.pyqtSignal(object, object, object)
+    # Value returned by the retrieval function.
+    finished = QtCore.pyqtSignal(object)
+    # Exception raised by the retrieval function, and its traceback.
+    failed = QtCore.pyqtSignal(object, object)
+    cancelled = QtCore.pyqtSignal()
+
+    # Workers which have been started, kept here so that they are not
+    # garbage collected before their thread ends, even once cancelled.
+    # Workers whose thread has ended are dropped when a new one starts.
+    running = set()
+
+    def __init__(self, function, *args, **kwargs):
+        super(RetrievalWorker, self).__init__()
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.monitor = RetrievalMonitor(self.progress.emit)
+        self.kwargs['monitor'] = self.monitor
+        self.thread = None
+
+    def start(self, priority=QtCore.QThread.InheritPriority):
+        """
+        Run the retrieval function in a new thread, with a QThread
+        priority.
+        """
+
+        self.thread = QtCore.QThread()
+        self.moveToThread(self.thread)
+        self.thread.started.connect(self.run)
+        self.finished.connect(self.thread.quit)
+        self.failed.connect(self.thread.quit)
+        self.cancelled.connect(self.thread.quit)
+        for worker in list(RetrievalWorker.running):
+            if worker.thread.isFinished():
+                RetrievalWorker.running.discard(worker)
+        RetrievalWorker.running.add(self)
+        self.thread.start(priority)
+
+    def run(self):
+        try:
+            result = self.function(*self.args, **self.kwargs)
+        except RetrievalCancelled:
+            self.cancelled.emit()
+            return
+        except Exception as e:
+            if self.monitor.isCancelled():
+                self.cancelled.emit()
+            else:
+                self.failed.emit(e, traceback.format_exc())
+            return
+
+        if self.monitor.isCancelled():
+            self.cancelled.emit()
+        else:
+            self.finished.emit(result)
+
+    def cancel(self):
+        """
+        Ask the retrieval to stop. It stops as soon as new data are
+        received, and cancelled signal is then emitted.
+        """
+        self.monitor.cancel()
+
+
+
+class SeriesFollower(QtCore.QObject):
+    """
+    Follow mode of a plotted time series: new observations are retrieved
+    at a regular interval in a background thread, from the time of the
+    last observation received (see sos.followSeriesSOS200), and appended
+    to the time series and to its curve, which is drawn again on its own
+    (see gui.PlotSeriesWindow.appendToCurve).
+
+    Following starts and stops with the follow button of the plot window,
+    and stops when the window is closed.
+
+    arguments:
+        >>> plot_window:
+            gui.PlotSeriesWindow object, whose first curve is the time
+            series.
+        >>> series:
+            timeseries.TimeSeries object, extended in place.
+        >>> function:
+            retrieval function taking the time of the last observation
+            (datetime object) as only positional argument, such as
+            sos.followSeriesSOS200 with its other arguments given.
+        >>> interval:
+            time (seconds) between two retrievals.
+
+    """
+
+    def __init__(self, plot_window, series, function, interval):
+        super(SeriesFollower, self).__init__(plot_window)
+        self.plot_window = plot_window
+        self.series = series
+        self.function = function
+        self.worker = None
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(int(max(interval, 1) * 1000))
+        self.timer.timeout.connect(self.poll)
+        plot_window.follow_pushButton.toggled.connect(self.setFollowing)
+        plot_window.finished.connect(self.stop)
+        plot_window.follow_pushButton.show()
+
+    def setFollowing(self, following):
+        if following:
+            self.plot_window.followCurve(0)
+            self.timer.start()
+            self.poll()
+        else:
+            self.stop()
+            self.plot_window.followCurve(0, following=False)
+
+    def stop(self, *args):
+        self.timer.stop()
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+
+    def poll(self):
+        # A slow server is not asked again before it has answered.
+        if self.worker is not None or self.series.isEmpty():
+            return
+        self.worker = RetrievalWorker(self.function,
+                                      self.series.times[-1].astype(object))
+        self.worker.finished.connect(self.pollFinished)
+        self.worker.failed.connect(self.pollFailed)
+        self.worker.start()
+
+    def pollFinished(self, result):
+        if self.sender() is not self.worker:
+            return
+        self.worker = None
+        series = result[0]
+        if series.isEmpty():
+            return
+        self.series.extend(series)
+        self.plot_window.appendToCurve(0, toPlotDates(series.times),
+                                       series.values)
+
+    def pollFailed(self, error, error_traceback):
+        # Following goes on, as the server may answer next time.
+        if self.sender() is not self.worker:
+            return
+        self.worker = None
+        QgsMessageLog.logMessage(
+            'Failed to retrieve new observations\n' + error_traceback,
+            'SOS Client')
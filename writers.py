@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+# =============================================================================
+# Copyright (c) ARMINES / MINES ParisTech
+# Created by Alexandre Barbusse <alexandre.barbusse@gmail.com>
+#
+# this file is available under the BSD 3-clause License
+# (https://opensource.org/licenses/BSD-3-Clause)
+# =============================================================================
+
+
+import csv
+import os
+import sys
+
+import numpy
+
+# Binary columnar formats depend on optional libraries, which may not be
+# installed along with QGIS: formats whose library is missing are simply
+# not offered (see getExportFormats).
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
+
+from timeseries import TimeSeries
+
+
+
+class SeriesWriter:
+    """
+    Base class of time series file writers.
+
+    A time series is written batch by batch (see write), so that it can be
+    written while it is being retrieved (see sos.exportSeriesSOS200). The
+    file is created when the first batch is written, as the unit of the
+    time series is only known then.
+
+    Subclasses write a file format by implementing:
+        >>> open(series):
+            create the file, given the first timeseries.TimeSeries batch,
+            possibly empty, or the template if no batch is written.
+        >>> writeBatch(series):
+            append the rows of a non-empty timeseries.TimeSeries batch.
+        >>> finish():
+            complete and close the file.
+
+    arguments:
+        >>> path:
+            complete path (folder + file name) of the file (unicode).
+        >>> template:
+            timeseries.TimeSeries object giving the metadata written if no
+            batch is written, or None.
+        >>> compression:
+            if True, data are compressed, if the format allows it.
+
+    """
+
+    def __init__(self, path, template=None, compression=True):
+        self.path = path
+        self.template = template if template is not None else TimeSeries()
+        self.compression = compression
+        self.rows = 0
+        self.opened = False
+
+    def write(self, series):
+        """Write the rows of a timeseries.TimeSeries batch."""
+
+        if not self.opened:
+            self.open(series)
+            self.opened = True
+        if len(series):
+            self.writeBatch(series)
+        self.rows += len(series)
+
+    def close(self):
+        if not self.opened:
+            self.open(self.template)
+            self.opened = True
+        self.finish()
+
+    def getMetadata(self, series):
+        """Return the metadata stored in the file, as a dict of strings."""
+        return {'unit': series.unit,
+                'offering': series.offering,
+                'observed_property': series.observed_property}
+
+
+
+class CsvSeriesWriter(SeriesWriter):
+    """
+    Write a time series to a CSV file, with a "Date" column and a value
+    column named after the observed property and its unit. Compression
+    does not apply.
+    """
+
+    def open(self, series):
+        # The csv module writes bytes with Python 2, and text with Python 3.
+        if sys.version_info[0] < 3:
+            self.file = open(self.path, 'wb')
+        else:
+            self.file = open(self.path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(["Date", series.getLabel()])
+
+    def writeBatch(self, series):
+        self.writer.writerows(zip(series.formatTimes().tolist(),
+                                  series.values.tolist()))
+
+    def finish(self):
+        self.file.close()
+
+
+
+class ArrowTableWriter(SeriesWriter):
+    """
+    Base class of the writers of Apache Arrow based formats: a "time" UTC
+    timestamp column (milliseconds) and a "value" float64 column, with
+    time series metadata stored in the schema metadata.
+    """
+
+    def getSchema(self, series):
+        metadata = dict((key, value.encode('utf-8')) for key, value
+                        in self.getMetadata(series).items())
+        return pyarrow.schema([
+            pyarrow.field('time', pyarrow.timestamp('ms', tz='UTC')),
+            pyarrow.field('value', pyarrow.float64())], metadata=metadata)
+
+    def getTable(self, series):
+        # Arrays are handed over as they are, without any conversion.
+        return pyarrow.Table.from_arrays(
+            [pyarrow.array(series.times.astype(numpy.int64),
+                           type=self.schema.field('time').type),
+             pyarrow.array(series.values, type=pyarrow.float64())],
+            schema=self.schema)
+
+
+
+class ParquetSeriesWriter(ArrowTableWriter):
+    """
+    Write a time series to an Apache Parquet file, Snappy compressed by
+    default. Each batch is written as a row group.
+    """
+
+    def open(self, series):
+        self.schema = self.getSchema(series)
+        self.writer = pyarrow.parquet.ParquetWriter(
+            self.path, self.schema,
+            compression='snappy' if self.compression else 'none')
+
+    def writeBatch(self, series):
+        self.writer.write_table(self.getTable(series))
+
+    def finish(self):
+        self.writer.close()
+
+
+
+class ArrowSeriesWriter(ArrowTableWriter):
+    """
+    Write a time series to an Apache Arrow IPC (Feather version 2) file,
+    LZ4 compressed by default when the installed pyarrow version allows
+    it. Each batch is written as a record batch.
+    """
+
+    def open(self, series):
+        self.schema = self.getSchema(series)
+        self.sink = pyarrow.OSFile(self.path, 'wb')
+        options = {}
+        if self.compression and hasattr(pyarrow.ipc, 'IpcWriteOptions'):
+            options['options'] = pyarrow.ipc.IpcWriteOptions(
+                compression='lz4')
+        self.writer = pyarrow.ipc.new_file(self.sink, self.schema, **options)
+
+    def writeBatch(self, series):
+        for batch in self.getTable(series).to_batches():
+            self.writer.write_batch(batch)
+
+    def finish(self):
+        self.writer.close()
+        self.sink.close()
+
+
+
+class NetCDFSeriesWriter(SeriesWriter):
+    """
+    Write a time series to a NetCDF-4 file, zlib compressed by default: a
+    "time" int64 variable (milliseconds since epoch, UTC) along an
+    unlimited dimension and a "value" float64 variable, with CF-style units
+    and time series metadata as attributes.
+    """
+
+    def open(self, series):
+        self.dataset = netCDF4.Dataset(self.path, 'w', format='NETCDF4')
+        metadata = self.getMetadata(series)
+        self.dataset.setncatts({'offering': metadata['offering'],
+                                'observed_property':
+                                    metadata['observed_property']})
+        self.dataset.createDimension('time', None)
+        self.time = self.dataset.createVariable(
+            'time', 'i8', ('time',), zlib=self.compression)
+        self.time.units = 'milliseconds since 1970-01-01 00:00:00 UTC'
+        self.time.calendar = 'standard'
+        self.value = self.dataset.createVariable(
+            'value', 'f8', ('time',), zlib=self.compression,
+            fill_value=numpy.nan)
+        self.value.units = metadata['unit']
+        self.value.long_name = metadata['observed_property']
+
+    def writeBatch(self, series):
+        start = len(self.time)
+        stop = start + len(series)
+        self.time[start:stop] = series.times.astype(numpy.int64)
+        self.value[start:stop] = series.values
+
+    def finish(self):
+        self.dataset.close()
+
+
+
+# Export formats: file name filter and writer class, by file extension.
+EXPORT_FORMATS = [
+    ('.csv', 'CSV (*.csv)', CsvSeriesWriter, True),
+    ('.parquet', 'Apache Parquet (*.parquet)', ParquetSeriesWriter,
+     pyarrow is not None),
+    ('.arrow', 'Apache Arrow (*.arrow)', ArrowSeriesWriter,
+     pyarrow is not None),
+    ('.nc', 'NetCDF-4 (*.nc)', NetCDFSeriesWriter, netCDF4 is not None),
+]
+
+
+
+def getExportFormats():
+    """
+    Return the (extension, file name filter) pairs of the export formats
+    whose library is installed.
+    """
+    return [(extension, name) for extension, name, _, available
+            in EXPORT_FORMATS if available]
+
+
+
+def getSeriesWriter(path, template=None, compression=True):
+    """
+    Return the time series writer matching a file extension, or a CSV
+    writer for unknown extensions.
+
+    arguments:
+        >>> path:
+            complete path (folder + file name) of the file (unicode).
+        >>> template, compression:
+            see SeriesWriter.
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+    for format_extension, _, writer_class, available in EXPORT_FORMATS:
+        if format_extension == extension and available:
+            return writer_class(path, template, compression)
+
+    return CsvSeriesWriter(path, template, compression)